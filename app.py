@@ -1,6 +1,8 @@
 import os
 import logging
+import multiprocessing
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 
@@ -16,6 +18,11 @@ db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
+# Behind reverse proxies, take the client address from that many X-Forwarded-For hops
+trusted_proxies = int(os.environ.get("TRUSTED_PROXIES", 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///downloads.db")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -29,10 +36,23 @@ db.init_app(app)
 # Create downloads directory
 os.makedirs('downloads', exist_ok=True)
 
-with app.app_context():
-    # Import models and routes
-    import models
-    import routes
-    
-    # Create all tables
-    db.create_all()
+# Post-processing children are spawned, and import the main module (hence this one)
+# again before they know their parent; named after their pool from the start, they
+# only run yt-dlp, so they skip the bootstrap and never start a queue
+if multiprocessing.current_process().name == 'MainProcess':
+    with app.app_context():
+        # Import models and routes
+        import models
+        import routes
+
+        # Create all tables, then add anything newer to existing ones
+        db.create_all()
+        models.upgrade_schema()
+        # Playlists from before their counters were kept are counted once
+        from playlist_progress import playlist_progress
+        playlist_progress.reconcile()
+
+        # Web processes download too unless RUN_WORKERS=0 (then run worker.py separately)
+        if os.environ.get('RUN_WORKERS', '1') == '1':
+            routes.download_queue.start_worker()
+
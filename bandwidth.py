@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+from yt_dlp.utils import parse_bytes
+
+# Seconds of traffic a bucket may save up and spend at once
+BURST_SECONDS = float(os.environ.get('BANDWIDTH_BURST_SECONDS', 1.0))
+MIN_RATE = 1024
+
+def parse_rate(value):
+    """Validate a rate in bytes/s: an integer, or a string such as '500K' or '2M'
+
+    Returns None (unlimited) for empty values and 0.
+    """
+    if value in (None, '', 0, '0'):
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('rate must be bytes per second, e.g. 1048576 or "1M"')
+    rate = value if isinstance(value, int) else parse_bytes(value.strip())
+    if rate is None:
+        raise ValueError('rate must be bytes per second, e.g. 1048576 or "1M"')
+    if rate < MIN_RATE:
+        raise ValueError(f'rate must be at least {MIN_RATE} bytes per second')
+    return rate
+
+class TokenBucket:
+    """Thread-safe token bucket; a rate of None lets everything through
+
+    Consumers take what they used and may go into debt, then sleep until
+    the debt is paid off, so a block is never split or held back.
+    """
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate or None
+            self.capacity = (rate or 0) * BURST_SECONDS
+            self.tokens = min(self.tokens, self.capacity)
+
+    def take(self, amount):
+        """Take amount tokens; returns the seconds to wait before using more"""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class BandwidthShaper:
+    """Global and per-download bandwidth caps for the downloads of a process
+
+    Every block a download reads is taken from its own bucket (its
+    rate_limit) and from the global bucket all workers share; the reader
+    then sleeps off whichever is further in debt. The global rate is this
+    process' share of the configured limit (see DownloadQueue).
+    """
+
+    def __init__(self, rate=None):
+        self.global_bucket = TokenBucket(rate)
+        self.lock = threading.Lock()
+        self.downloads = {}
+        self.throttled_seconds = 0.0
+
+    @property
+    def global_rate(self):
+        return self.global_bucket.rate
+
+    def set_global_rate(self, rate):
+        self.global_bucket.set_rate(rate)
+
+    def register(self, download_id, rate=None):
+        """Start shaping a download; returns its throttle(nbytes) function"""
+        with self.lock:
+            self.downloads[download_id] = TokenBucket(rate)
+        return lambda amount: self.throttle(download_id, amount)
+
+    def unregister(self, download_id):
+        with self.lock:
+            self.downloads.pop(download_id, None)
+
+    def throttle(self, download_id, amount):
+        """Account for amount bytes read by a download, sleeping as needed"""
+        if amount <= 0:
+            return
+        bucket = self.downloads.get(download_id)
+        wait = max(bucket.take(amount) if bucket else 0.0, self.global_bucket.take(amount))
+        if wait > 0:
+            with self.lock:
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def effective_rate(self, download_id):
+        """Rate a running download is held to: its cap or its share of the global rate"""
+        with self.lock:
+            bucket = self.downloads.get(download_id)
+            if bucket is None:
+                return None
+            rates = [bucket.rate]
+            if self.global_rate:
+                rates.append(self.global_rate / len(self.downloads))
+        rates = [rate for rate in rates if rate]
+        return int(min(rates)) if rates else None
+
+    def stats(self):
+        with self.lock:
+            download_ids = list(self.downloads)
+            throttled_seconds = self.throttled_seconds
+        return {
+            'global_rate': self.global_rate,
+            'downloads': {download_id: self.effective_rate(download_id) for download_id in download_ids},
+            'throttled_seconds': round(throttled_seconds, 3),
+        }
+
+bandwidth = BandwidthShaper()
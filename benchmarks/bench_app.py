@@ -0,0 +1,299 @@
+"""End-to-end benchmarks of the download pipeline, offline
+
+Runs the app (queue workers, ingestion, API) against a local
+media_server.py, with yt-dlp extracting through the recorded info dicts of
+yt_dlp_plugins/extractor/bench_fixtures.py. Each scenario runs in a fresh
+process, in a throwaway directory with its own SQLite database, and reports:
+
+  throughput    downloads and bytes per second, from adding them until all finished
+  api latency   p50/p99 of GET /api/downloads from polling clients (in-process WSGI calls)
+  queries       SQL statements per download (clients' requests counted apart)
+  progress      progress hook samples and the database writes they caused, per second
+  peak rss      of the process running the app, its workers and the clients
+
+Scenarios:
+  single-4k     one 4K video
+  playlist      a 500 video playlist, small files: per-download overhead
+  polling       a few throttled downloads while 50 clients poll /api/downloads
+  progress      throttled downloads, to compare hook samples with database writes
+
+Synthetic media can't be merged or transcoded, so scenarios pick single-file
+formats; post-processing isn't covered. App settings (DOWNLOAD_WORKERS,
+PLATFORM_CONCURRENCY, PROGRESS_FLUSH_INTERVAL, ...) come from the environment
+as usual; BENCH_DATABASE_URL points the runs at another, empty, database.
+
+Usage: python benchmarks/bench_app.py [scenario ...] [--count N] [--size BYTES]
+       [--clients N] [--latency S] [--bandwidth RATE] [--protocol http|hls|dash] [--json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# Formats with audio and video in one file, or video alone (HLS has no muxed formats)
+SINGLE_FILE = 'best[vcodec!=none][acodec!=none]/bestvideo'
+
+SCENARIOS = {
+    'single-4k': {'playlist': False, 'count': 1, 'size': '128M', 'format': 'bestvideo[height>=2160]',
+                  'clients': 1, 'bandwidth': '0'},
+    'playlist': {'playlist': True, 'count': 500, 'size': '256K', 'format': SINGLE_FILE,
+                 'clients': 1, 'bandwidth': '0'},
+    'polling': {'playlist': False, 'count': 6, 'size': '32M', 'format': SINGLE_FILE,
+                'clients': 50, 'bandwidth': '2M'},
+    'progress': {'playlist': False, 'count': 2, 'size': '32M', 'format': SINGLE_FILE,
+                 'clients': 0, 'bandwidth': '1M'},
+}
+FIXTURE = 'youtube_4k'
+POLL_INTERVAL = 1.0
+
+# Which statements a thread's queries are counted under: the polling
+# clients' and the harness' own apart from the download pipeline's
+_local = threading.local()
+
+class QueryCounter:
+    """Counts SQL statements by bucket and kind (SELECT, UPDATE, ...)"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, connection, cursor, statement, parameters, context, executemany):
+        kind = statement.lstrip().split(None, 1)[0].upper()
+        with self.lock:
+            self.counts[getattr(_local, 'bucket', 'pipeline'), kind] += 1
+
+    def bucket(self, name):
+        with self.lock:
+            return {kind: count for (bucket, kind), count in self.counts.items() if bucket == name}
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(round(percent / 100 * (len(values) - 1)), len(values) - 1)]
+
+def poll(app, latencies, stop):
+    """A client polling /api/downloads every POLL_INTERVAL seconds, like the UI"""
+    _local.bucket = 'api'
+    client = app.test_client()
+    stop.wait(random.uniform(0, POLL_INTERVAL))
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.get('/api/downloads')
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            logging.warning(f"GET /api/downloads returned {response.status_code}")
+        stop.wait(POLL_INTERVAL)
+
+def wait_finished(expected, timeout):
+    """Wait until expected downloads completed or failed; returns the counts by status"""
+    from sqlalchemy import func
+    from app import db
+    from models import Download
+
+    _local.bucket = 'harness'
+    deadline = time.monotonic() + timeout
+    while True:
+        counts = {status.value: count for status, count in
+                  db.session.query(Download.status, func.count(Download.id)).group_by(Download.status)}
+        db.session.commit()
+        if counts.get('completed', 0) + counts.get('failed', 0) >= expected or time.monotonic() > deadline:
+            _local.bucket = 'pipeline'
+            return counts
+        time.sleep(0.2)
+
+def run(name, settings, timeout):
+    """Run one scenario in this process; the working directory is its sandbox"""
+    os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL') or f'sqlite:///{os.getcwd()}/bench.db'
+    os.environ['RUN_WORKERS'] = '0'
+    sys.path[:0] = [ROOT, BENCH_DIR]
+
+    from yt_dlp.utils import parse_bytes
+    from sqlalchemy import func
+    from media_server import MediaServer
+    from app import app, db
+    from models import Download, DownloadStatus
+    from routes import download_queue
+    from progress import progress_store
+    logging.getLogger().setLevel(logging.WARNING)
+    rss_after_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    server = MediaServer(latency=settings['latency'], bandwidth=parse_bytes(settings['bandwidth']) or 0).start()
+    query = f"size={parse_bytes(settings['size'])}" + (f"&protocol={settings['protocol']}" if settings['protocol'] else '')
+    if settings['playlist']:
+        urls = [f"{server.url}/playlist/{FIXTURE}/{settings['count']}?{query}"]
+    else:
+        urls = [f"{server.url}/watch/{FIXTURE}/{name}-{index:05d}?{query}" for index in range(settings['count'])]
+
+    with app.app_context():
+        queries = QueryCounter(db.engine)
+        latencies = []
+        stop = threading.Event()
+        clients = [threading.Thread(target=poll, args=(app, latencies, stop), name=f'bench-client-{index}', daemon=True)
+                   for index in range(settings['clients'])]
+        download_queue.start_worker()
+        for client in clients:
+            client.start()
+
+        started = time.monotonic()
+        progress_before = progress_store.stats()
+        adder = app.test_client()
+        for url in urls:
+            response = adder.post('/api/add_download', json={'url': url, 'format_id': settings['format']})
+            if response.status_code >= 400:
+                raise RuntimeError(f"Adding {url} failed: {response.get_json()}")
+        counts = wait_finished(settings['count'], timeout)
+        seconds = time.monotonic() - started
+        progress_after = progress_store.stats()
+
+        stop.set()
+        for client in clients:
+            client.join()
+        download_queue.stop_worker()
+        server.stop()
+
+        _local.bucket = 'harness'
+        downloaded = db.session.query(func.coalesce(func.sum(Download.file_size), 0)).filter(
+            Download.status == DownloadStatus.COMPLETED).scalar()
+        errors = [error for (error,) in db.session.query(Download.error_message).filter(
+            Download.status == DownloadStatus.FAILED).limit(3)]
+
+    finished = counts.get('completed', 0) + counts.get('failed', 0)
+    pipeline = queries.bucket('pipeline')
+    api = queries.bucket('api')
+    hook_updates = progress_after['updates'] - progress_before['updates']
+    flushes = progress_after['commits'] - progress_before['commits']
+    writes = sum(count for kind, count in pipeline.items() if kind in ('INSERT', 'UPDATE', 'DELETE'))
+    return {
+        'scenario': name,
+        'settings': settings,
+        'downloads': counts,
+        'errors': errors,
+        'timed_out': finished < settings['count'],
+        'seconds': round(seconds, 3),
+        'downloads_per_s': round(counts.get('completed', 0) / seconds, 3),
+        'bytes': downloaded,
+        'bytes_per_s': round(downloaded / seconds),
+        'api': {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'queries_per_request': round(sum(api.values()) / len(latencies), 2) if latencies else None,
+        },
+        'queries': {
+            'total': sum(pipeline.values()),
+            'per_download': round(sum(pipeline.values()) / max(finished, 1), 1),
+            'by_kind': pipeline,
+        },
+        'progress': {
+            'hook_updates': hook_updates,
+            'hook_updates_per_s': round(hook_updates / seconds, 1),
+            'flushes_per_s': round(flushes / seconds, 2),
+            'db_writes_per_s': round(writes / seconds, 2),
+        },
+        'rss': {
+            'after_import': rss_after_import,
+            'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        },
+    }
+
+def spawn(name, settings, args):
+    """Run a scenario in a child process and sandbox; returns its results"""
+    workdir = tempfile.mkdtemp(prefix=f'mediatab-bench-{name}-')
+    result_path = os.path.join(workdir, 'result.json')
+    log_path = os.path.join(workdir, 'bench.log')
+    try:
+        with open(log_path, 'w') as log:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', name, '--settings', json.dumps(settings),
+                 '--result', result_path, '--timeout', str(args.timeout)],
+                cwd=workdir, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL
+            )
+        if process.returncode or not os.path.exists(result_path):
+            with open(log_path) as log:
+                tail = log.read()[-2000:]
+            raise RuntimeError(f"Scenario {name} exited with {process.returncode}:\n{tail}")
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def report(result):
+    from yt_dlp.utils import format_bytes
+
+    counts = result['downloads']
+    api = result['api']
+    queries = result['queries']
+    progress = result['progress']
+    print(f"{result['scenario']}: {counts.get('completed', 0)} completed, {counts.get('failed', 0)} failed "
+          f"in {result['seconds']:.2f}s{' (timed out)' if result['timed_out'] else ''}")
+    print(f"  throughput   {result['downloads_per_s']:.2f} downloads/s, {format_bytes(result['bytes_per_s'])}/s")
+    if api['requests']:
+        print(f"  api          p50 {api['p50_ms']:.1f} ms, p99 {api['p99_ms']:.1f} ms over {api['requests']} requests, "
+              f"{api['queries_per_request']} queries/request")
+    by_kind = ', '.join(f'{kind.lower()} {count}' for kind, count in sorted(queries['by_kind'].items()))
+    print(f"  queries      {queries['per_download']} per download ({by_kind})")
+    print(f"  progress     {progress['hook_updates_per_s']} hook samples/s -> {progress['flushes_per_s']} flushes/s, "
+          f"{progress['db_writes_per_s']} db writes/s")
+    print(f"  peak rss     {format_bytes(result['rss']['peak'])} ({format_bytes(result['rss']['after_import'])} after import)")
+    for error in result['errors']:
+        print(f"  error        {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f"{', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--count', type=int, help='videos (playlist entries for playlist)')
+    parser.add_argument('--size', help='bytes per video, e.g. 64M')
+    parser.add_argument('--clients', type=int, help='clients polling /api/downloads')
+    parser.add_argument('--latency', type=float, default=0.02, help='media server seconds before each response')
+    parser.add_argument('--bandwidth', help='media server bytes/s per connection (0: unlimited)')
+    parser.add_argument('--protocol', choices=('http', 'hls', 'dash'), help='transport of the formats')
+    parser.add_argument('--timeout', type=float, default=900, help='seconds to wait for a scenario')
+    parser.add_argument('--keep', action='store_true', help='keep the scenario directories')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--settings', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.run:
+        result = run(args.run, json.loads(args.settings), args.timeout)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+        # Workers of timed out runs may still hold threads
+        os._exit(0)
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        settings = dict(SCENARIOS[name], latency=args.latency, protocol=args.protocol)
+        settings.update({option: getattr(args, option) for option in ('count', 'size', 'clients', 'bandwidth')
+                         if getattr(args, option) is not None})
+        result = spawn(name, settings, args)
+        results.append(result)
+        if not args.json:
+            report(result)
+    if args.json:
+        print(json.dumps(results, indent=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Micro-benchmark for the extract_info format-table builder
+
+Compares the original per-format if/elif loop with formats.normalize_formats
+over the info dicts in benchmarks/fixtures, checks both produce the same
+table, and times a full render and the UI's fields= projection: on a fresh
+extraction, and per request once the rows are cached.
+
+Usage: python benchmarks/bench_formats.py [--repeat N] [--scale N]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formats import normalize_formats, render_formats, FORMAT_FIELDS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+UI_FIELDS = ('format_id', 'ext', 'quality', 'filesize', 'height')
+
+def legacy_formats(info):
+    """The format loop as it was in VideoDownloader.extract_info"""
+    formats = []
+    seen_formats = set()
+    for fmt in info['formats']:
+        if fmt and (fmt.get('vcodec') != 'none' or fmt.get('acodec') != 'none'):
+            height = fmt.get('height')
+            ext = fmt.get('ext', 'unknown')
+            vcodec = fmt.get('vcodec', 'none')
+            acodec = fmt.get('acodec', 'none')
+            quality_label = fmt.get('format_note', '')
+            if height:
+                if height >= 2160:
+                    quality_display = f"4K ({height}p)"
+                elif height >= 1440:
+                    quality_display = f"2K ({height}p)"
+                elif height >= 1080:
+                    quality_display = f"Full HD ({height}p)"
+                elif height >= 720:
+                    quality_display = f"HD ({height}p)"
+                else:
+                    quality_display = f"{height}p"
+            else:
+                if acodec != 'none' and vcodec == 'none':
+                    tbr = fmt.get('tbr') or 0
+                    if tbr >= 320:
+                        quality_display = 'High Quality Audio (320+ kbps)'
+                    elif tbr >= 256:
+                        quality_display = 'Premium Audio (256 kbps)'
+                    elif tbr >= 192:
+                        quality_display = 'Standard Audio (192 kbps)'
+                    elif tbr >= 128:
+                        quality_display = 'Good Audio (128 kbps)'
+                    else:
+                        quality_display = 'Audio Only'
+                else:
+                    quality_display = quality_label or 'Unknown Quality'
+            if vcodec != 'none' and acodec != 'none':
+                codec_info = f" ({vcodec}+{acodec})"
+            elif vcodec != 'none':
+                codec_info = f" (video: {vcodec})"
+            elif acodec != 'none':
+                codec_info = f" (audio: {acodec})"
+            else:
+                codec_info = ""
+            format_key = f"{height}_{ext}_{vcodec}_{acodec}"
+            if format_key not in seen_formats:
+                seen_formats.add(format_key)
+                formats.append({
+                    'format_id': fmt.get('format_id'),
+                    'ext': ext,
+                    'quality': quality_display + codec_info,
+                    'quality_sort': height or 0,
+                    'filesize': fmt.get('filesize'),
+                    'vcodec': vcodec,
+                    'acodec': acodec,
+                    'height': height,
+                    'width': fmt.get('width'),
+                    'fps': fmt.get('fps'),
+                    'tbr': fmt.get('tbr'),
+                    'is_audio_only': vcodec == 'none' and acodec != 'none'
+                })
+    formats.sort(key=lambda x: (x.get('is_audio_only', False), -x.get('quality_sort', 0)))
+    return formats
+
+def scaled(info, scale):
+    """Repeat the format list with distinct codecs to mimic extractors returning hundreds"""
+    formats = []
+    for copy in range(scale):
+        for fmt in info['formats']:
+            fmt = dict(fmt)
+            if copy and fmt.get('vcodec') not in (None, 'none'):
+                fmt['vcodec'] = f"{fmt['vcodec']}.{copy}"
+            formats.append(fmt)
+    return dict(info, formats=formats)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--scale', type=int, default=8)
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.json'))):
+        with open(path) as f:
+            info = scaled(json.load(f), args.scale)
+
+        new = render_formats(normalize_formats(info['formats']), FORMAT_FIELDS)
+        assert new == legacy_formats(info), f"{path}: format tables differ"
+
+        # What a request pays when the extraction is served from MetadataCache
+        rows = json.loads(json.dumps(normalize_formats(info['formats'])))
+
+        timings = {
+            'legacy': lambda: legacy_formats(info),
+            'normalize+render all': lambda: render_formats(normalize_formats(info['formats'])),
+            'normalize+render ui': lambda: render_formats(normalize_formats(info['formats']), UI_FIELDS),
+            'cached render all': lambda: render_formats(rows),
+            'cached render ui': lambda: render_formats(rows, UI_FIELDS),
+        }
+        print(f"{os.path.basename(path)}: {len(info['formats'])} formats -> {len(new)} rows")
+        baseline = None
+        for name, func in timings.items():
+            seconds = min(timeit.repeat(func, number=args.repeat, repeat=3)) / args.repeat
+            baseline = baseline or seconds
+            print(f"  {name:<22} {seconds * 1e6:9.1f} us/call  ({baseline / seconds:4.2f}x)")
+
+if __name__ == '__main__':
+    main()
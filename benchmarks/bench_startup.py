@@ -0,0 +1,113 @@
+"""Startup and per-call YoutubeDL costs of the app, offline
+
+Each measurement runs in a fresh process, in a throwaway directory with its
+own SQLite database, and reports the median of --repeat runs:
+
+  import yt_dlp     importing yt-dlp alone
+  first YoutubeDL   building the first YoutubeDL: plugins and every extractor
+  worker boot       importing main (app, routes, queue) as a gunicorn worker does
+  preloaded boot    the same with yt-dlp already loaded, as in workers forked from
+                    a master that ran the on_starting hook of gunicorn.conf.py
+  extract           per VideoDownloader._extract_info call on a recorded fixture
+                    (see yt_dlp_plugins/extractor/bench_fixtures.py), with pooled
+                    YoutubeDL instances and with YDL_POOL_SIZE=0 (one per call)
+
+Usage: python benchmarks/bench_startup.py [--repeat N] [--calls N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+MEASUREMENTS = {
+    'import': 'import yt_dlp',
+    'first-ydl': 'first YoutubeDL',
+    'boot': 'worker boot',
+    'preloaded-boot': 'preloaded boot',
+    'extract-pooled': 'extract, pooled',
+    'extract-fresh': 'extract, unpooled',
+}
+
+def measure(name, calls):
+    """Seconds taken by one measurement, in this process"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.getcwd()}/bench.db'
+    os.environ['RUN_WORKERS'] = '0'
+    os.environ['YDL_POOL_SIZE'] = '0' if name == 'extract-fresh' else os.environ.get('YDL_POOL_SIZE', '8')
+    sys.path[:0] = [ROOT, BENCH_DIR]
+
+    if name == 'boot':
+        started = time.perf_counter()
+        import main  # noqa: F401
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    import yt_dlp
+    if name == 'import':
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    yt_dlp.YoutubeDL({'quiet': True}).close()
+    if name == 'first-ydl':
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    import main  # noqa: F401
+    if name == 'preloaded-boot':
+        return time.perf_counter() - started
+
+    from downloader import VideoDownloader
+    downloader = VideoDownloader()
+    timings = []
+    for index in range(calls):
+        started = time.perf_counter()
+        downloader._extract_info(f'http://127.0.0.1/watch/youtube_4k/startup-{index:05d}')
+        timings.append(time.perf_counter() - started)
+    # The first call builds an instance either way
+    return statistics.median(timings[1:] or timings)
+
+def spawn(name, calls):
+    """Run a measurement in a child process and sandbox"""
+    workdir = tempfile.mkdtemp(prefix=f'mediatab-bench-{name}-')
+    try:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', name, '--calls', str(calls)],
+            cwd=workdir, capture_output=True, text=True, stdin=subprocess.DEVNULL
+        )
+        if process.returncode:
+            raise RuntimeError(f"Measurement {name} exited with {process.returncode}:\n{process.stderr[-2000:]}")
+        return float(process.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each measurement')
+    parser.add_argument('--calls', type=int, default=20, help='extractions per extract run')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(measure(args.run, args.calls))
+        # Queue and pool threads need not wind down
+        sys.stdout.flush()
+        os._exit(0)
+
+    results = {}
+    for name, label in MEASUREMENTS.items():
+        results[name] = round(statistics.median(spawn(name, args.calls) for _ in range(args.repeat)) * 1000, 1)
+        if not args.json:
+            print(f"{label:<18} {results[name]:>8.1f} ms{' per call' if name.startswith('extract') else ''}")
+    if args.json:
+        print(json.dumps({name: {'ms': ms} for name, ms in results.items()}, indent=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Local HTTP server of synthetic media for the benchmarks
+
+Serves deterministic bytes (seeded by the name) of any size, so nothing
+goes over the network:
+
+    /media/<name>?size=N                   a progressive file, with Range support
+    /hls/<name>.m3u8?size=N&segments=K     an HLS media playlist of K segments
+    /hls/<name>/<index>.ts?size=N          one of its segments
+
+Every response waits latency seconds before its headers, and bodies are
+sent at up to bandwidth bytes/s per connection (0: unlimited).
+
+Usage: python benchmarks/media_server.py [--port P] [--latency S] [--bandwidth RATE]
+"""
+import re
+import time
+import random
+import argparse
+import threading
+import functools
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from yt_dlp.utils import parse_bytes
+
+BLOCK_SIZE = 1 << 16
+SEGMENT_SECONDS = 6
+
+@functools.lru_cache(maxsize=4096)
+def _block(name):
+    # Distinct names get distinct bytes, so the result store doesn't dedupe them
+    return random.Random(name).randbytes(BLOCK_SIZE)
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        size = int(query.get('size', [BLOCK_SIZE])[0])
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if match := re.fullmatch(r'/hls/([^/]+)\.m3u8', url.path):
+            segments = max(int(query.get('segments', [1])[0]), 1)
+            body = self._playlist(match.group(1), size, segments).encode()
+            return self._respond(200, 'application/vnd.apple.mpegurl', body, head)
+        if not re.fullmatch(r'/(media|hls)/[^?]+', url.path):
+            return self._respond(404, 'text/plain', b'Not found\n', head)
+        self._send_file(url.path, size, head)
+
+    def _playlist(self, name, size, segments):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+        for index in range(segments):
+            segment_size = size // segments + (size % segments if index == segments - 1 else 0)
+            lines += [f'#EXTINF:{SEGMENT_SECONDS}.0,', f'{name}/{index}.ts?size={segment_size}']
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def _respond(self, status, content_type, body, head):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_file(self, path, size, head):
+        start, end = 0, size - 1
+        if match := re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '')):
+            if match.group(1):
+                start, end = int(match.group(1)), min(int(match.group(2) or end), end)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t' if path.endswith('.ts') else 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+
+        block = _block(path)
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        position = start
+        try:
+            while position <= end:
+                offset = position % BLOCK_SIZE
+                chunk = block[offset:offset + min(BLOCK_SIZE - offset, end - position + 1)]
+                self.wfile.write(chunk)
+                position += len(chunk)
+                if bandwidth:
+                    ahead = (position - start) / bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            # Paused or cancelled downloads hang up mid-body
+            self.close_connection = True
+
+class MediaServer(ThreadingHTTPServer):
+    """The media server, run in a background thread by start()"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=0):
+        super().__init__((host, port), MediaHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='media-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--bandwidth', default='0', help='bytes/s per connection, e.g. 10M (0: unlimited)')
+    args = parser.parse_args()
+
+    server = MediaServer(args.host, args.port, args.latency, parse_bytes(args.bandwidth) or 0)
+    print(f"Serving synthetic media on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
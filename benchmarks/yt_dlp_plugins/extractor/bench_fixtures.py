@@ -0,0 +1,92 @@
+"""Extractors replaying the recorded info dicts in benchmarks/fixtures
+
+yt-dlp loads them as plugins (ahead of its own extractors) once benchmarks/
+is on sys.path. URLs point at a benchmarks/media_server.py instance, which
+serves the formats:
+
+    <server>/watch/<fixture>/<video id>?size=N&protocol=P
+        <fixture>.json as the video <video id>, every format N bytes
+        (default 8 MiB). protocol keeps only progressive formats ('http'),
+        HLS video with progressive audio ('hls') or everything as DASH
+        segments ('dash'); all progressive and HLS formats by default.
+    <server>/playlist/<fixture>/<count>?size=N&protocol=P
+        a playlist of count such videos
+
+The recorded extractor and extractor_key are kept, so the app treats them as
+videos of the site they were recorded from (platform limits, fetch settings).
+"""
+import os
+import json
+import functools
+import urllib.parse
+from yt_dlp.extractor.common import InfoExtractor
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'fixtures')
+_HOST = r'https?://(?:127\.0\.0\.1|localhost)(?::\d+)?'
+
+DEFAULT_SIZE = 8 << 20
+# Size of HLS/DASH segments
+FRAGMENT_SIZE = 1 << 20
+
+@functools.lru_cache(maxsize=None)
+def _load(fixture):
+    with open(os.path.join(FIXTURES, f'{fixture}.json')) as f:
+        return json.load(f)
+
+def _query(url):
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    return f'{parts.scheme}://{parts.netloc}', int(query.get('size', DEFAULT_SIZE)), query.get('protocol')
+
+def _format(fmt, base, name, size, protocol):
+    """fmt served by the media server under name, or None to drop it"""
+    segments = max(size // FRAGMENT_SIZE, 1)
+    fmt = dict(fmt, filesize=size)
+    fmt.pop('fragments', None)
+    if fmt.get('protocol') == 'm3u8_native':
+        if protocol not in (None, 'hls'):
+            return None
+        # The segments come from the playlist, so the size is an estimate to yt-dlp
+        fmt['filesize_approx'] = fmt.pop('filesize')
+        return dict(fmt, url=f'{base}/hls/{name}.m3u8?size={size}&segments={segments}')
+    if fmt.get('protocol') not in ('http', 'https'):
+        # Storyboards
+        return None
+    if protocol == 'hls' and fmt.get('vcodec') != 'none':
+        return None
+    if protocol == 'dash':
+        return dict(fmt, protocol='http_dash_segments', url=f'{base}/dash/{name}.mpd',
+                    fragment_base_url=f'{base}/media/', fragments=[
+                        {'path': f'{name}-{index}.m4s?size={size // segments + (size % segments if index == segments - 1 else 0)}'}
+                        for index in range(segments)
+                    ])
+    return dict(fmt, protocol='http', url=f'{base}/media/{name}.{fmt["ext"]}?size={size}')
+
+class BenchFixtureIE(InfoExtractor):
+    IE_NAME = 'bench:fixture'
+    _VALID_URL = _HOST + r'/watch/(?P<fixture>[\w-]+)/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        fixture, video_id = self._match_valid_url(url).group('fixture', 'id')
+        base, size, protocol = _query(url)
+        info = _load(fixture)
+        formats = [_format(fmt, base, f'{video_id}-{fmt["format_id"]}', size, protocol) for fmt in info['formats']]
+        return dict(info, id=video_id, title=f"{info['title']} {video_id}", webpage_url=url,
+                    formats=[fmt for fmt in formats if fmt])
+
+class BenchPlaylistIE(InfoExtractor):
+    IE_NAME = 'bench:playlist'
+    _VALID_URL = _HOST + r'/playlist/(?P<fixture>[\w-]+)/(?P<count>\d+)'
+
+    def _real_extract(self, url):
+        fixture, count = self._match_valid_url(url).group('fixture', 'count')
+        parts = urllib.parse.urlsplit(url)
+        playlist_id = f'{fixture}-{count}'
+        info = _load(fixture)
+        entries = [
+            self.url_result(f'{parts.scheme}://{parts.netloc}/watch/{fixture}/{playlist_id}-{index:05d}?{parts.query}',
+                            BenchFixtureIE, f'{playlist_id}-{index:05d}', f"{info['title']} {index}")
+            for index in range(1, int(count) + 1)
+        ]
+        return self.playlist_result(entries, playlist_id, f'{fixture} x{count}',
+                                    extractor=info['extractor'], extractor_key=info['extractor_key'])
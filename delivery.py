@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import mimetypes
+from urllib.parse import quote
+from flask import request, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+
+# '' serves files from the app; 'x-sendfile' (Apache, lighttpd) or
+# 'x-accel-redirect' (nginx) hand them to the front server instead
+DELIVERY_OFFLOAD = os.environ.get('DELIVERY_OFFLOAD', '').lower()
+# nginx `internal` location aliased to the downloads directory
+DELIVERY_ACCEL_PREFIX = os.environ.get('DELIVERY_ACCEL_PREFIX', '/protected-downloads/')
+CHUNK_SIZE = 256 * 1024
+# Longest wait for news of a download being streamed; downloads running in
+# another process are only noticed at this interval
+STREAM_WAIT_SECONDS = float(os.environ.get('STREAM_WAIT_SECONDS', 1.0))
+
+class StreamInterrupted(Exception):
+    """The download being streamed stopped before it was complete"""
+
+class BoundedFile:
+    """The next `length` bytes of an open file, as a file object
+
+    Keeps fileno(), so gunicorn can send it with sendfile() from the
+    current offset; servers that iterate it instead stop at length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+def content_disposition(filename, attachment):
+    """Content-Disposition with an ASCII fallback and the UTF-8 name"""
+    fallback = filename.encode('ascii', 'replace').decode().replace('"', "'")
+    kind = 'attachment' if attachment else 'inline'
+    return f"{kind}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+def send_download(path, root, attachment=False):
+    """Response with a finished file under root, for the current request
+
+    Answers conditional GETs (ETag/Last-Modified) with 304 and a single
+    Range with 206, or hands the file to the front server when
+    DELIVERY_OFFLOAD is set. The body is the open file itself, so memory
+    use is constant and gunicorn sends it with sendfile().
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    filename = os.path.basename(path)
+
+    response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                        direct_passthrough=True)
+    response.headers['Content-Disposition'] = content_disposition(filename, attachment)
+    # Finished files never change in place; a replaced file has a new inode
+    response.set_etag(f'{stat.st_ino:x}-{size:x}-{int(stat.st_mtime):x}')
+    response.last_modified = int(stat.st_mtime)
+    response.cache_control.no_cache = True
+
+    if DELIVERY_OFFLOAD == 'x-accel-redirect':
+        # nginx does ranges and conditional requests itself
+        response.headers['X-Accel-Redirect'] = DELIVERY_ACCEL_PREFIX + quote(os.path.relpath(path, root))
+        return response
+    if DELIVERY_OFFLOAD == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    response.content_length = size
+    try:
+        response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response()
+
+    if response.status_code in (304, 412) or request.method == 'HEAD':
+        response.response = []
+        return response
+
+    start, length = 0, size
+    if response.status_code == 206:
+        start = response.content_range.start
+        length = response.content_range.stop - start
+    f = open(path, 'rb')
+    f.seek(start)
+    response.response = wrap_file(request.environ, BoundedFile(f, length), CHUNK_SIZE)
+    return response
+
+def open_growing(path):
+    """Open a file being fetched to path: its .part file, or path once complete
+
+    Returns (file, part path or None), or (None, None) when neither exists.
+    """
+    for candidate, part_path in ((path + '.part', path + '.part'), (path, None)):
+        try:
+            return open(candidate, 'rb'), part_path
+        except FileNotFoundError:
+            continue
+    return None, None
+
+def written_bytes(file, part_path):
+    """How much of a .part file is written from its start
+
+    ParallelHttpFD fills a preallocated file out of order and records this
+    in its state file; other downloaders append, so it is the file size.
+    """
+    try:
+        with open(part_path + '.ytdl') as f:
+            return json.load(f)['written']
+    except (OSError, ValueError, KeyError):
+        return os.fstat(file.fileno()).st_size
+
+def stream_growing(file, part_path, wait, stopped):
+    """Chunks of a file from open_growing, as they are written, up to its end
+
+    The file stays open when the .part file is renamed into place, so the
+    stream carries on into the finished file without reopening it. When
+    there is nothing new to send, wait(timeout) blocks until the download
+    made progress. A paused, failed or cancelled download (stopped()
+    returns True) ends the stream with StreamInterrupted, so the client
+    doesn't take the truncated body for the whole file. The generator
+    only resumes once the server sent the previous chunk, so a slow client
+    holds no more than a chunk in memory.
+    """
+    position = 0
+    complete = part_path is None
+    try:
+        while True:
+            if not complete and not os.path.exists(part_path):
+                # A cancelled download's .part file is deleted, not renamed
+                if os.fstat(file.fileno()).st_nlink == 0 and stopped():
+                    raise StreamInterrupted(f'Download stopped after {position} bytes')
+                complete = True
+            available = os.fstat(file.fileno()).st_size if complete else written_bytes(file, part_path)
+            if position < available:
+                file.seek(position)
+                data = file.read(min(CHUNK_SIZE, available - position))
+                position += len(data)
+                yield data
+                continue
+
+            if complete:
+                return
+            if not wait(STREAM_WAIT_SECONDS) and stopped():
+                raise StreamInterrupted(f'Download stopped after {position} bytes')
+    finally:
+        file.close()
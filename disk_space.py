@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, case, func, or_
+from sqlalchemy.exc import IntegrityError
+from yt_dlp.utils import parse_bytes
+from models import Download, DownloadStatus, StoredFile, Setting
+from playlist_progress import playlist_progress
+from result_store import result_store
+from app import db
+
+# Free space never handed out to downloads
+DISK_RESERVE_BYTES = parse_bytes(os.environ.get('DISK_RESERVE_BYTES', '1G')) or 0
+
+# Downloads deferred for disk space are tried again after this long, not on every poll
+DISK_RETRY_SECONDS = float(os.environ.get('DISK_RETRY_SECONDS', 60))
+
+# Leftovers of interrupted transfers
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.ytdl.tmp')
+
+class InsufficientDiskSpace(Exception):
+    """A download would not fit in the free disk space"""
+
+    def __init__(self, needed, available):
+        super().__init__(f"Waiting for disk space: needs {needed} bytes, {max(available, 0)} available")
+        self.needed = needed
+        self.available = available
+
+def expected_size(info):
+    """Size of the formats a video resolved to, if the site tells; None otherwise"""
+    sizes = [fmt.get('filesize') or fmt.get('filesize_approx') for fmt in info.get('requested_formats') or [info]]
+    return sum(sizes) if sizes and all(sizes) else None
+
+def remove_download_files(download_dir, download):
+    """Delete a download's file and the subtitles linked for it
+
+    Only names recorded on the row: other formats of the same video share
+    the file name's stem.
+    """
+    if not download.filename:
+        return
+    for name in {download.filename, *json.loads(download.subtitle_files or '[]')}:
+        try:
+            os.remove(os.path.join(download_dir, name))
+        except FileNotFoundError:
+            pass
+
+class DiskSpace:
+    """Admission of downloads against the free space of the downloads volume
+
+    A download reserves its expected size by carrying it as file_size
+    while it is DOWNLOADING (the part not written yet) or POSTPROCESSING
+    (room for the output); the reservations come from the database, so
+    they hold across processes. Followers of a result count as well, which
+    errs on the safe side.
+    """
+
+    def __init__(self, download_dir='downloads', reserve_bytes=None):
+        self.download_dir = download_dir
+        self.reserve_bytes = DISK_RESERVE_BYTES if reserve_bytes is None else reserve_bytes
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.deferred = 0
+
+    def reserved(self, exclude=None):
+        """Bytes running downloads are still expected to write"""
+        outstanding = case(
+            (Download.status == DownloadStatus.POSTPROCESSING, Download.file_size),
+            else_=Download.file_size - func.coalesce(Download.downloaded_bytes, 0)
+        )
+        query = (select(func.coalesce(func.sum(outstanding), 0))
+                 .where(Download.status.in_([DownloadStatus.DOWNLOADING, DownloadStatus.POSTPROCESSING]),
+                        Download.file_size.isnot(None)))
+        if exclude is not None:
+            query = query.where(Download.id != exclude)
+        reserved = db.session.execute(query).scalar()
+        db.session.commit()
+        return max(int(reserved), 0)
+
+    def available(self, exclude=None):
+        """Free bytes not reserved by running downloads nor kept in reserve"""
+        free = shutil.disk_usage(self.download_dir).free
+        return free - self.reserved(exclude) - self.reserve_bytes
+
+    def admit(self, download, postprocessed=False):
+        """Check that a download fits on disk next to the running ones
+
+        Its row must carry the expected file_size already; raises
+        InsufficientDiskSpace if it doesn't fit. Post-processed downloads
+        need room for their output next to the fetched files.
+        """
+        if not download.file_size:
+            return
+        needed = download.file_size - (download.downloaded_bytes or 0)
+        if postprocessed:
+            needed += download.file_size
+        available = self.available(exclude=download.id)
+        if needed > available:
+            self._count('deferred')
+            raise InsufficientDiskSpace(needed, available)
+        self._count('admitted')
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        usage = shutil.disk_usage(self.download_dir)
+        with self.lock:
+            return {
+                'free': usage.free,
+                'total': usage.total,
+                'reserve': self.reserve_bytes,
+                'admitted': self.admitted,
+                'deferred': self.deferred,
+            }
+
+class RetentionSweeper:
+    """Deletes completed downloads (files and rows) past the retention policy
+
+    Downloads completed more than max_age_days ago go first; then, while
+    completed downloads take more than max_bytes, the least recently
+    accessed ones. Partial files nobody wrote to for orphan_days are
+    removed too, unless a fetch in flight owns them. Downloads share their
+    bytes with the result store (hardlinks), which is bounded on its own
+    by RESULT_CACHE_MAX_BYTES.
+
+    Every process running workers runs the sweeper, but only the one
+    holding the sweep lease (a Setting row naming its owner, renewed by
+    each sweep) sweeps; the others take it over once it has gone unrenewed
+    for two intervals.
+    """
+
+    # Setting naming the process that sweeps
+    LEASE_SETTING = 'retention_lease'
+
+    def __init__(self, download_dir='downloads', max_age_days=None, max_bytes=None, orphan_days=None,
+                 interval=None):
+        self.download_dir = download_dir
+        self.max_age_days = max_age_days or float(os.environ.get('RETENTION_MAX_AGE_DAYS', 0)) or None
+        self.max_bytes = max_bytes or parse_bytes(os.environ.get('RETENTION_MAX_BYTES', '0')) or None
+        self.orphan_days = orphan_days or float(os.environ.get('RETENTION_ORPHAN_PART_DAYS', 7))
+        self.interval = interval or float(os.environ.get('RETENTION_SWEEP_INTERVAL', 600))
+        self.lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+        self.orphans = 0
+        self.last_sweep = None
+
+    def run(self, stop_event, owner):
+        """Sweep every interval while owner holds the lease, until stop_event is set; runs in its own thread"""
+        while not stop_event.wait(self.interval):
+            try:
+                if self._lease(owner):
+                    self.sweep()
+            except Exception as e:
+                logging.error(f"Retention sweep error: {str(e)}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def _lease(self, owner):
+        """Take or renew the sweep lease for owner, if it is free; commits"""
+        now = datetime.utcnow()
+        taken = db.session.execute(
+            update(Setting)
+            .where(Setting.key == self.LEASE_SETTING,
+                   or_(Setting.value == owner, Setting.updated_at < now - timedelta(seconds=self.interval * 2)))
+            .values(value=owner, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not taken and db.session.get(Setting, self.LEASE_SETTING) is None:
+            db.session.add(Setting(key=self.LEASE_SETTING, value=owner, updated_at=now))
+            taken = 1
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process created the lease first
+            db.session.rollback()
+            return False
+        return bool(taken)
+
+    def sweep(self):
+        """Apply the retention policy once; returns what was removed"""
+        expired = self._expire() if self.max_age_days else 0
+        evicted = self._evict() if self.max_bytes else 0
+        orphans = self._remove_orphans()
+        with self.lock:
+            self.expired += expired
+            self.evicted += evicted
+            self.orphans += orphans
+            self.last_sweep = datetime.utcnow()
+        if expired or evicted or orphans:
+            logging.info(f"Retention sweep removed {expired} expired and {evicted} evicted downloads, "
+                         f"{orphans} orphaned partial files")
+        return {'expired': expired, 'evicted': evicted, 'orphans': orphans}
+
+    def remove(self, downloads):
+        """Delete downloads together with their files
+
+        Downloads of the same result may share a file; it stays while any
+        other download still names it. Results in the store that no
+        download links any more are dropped too, as their hardlinks would
+        keep the space in use. Their playlists are recounted.
+        """
+        playlist_ids = {download.playlist_id for download in downloads if download.playlist_id}
+        result_keys = set()
+        for download in downloads:
+            if download.status == DownloadStatus.COMPLETED and download.filename:
+                result_keys.add(download.result_key or result_store.key_of(
+                    os.path.join(self.download_dir, download.filename), download.file_size))
+        result_keys.discard(None)
+        filenames = {download.filename for download in downloads if download.filename}
+        shared = set(db.session.execute(
+            select(Download.filename).where(Download.filename.in_(filenames),
+                                            Download.id.notin_([download.id for download in downloads]))
+        ).scalars()) if filenames else set()
+        for download in downloads:
+            if download.filename not in shared:
+                remove_download_files(self.download_dir, download)
+            db.session.delete(download)
+        db.session.commit()
+        if result_keys:
+            result_store.forget(result_keys)
+        if playlist_ids:
+            playlist_progress.reconcile(playlist_ids)
+        return len(downloads)
+
+    def _expire(self):
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+        downloads = db.session.execute(
+            select(Download).where(Download.status == DownloadStatus.COMPLETED, Download.completed_at < cutoff)
+        ).scalars().all()
+        return self.remove(downloads)
+
+    def _evict(self):
+        total = db.session.execute(
+            select(func.coalesce(func.sum(Download.file_size), 0)).where(Download.status == DownloadStatus.COMPLETED)
+        ).scalar()
+        if total <= self.max_bytes:
+            db.session.commit()
+            return 0
+
+        victims = []
+        last_used = func.coalesce(Download.last_accessed_at, Download.completed_at)
+        rows = db.session.execute(
+            select(Download).where(Download.status == DownloadStatus.COMPLETED).order_by(last_used, Download.id)
+        ).scalars()
+        for download in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append(download)
+            total -= download.file_size or 0
+        return self.remove(victims)
+
+    def _remove_orphans(self):
+        # Fetches in flight own <key>.* in the store's partial directory;
+        # paused downloads that can be streamed name theirs
+        owned_keys = set(db.session.execute(select(StoredFile.key).where(StoredFile.ready.is_(False))).scalars())
+        owned_paths = set(db.session.execute(
+            select(Download.stream_path).where(Download.status != DownloadStatus.COMPLETED,
+                                               Download.stream_path.isnot(None))
+        ).scalars())
+        db.session.commit()
+
+        cutoff = time.time() - self.orphan_days * 86400
+        removed = 0
+        for directory, _, filenames in os.walk(self.download_dir):
+            for name in filenames:
+                if not (name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name):
+                    continue
+                path = os.path.join(directory, name)
+                if name.split('.', 1)[0] in owned_keys or any(path.startswith(owned) for owned in owned_paths):
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_age_days': self.max_age_days,
+                'max_bytes': self.max_bytes,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'orphans': self.orphans,
+                'last_sweep': self.last_sweep.isoformat() if self.last_sweep else None,
+            }
+
+disk_space = DiskSpace()
+retention = RetentionSweeper()
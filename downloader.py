@@ -1,16 +1,66 @@
-import yt_dlp
 import os
+import json
+import time
 import logging
+from yt_dlp.utils import DownloadCancelled
+from sqlalchemy import select, update
 from models import Download, DownloadStatus
-from app import db
-from datetime import datetime
+from app import app, db
+from progress import progress_store
+from metadata_cache import metadata_cache
+from formats import FORMAT_FIELDS, normalize_formats, render_formats
+from fetcher import FetchingYoutubeDL, fetch_settings, build_fetch_params
+from ydl_pool import ydl_pool
+from result_store import result_store
+from postprocess import postprocessing
+from subtitles import subtitle_cache, subtitle_params
+from bandwidth import bandwidth
+from disk_space import disk_space, expected_size, InsufficientDiskSpace, DISK_RETRY_SECONDS
+from retry import classify_error, retry_delay
+from metrics import metrics, Timer
+from playlist_progress import playlist_progress
+from datetime import datetime, timedelta
+
+# Playlist entry fields kept in extract_info results
+ENTRY_FIELDS = ('id', 'url', 'webpage_url', 'title', 'duration', 'ie_key')
+
+class DownloadInterrupted(DownloadCancelled):
+    """Raised from the progress hook to stop a running transfer"""
+
+    def __init__(self, reason):
+        super().__init__(f"Download {reason}")
+        self.reason = reason
 
 class VideoDownloader:
+    # Name of finished files in the downloads directory (the id keeps same-titled videos apart)
+    OUTPUT_TEMPLATE = '%(uploader)s - %(title)s [%(id)s]'
+    # Seconds between checks while waiting for another download of the same result
+    FOLLOW_INTERVAL = 1
+
     def __init__(self):
         self.download_dir = 'downloads'
         os.makedirs(self.download_dir, exist_ok=True)
     
-    def extract_info(self, url, extract_flat=False):
+    def extract_info(self, url, extract_flat=False, fields=FORMAT_FIELDS):
+        """Extract video/playlist information, served from the metadata cache when possible
+
+        Formats are cached as compact rows and rendered here with only the
+        requested fields.
+        """
+        return self.render(self.extract_cached(url, extract_flat), fields)
+
+    def extract_cached(self, url, extract_flat=False):
+        """Extract video/playlist information through the metadata cache, formats as compact rows"""
+        return metadata_cache.get_or_extract(url, extract_flat, self._extract_info)
+
+    @staticmethod
+    def render(info, fields=FORMAT_FIELDS):
+        """Render the compact format rows of a cached result with only the requested fields"""
+        if info.get('type') == 'video':
+            info = dict(info, formats=render_formats(info['formats'], fields))
+        return info
+    
+    def _extract_info(self, url, extract_flat=False):
         """Extract video/playlist information"""
         ydl_opts = {
             'quiet': True,
@@ -19,90 +69,25 @@ class VideoDownloader:
             'ignoreerrors': True,
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with ydl_pool.get(ydl_opts) as ydl:
             try:
-                info = ydl.extract_info(url, download=False)
+                with Timer(metrics.extract_seconds, 'api'):
+                    info = ydl.extract_info(url, download=False)
                 
                 if info and info.get('_type') == 'playlist':
                     return {
                         'type': 'playlist',
                         'title': info.get('title', 'Unknown Playlist'),
                         'extractor': info.get('extractor', 'unknown'),
-                        'entries': info.get('entries', []),
+                        # Full entries carry their own format lists; keep only what ingestion needs
+                        'entries': [
+                            {field: entry.get(field) for field in ENTRY_FIELDS} if entry else None
+                            for entry in info.get('entries') or []
+                        ],
                         'webpage_url': info.get('webpage_url', url)
                     }
                 else:
-                    formats = []
-                    if info and info.get('formats'):
-                        seen_formats = set()
-                        for fmt in info['formats']:
-                            if fmt and (fmt.get('vcodec') != 'none' or fmt.get('acodec') != 'none'):
-                                # Create unique identifier for format to avoid duplicates
-                                height = fmt.get('height')
-                                ext = fmt.get('ext', 'unknown')
-                                vcodec = fmt.get('vcodec', 'none')
-                                acodec = fmt.get('acodec', 'none')
-                                
-                                # Enhanced quality detection for YouTube
-                                quality_label = fmt.get('format_note', '')
-                                if height:
-                                    if height >= 2160:
-                                        quality_display = f"4K ({height}p)"
-                                    elif height >= 1440:
-                                        quality_display = f"2K ({height}p)"
-                                    elif height >= 1080:
-                                        quality_display = f"Full HD ({height}p)"
-                                    elif height >= 720:
-                                        quality_display = f"HD ({height}p)"
-                                    else:
-                                        quality_display = f"{height}p"
-                                else:
-                                    # Enhanced audio quality detection
-                                    if acodec != 'none' and vcodec == 'none':
-                                        tbr = fmt.get('tbr', 0)
-                                        if tbr >= 320:
-                                            quality_display = 'High Quality Audio (320+ kbps)'
-                                        elif tbr >= 256:
-                                            quality_display = 'Premium Audio (256 kbps)'
-                                        elif tbr >= 192:
-                                            quality_display = 'Standard Audio (192 kbps)'
-                                        elif tbr >= 128:
-                                            quality_display = 'Good Audio (128 kbps)'
-                                        else:
-                                            quality_display = 'Audio Only'
-                                    else:
-                                        quality_display = quality_label or 'Unknown Quality'
-                                
-                                # Add codec info for better selection
-                                if vcodec != 'none' and acodec != 'none':
-                                    codec_info = f" ({vcodec}+{acodec})"
-                                elif vcodec != 'none':
-                                    codec_info = f" (video: {vcodec})"
-                                elif acodec != 'none':
-                                    codec_info = f" (audio: {acodec})"
-                                else:
-                                    codec_info = ""
-                                
-                                format_key = f"{height}_{ext}_{vcodec}_{acodec}"
-                                if format_key not in seen_formats:
-                                    seen_formats.add(format_key)
-                                    formats.append({
-                                        'format_id': fmt.get('format_id'),
-                                        'ext': ext,
-                                        'quality': quality_display + codec_info,
-                                        'quality_sort': height or 0,
-                                        'filesize': fmt.get('filesize'),
-                                        'vcodec': vcodec,
-                                        'acodec': acodec,
-                                        'height': height,
-                                        'width': fmt.get('width'),
-                                        'fps': fmt.get('fps'),
-                                        'tbr': fmt.get('tbr'),
-                                        'is_audio_only': vcodec == 'none' and acodec != 'none'
-                                    })
-                        
-                        # Sort formats by quality (highest first) and group by type
-                        formats.sort(key=lambda x: (x.get('is_audio_only', False), -x.get('quality_sort', 0)))
+                    formats = normalize_formats(info.get('formats') if info else None)
                     
                     return {
                         'type': 'video',
@@ -122,27 +107,77 @@ class VideoDownloader:
                 logging.error(f"Error extracting info for {url}: {str(e)}")
                 raise e
     
-    def download_video(self, download_obj):
-        """Download a single video"""
+    def download_video(self, download_obj, should_stop=None):
+        """Download a single video
+
+        The result comes from the ResultStore when the same video, formats
+        and postprocessing were fetched before, or are being fetched right
+        now; otherwise it is fetched into the store. Either way it is
+        hardlinked into the downloads directory.
+
+        Merging, fixups and audio extraction don't run here: the fetched
+        files go to the post-processing stage and the download is left
+        POSTPROCESSING. A Future of its completion is returned then, None
+        when the download finished (or stopped) here.
+
+        A fetch that would not fit on disk (see DiskSpace) puts the download
+        back to PENDING; the queue holds it until there is room. So does a
+        retryable failure, with next_retry_at set by exponential backoff,
+        until RETRY_MAX_ATTEMPTS runs failed; fatal ones fail right away.
+        Failures are raised again either way.
+
+        should_stop is polled from the progress hook; when it returns
+        'paused' or 'cancelled' the transfer is aborted. Paused downloads
+        keep their .part files, which yt-dlp continues with range requests
+        once the download runs again; cancelled ones have them removed.
+        """
+        partial_files = set()
+        leading_key = None
+        # The row of a cancelled download is gone by the time it stops
+        download_id = download_obj.id
+        called = time.monotonic()
+        # Bytes each file had at its last progress report, for the per-extractor byte counter
+        reported = {}
         try:
             download_obj.status = DownloadStatus.DOWNLOADING
             download_obj.started_at = datetime.utcnow()
+            # E.g. why it was waiting for disk space, or the error it is retried after
+            download_obj.error_message = None
+            download_obj.next_retry_at = None
             db.session.commit()
+            progress_store.start(
+                download_obj.id,
+                title=download_obj.title,
+                url=download_obj.url,
+                platform=download_obj.platform,
+                quality=download_obj.quality,
+                playlist_id=download_obj.playlist_id,
+                playlist_index=download_obj.playlist_index,
+                status=DownloadStatus.DOWNLOADING.value
+            )
             
             def progress_hook(d):
                 if d['status'] == 'downloading':
-                    download_obj.downloaded_bytes = d.get('downloaded_bytes', 0)
-                    download_obj.file_size = d.get('total_bytes', d.get('total_bytes_estimate', 0))
-                    download_obj.download_speed = d.get('speed', 0)
-                    download_obj.eta = d.get('eta', 0)
-                    db.session.commit()
-                
-                elif d['status'] == 'finished':
-                    download_obj.filename = os.path.basename(d['filename'])
-                    download_obj.status = DownloadStatus.COMPLETED
-                    download_obj.completed_at = datetime.utcnow()
-                    download_obj.downloaded_bytes = download_obj.file_size
-                    db.session.commit()
+                    if d.get('tmpfilename'):
+                        partial_files.add(d['tmpfilename'])
+                    name = d.get('tmpfilename') or d.get('filename')
+                    downloaded = d.get('downloaded_bytes') or 0
+                    # The first report of a file includes what was resumed; a file
+                    # that starts over (e.g. a fragment retried) counts from its new start
+                    metrics.downloaded_bytes.inc(max(downloaded - reported.get(name, downloaded), 0),
+                                                 download_obj.extractor_key or 'unknown')
+                    reported[name] = downloaded
+                    reason = should_stop() if should_stop else None
+                    if reason:
+                        raise DownloadInterrupted(reason)
+                    # Kept in memory and flushed in batches; see ProgressStore
+                    progress_store.update(
+                        download_obj.id,
+                        d.get('downloaded_bytes', 0),
+                        d.get('total_bytes') or d.get('total_bytes_estimate', 0),
+                        d.get('speed', 0),
+                        d.get('eta', 0)
+                    )
             
             # Enhanced format selection for better YouTube quality
             if download_obj.format_id == 'best':
@@ -163,14 +198,24 @@ class VideoDownloader:
 
             # Base options
             ydl_opts = {
-                'outtmpl': os.path.join(self.download_dir, '%(uploader)s - %(title)s.%(ext)s'),
                 'format': format_selector,
                 'progress_hooks': [progress_hook],
                 'no_warnings': True,
                 'ignoreerrors': False,
                 'extract_flat': False,
+                # Resume interrupted transfers from their .part files
+                'continuedl': True,
+                # Post-processing runs in its own stage; see postprocess.py
+                'defer_postprocessing': True,
             }
             
+            # Parallel fragments/ranges and buffer sizes; see fetcher.py
+            fetch_options = json.loads(download_obj.fetch_options) if download_obj.fetch_options else None
+            settings = fetch_settings(download_obj.platform, fetch_options)
+            ydl_opts.update(build_fetch_params(settings))
+            # Held to its own cap and its share of the global one
+            ydl_opts['throttle'] = bandwidth.register(download_obj.id, download_obj.rate_limit)
+            
             # Audio-specific options
             if download_obj.format_id in ['audio', 'mp3', 'mp3_320', 'mp3_256', 'mp3_192', 'mp3_128']:
                 # Determine quality based on format_id
@@ -192,23 +237,306 @@ class VideoDownloader:
                         'preferredcodec': 'mp3',
                         'preferredquality': quality,
                     }],
-                    'outtmpl': os.path.join(self.download_dir, '%(uploader)s - %(title)s.%(ext)s'),
                 })
             else:
-                # Video options
+                # Video options; subtitles only when asked for
                 ydl_opts.update({
-                    'writesubtitles': True,
-                    'writeautomaticsub': True,
-                    'subtitleslangs': ['en', 'es', 'fr', 'de'],
                     'merge_output_format': 'mp4',
+                    **subtitle_params(download_obj.subtitle_langs),
                 })
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([download_obj.url])
+            started = time.monotonic()
+            with ydl_pool.get(ydl_opts, FetchingYoutubeDL) as ydl:
+                with Timer(metrics.extract_seconds, 'download'):
+                    info = ydl.extract_info(download_obj.url, download=False)
+                if info.get('_type') == 'playlist':
+                    raise ValueError('This URL is a playlist; add it again to queue its videos')
+                basename = os.path.basename(ydl.prepare_filename(info, outtmpl=self.OUTPUT_TEMPLATE))
+                key = result_store.make_key(info, ydl_opts)
+                if self._streamable(info, ydl_opts):
+                    # Whoever fetches the key writes it here; see /api/download/<id>/stream
+                    download_obj.stream_path = ydl.prepare_filename(info, outtmpl=result_store.partial_template(key))
+            download_obj.extractor_key = info.get('extractor_key')
+            download_obj.video_id = info.get('id')
+            # Reserves room on disk while it runs; a resumed download knows its real size
+            self._set_file_size(download_obj, download_obj.file_size or expected_size(info))
+            db.session.commit()
+            
+            stored = result_store.claim(
+                key, download_obj.id,
+                lambda leader_id: self._follow(download_obj.id, leader_id, should_stop)
+            )
+            fetched = stored is None
+            if fetched:
+                leading_key = key
+                disk_space.admit(download_obj, postprocessed=bool(info.get('requested_formats')
+                                                                  or ydl_opts.get('postprocessors')))
+                # Fetch into the store under a stable name, so interrupted fetches resume
+                outtmpl = result_store.partial_template(key)
+                with ydl_pool.get(dict(ydl_opts, outtmpl=outtmpl), FetchingYoutubeDL) as ydl:
+                    info = ydl.process_ie_result(info, download=True)
+                    deferred = ydl.deferred
+                # Wall time of the transfer itself, to compare fetch modes
+                download_obj.download_seconds = round(time.monotonic() - started, 3)
+                metrics.download_seconds.observe(download_obj.download_seconds, download_obj.extractor_key or 'unknown')
+                if deferred:
+                    params = {option: value for option, value in ydl_opts.items()
+                              if option not in ('progress_hooks', 'throttle', 'defer_postprocessing')}
+                    pending = self._postprocess(download_obj, key, dict(deferred, params=dict(params, outtmpl=outtmpl)),
+                                                basename)
+                    leading_key = None
+                    return pending
+                stored = result_store.store(key, download_obj.id, info, *self._fetched_files(info))
+                leading_key = None
+            else:
+                download_obj.download_seconds = round(time.monotonic() - started, 3)
+            
+            source = f"{settings['mode']} fetch" if fetched else 'result store'
+            self._complete(download_obj, stored, basename, source)
             
+        except DownloadInterrupted as e:
+            self._interrupted(download_obj.id, e.reason, partial_files, leading_key)
+
+        except InsufficientDiskSpace as e:
+            logging.warning(f"Deferring download {download_id}: {str(e)}")
+            db.session.rollback()
+            if leading_key:
+                result_store.release(leading_key, download_id)
+            progress_store.pop(download_id)
+            # Unless paused or cancelled meanwhile. The scheduler only knows the size left to
+            # fetch, not the room post-processing needs, so it is kept from claiming it again at once
+            db.session.execute(
+                update(Download)
+                .where(Download.id == download_id, Download.status == DownloadStatus.DOWNLOADING)
+                .values(status=DownloadStatus.PENDING, error_message=str(e),
+                        next_retry_at=datetime.utcnow() + timedelta(seconds=DISK_RETRY_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            progress_store.publish('status', {'id': download_id, 'status': DownloadStatus.PENDING.value})
+
         except Exception as e:
             logging.error(f"Error downloading {download_obj.url}: {str(e)}")
-            download_obj.status = DownloadStatus.FAILED
-            download_obj.error_message = str(e)
+            db.session.rollback()
+            if leading_key:
+                result_store.release(leading_key, download_obj.id)
+            progress = progress_store.pop(download_obj.id)
+            if progress.get('downloaded_bytes'):
+                download_obj.downloaded_bytes = progress['downloaded_bytes']
+                self._set_file_size(download_obj, download_obj.file_size or progress['file_size'])
+            download_obj.attempts = (download_obj.attempts or 0) + 1
+            retryable, label = classify_error(e)
+            metrics.failures.inc(1, label, 'true' if retryable else 'false')
+            delay = retry_delay(download_obj.attempts, e) if retryable else None
+            if delay is not None:
+                download_obj.status = DownloadStatus.PENDING
+                download_obj.next_retry_at = datetime.utcnow() + timedelta(seconds=delay)
+                download_obj.error_message = f"Retrying in {int(delay)}s ({label}): {str(e)}"
+            else:
+                download_obj.status = DownloadStatus.FAILED
+                download_obj.error_message = str(e)
+                if download_obj.playlist_id:
+                    playlist_progress.record(download_obj.playlist_id, failed=1)
             db.session.commit()
+            progress_store.publish('status', {'id': download_obj.id, 'status': download_obj.status.value})
             raise e
+
+        finally:
+            bandwidth.unregister(download_id)
+            metrics.download_video_seconds.observe(time.monotonic() - called)
+
+    def fetch_subtitles(self, download_obj, languages):
+        """Fetch subtitles for a completed download and link them next to its file
+
+        Tracks come from the SubtitleCache when this video's were fetched
+        before. Returns {lang: file name} for the languages found.
+        """
+        extractor_key, video_id, tracks = subtitle_cache.fetch(
+            download_obj.url, languages, download_obj.extractor_key, download_obj.video_id
+        )
+        download_obj.extractor_key = extractor_key
+        download_obj.video_id = video_id
+        db.session.commit()
+
+        basename = os.path.splitext(download_obj.filename)[0]
+        files = {}
+        for language, path in tracks.items():
+            # Cached as <video key>.<lang>.<ext>
+            suffix = '.' + os.path.basename(path).split('.', 1)[1]
+            files[language] = result_store.link_free(path, self.download_dir, basename, suffix)
+        linked = sorted({*json.loads(download_obj.subtitle_files or '[]'), *files.values()})
+        download_obj.subtitle_files = json.dumps(linked) if linked else None
+        db.session.commit()
+        return files
+
+    def _complete(self, download_obj, stored, basename, source):
+        """Link a stored result into the downloads directory and mark the download completed"""
+        progress = progress_store.pop(download_obj.id)
+        if download_obj.playlist_id:
+            playlist_progress.record(download_obj.playlist_id, completed=1, downloaded_bytes=stored.size)
+        self._set_file_size(download_obj, stored.size)
+        download_obj.filename, subtitle_files = result_store.link(stored, self.download_dir, basename)
+        download_obj.result_key = stored.key
+        download_obj.subtitle_files = json.dumps(subtitle_files) if subtitle_files else None
+        download_obj.status = DownloadStatus.COMPLETED
+        download_obj.completed_at = datetime.utcnow()
+        download_obj.last_accessed_at = download_obj.completed_at
+        download_obj.downloaded_bytes = stored.size
+        if progress.get('download_speed'):
+            download_obj.download_speed = progress['download_speed']
+        download_obj.eta = 0
+        db.session.commit()
+        progress_store.publish('status', {'id': download_obj.id, 'status': download_obj.status.value})
+        logging.info(f"Downloaded {download_obj.url} in {download_obj.download_seconds}s ({source})")
+
+    def _postprocess(self, download_obj, key, job, basename):
+        """Hand fetched files to the post-processing stage
+
+        Blocks while the stage is full. The result is stored and linked by
+        _postprocessed once the stage is done with it; the returned Future
+        resolves after that.
+        """
+        progress = progress_store.pop(download_obj.id)
+        download_obj.status = DownloadStatus.POSTPROCESSING
+        download_obj.postprocess_started_at = datetime.utcnow()
+        if progress.get('downloaded_bytes'):
+            download_obj.downloaded_bytes = progress['downloaded_bytes']
+            self._set_file_size(download_obj, download_obj.file_size or progress['file_size'])
+        download_obj.download_speed = progress.get('download_speed')
+        download_obj.eta = None
+        db.session.commit()
+        progress_store.publish('status', {'id': download_obj.id, 'status': download_obj.status.value})
+
+        download_id = download_obj.id
+        info = job['info']
+
+        def finish(result, error):
+            # Runs on the stage's finisher thread
+            with app.app_context():
+                try:
+                    self._postprocessed(download_id, key, info, basename, result, error)
+                finally:
+                    db.session.remove()
+
+        return postprocessing.submit(job, finish)
+
+    def _postprocessed(self, download_id, key, info, basename, result, error):
+        """Store the post-processed result and complete the download (unless cancelled meanwhile)"""
+        try:
+            if error:
+                raise error
+            stored = result_store.store(key, download_id, info, *self._fetched_files(result))
+        except Exception as e:
+            logging.error(f"Error post-processing download {download_id}: {str(e)}")
+            metrics.failures.inc(1, 'postprocessing', 'false')
+            db.session.rollback()
+            result_store.release(key, download_id)
+            playlist_id = db.session.execute(
+                select(Download.playlist_id).where(Download.id == download_id)
+            ).scalar()
+            db.session.execute(
+                update(Download)
+                .where(Download.id == download_id)
+                .values(status=DownloadStatus.FAILED, error_message=str(e))
+                .execution_options(synchronize_session=False)
+            )
+            if playlist_id:
+                playlist_progress.record(playlist_id, failed=1)
+            db.session.commit()
+            progress_store.publish('status', {'id': download_id, 'status': DownloadStatus.FAILED.value})
+            return
+
+        download_obj = db.session.get(Download, download_id)
+        if download_obj is None:
+            # Cancelled while post-processing; the result stays in the store
+            return
+        download_obj.postprocess_seconds = result['seconds']
+        metrics.postprocess_seconds.observe(result['seconds'])
+        self._complete(download_obj, stored, basename, 'post-processed')
+
+    def _follow(self, download_id, leader_id, should_stop):
+        """Wait for another download fetching the same result, mirroring its progress"""
+        reason = should_stop() if should_stop else None
+        if reason:
+            raise DownloadInterrupted(reason)
+        leader = progress_store.get(leader_id)
+        if leader is None:
+            # Running in another process; use its last flushed progress
+            row = db.session.execute(
+                select(Download.downloaded_bytes, Download.file_size).where(Download.id == leader_id)
+            ).first()
+            db.session.commit()
+            leader = {'downloaded_bytes': row[0], 'file_size': row[1]} if row else {}
+        progress_store.update(
+            download_id,
+            leader.get('downloaded_bytes'),
+            leader.get('file_size'),
+            leader.get('download_speed'),
+            leader.get('eta')
+        )
+        time.sleep(self.FOLLOW_INTERVAL)
+
+    @staticmethod
+    def _set_file_size(download_obj, file_size):
+        """Set a download's size, keeping its playlist's total_bytes in step
+
+        Every change of a row's file_size goes through here (or applies
+        the same change to the playlist), so the counter never drifts.
+        Sizes from progress hooks only fill in a size nothing else gave:
+        they count the format being fetched, not the whole download.
+        """
+        if download_obj.playlist_id and file_size != download_obj.file_size:
+            playlist_progress.record(download_obj.playlist_id,
+                                     total_bytes=(file_size or 0) - (download_obj.file_size or 0))
+        download_obj.file_size = file_size
+
+    @staticmethod
+    def _streamable(info, ydl_opts):
+        """Whether a video is fetched as one progressive file that ends up unchanged"""
+        return (not info.get('requested_formats') and info.get('protocol') in ('http', 'https')
+                and not ydl_opts.get('postprocessors'))
+
+    @staticmethod
+    def _fetched_files(info):
+        """Main file and subtitle files (by name suffix) produced by a download"""
+        downloaded = (info.get('requested_downloads') or [info])[0]
+        # yt-dlp drops what the entry shares with the top level, subtitles included
+        subtitles = downloaded.get('requested_subtitles') or info.get('requested_subtitles') or {}
+        extra_files = {
+            f".{lang}.{subtitle['ext']}": subtitle['filepath']
+            for lang, subtitle in subtitles.items()
+            if subtitle.get('filepath')
+        }
+        return downloaded['filepath'], extra_files
+
+    def _interrupted(self, download_id, reason, partial_files, leading_key):
+        """Record where a paused download stopped, or clean up a cancelled one"""
+        db.session.rollback()
+        progress = progress_store.pop(download_id)
+        if reason == 'cancelled':
+            # The row is already gone; so are the bytes
+            for path in partial_files:
+                for leftover in (path, path + '.ytdl'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        elif progress.get('downloaded_bytes'):
+            # The status was set by whoever paused it; the row may be deleted meanwhile
+            row = db.session.execute(
+                select(Download.playlist_id, Download.file_size).where(Download.id == download_id)
+            ).first()
+            file_size = (row.file_size if row else None) or progress['file_size']
+            db.session.execute(
+                update(Download)
+                .where(Download.id == download_id)
+                .values(downloaded_bytes=progress['downloaded_bytes'], file_size=file_size,
+                        download_speed=None, eta=None)
+                .execution_options(synchronize_session=False)
+            )
+            if row and row.playlist_id and file_size != row.file_size:
+                playlist_progress.record(row.playlist_id, total_bytes=(file_size or 0) - (row.file_size or 0))
+            db.session.commit()
+        if leading_key:
+            # A download waiting for the same result takes over (and its .part file)
+            result_store.release(leading_key, download_id)
+        logging.info(f"Download {download_id} {reason}")
+        progress_store.publish('status', {'id': download_id, 'status': reason})
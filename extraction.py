@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from formats import FORMAT_FIELDS
+from metadata_cache import metadata_cache
+from app import app
+
+# Seconds clients are asked to wait before retrying a turned away extraction
+BUSY_RETRY_SECONDS = 2
+
+class ExtractionBusy(Exception):
+    """No room for another extraction right now"""
+
+    def __init__(self, message, retry_after=BUSY_RETRY_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ExtractionTimeout(Exception):
+    """An extraction outlived the request waiting for it; it keeps running"""
+
+class ExtractionPool:
+    """Runs the API's extractions on a bounded pool of threads
+
+    Request threads only wait for a result, for up to timeout seconds; an
+    extraction that takes longer carries on and lands in the metadata
+    cache, so the client's retry is served from there. At most max_pending
+    extractions are queued or running, max_per_client of them for any one
+    client; further requests are turned away at once instead of tying up
+    web threads behind a slow extractor. Identical requests share one
+    extraction, and cached results never take a slot.
+    """
+
+    def __init__(self, downloader, workers=None, max_pending=None, max_per_client=None, timeout=None):
+        self.downloader = downloader
+        self.workers = workers or int(os.environ.get('EXTRACT_WORKERS', 4))
+        self.max_pending = max_pending or int(os.environ.get('EXTRACT_MAX_PENDING', 16))
+        self.max_per_client = max_per_client or int(os.environ.get('EXTRACT_MAX_PER_CLIENT', 2))
+        self.timeout = timeout or float(os.environ.get('EXTRACT_TIMEOUT', 20))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='extract')
+        self.inflight = {}
+        self.clients = Counter()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.joined = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def extract(self, url, client, fields=FORMAT_FIELDS):
+        """Extract url for a request, as VideoDownloader.extract_info does
+
+        Raises ExtractionBusy when there is no room for it, and
+        ExtractionTimeout when it isn't done within the timeout.
+        """
+        cached = metadata_cache.peek(url, extract_flat=False)
+        if cached is not None:
+            return self.downloader.render(cached, fields)
+
+        future = self._submit(url, client)
+        try:
+            info = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self.lock:
+                self.timeouts += 1
+            raise ExtractionTimeout('Extraction is taking a while; it continues in the background, '
+                                    'try again shortly')
+        return self.downloader.render(info, fields)
+
+    def _submit(self, url, client):
+        key = metadata_cache.cache_key(url, False)
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.joined += 1
+                return future
+            if len(self.inflight) >= self.max_pending:
+                self.rejected += 1
+                raise ExtractionBusy('Too many extractions in progress, try again shortly')
+            if self.clients[client] >= self.max_per_client:
+                self.rejected += 1
+                raise ExtractionBusy('You have too many extractions in progress, try again shortly')
+            self.clients[client] += 1
+            self.submitted += 1
+            future = self.inflight[key] = self.executor.submit(self._run, url)
+        # Outside the lock: runs right away if the extraction already finished
+        future.add_done_callback(lambda done: self._finished(key, client))
+        return future
+
+    def _run(self, url):
+        with app.app_context():
+            return self.downloader.extract_cached(url)
+
+    def _finished(self, key, client):
+        with self.lock:
+            self.inflight.pop(key, None)
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'in_flight': len(self.inflight),
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'joined': self.joined,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from yt_dlp import YoutubeDL
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.utils import DownloadError
+
+MB = 1024 * 1024
+
+FETCH_MODES = ('single', 'parallel')
+
+# Transfer settings; per-platform entries override the defaults and
+# options sent with a download override both
+FETCH_DEFAULTS = {
+    'mode': os.environ.get('FETCH_MODE', 'parallel'),
+    # DASH/HLS fragments downloaded at once
+    'fragments': int(os.environ.get('FETCH_FRAGMENTS', 4)),
+    # Range requests per progressive file
+    'connections': int(os.environ.get('FETCH_CONNECTIONS', 4)),
+    # Smaller files are not worth splitting
+    'min_parallel_size': int(os.environ.get('FETCH_MIN_PARALLEL_SIZE', 32 * MB)),
+    # Range size for single-connection downloads; None fetches in one request
+    'chunk_size': None,
+    'buffer_size': 64 * 1024,
+}
+PLATFORM_FETCH_DEFAULTS = {
+    # YouTube throttles long single responses, so always request in chunks
+    'youtube': {'chunk_size': 10 * MB, 'buffer_size': 256 * 1024},
+}
+
+# Accepted ranges for options sent with a download
+FETCH_OPTION_LIMITS = {
+    'fragments': (1, 32),
+    'connections': (1, 16),
+    'min_parallel_size': (MB, 64 * 1024 * MB),
+    'chunk_size': (256 * 1024, 1024 * MB),
+    'buffer_size': (1024, 16 * MB),
+}
+
+def parse_fetch_options(options):
+    """Validate fetch options sent with a download; returns a dict or None"""
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        raise ValueError('fetch must be an object')
+    unknown = set(options) - {'mode'} - set(FETCH_OPTION_LIMITS)
+    if unknown:
+        raise ValueError(f"Unknown fetch options: {', '.join(sorted(unknown))}")
+
+    parsed = {}
+    if 'mode' in options:
+        if options['mode'] not in FETCH_MODES:
+            raise ValueError(f"fetch mode must be one of: {', '.join(FETCH_MODES)}")
+        parsed['mode'] = options['mode']
+    for name, (low, high) in FETCH_OPTION_LIMITS.items():
+        if name in options:
+            value = options[name]
+            if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+                raise ValueError(f"fetch {name} must be an integer between {low} and {high}")
+            parsed[name] = value
+    return parsed
+
+def fetch_settings(platform, options=None):
+    """Effective transfer settings for a platform and a download's own options"""
+    settings = dict(FETCH_DEFAULTS)
+    settings.update(PLATFORM_FETCH_DEFAULTS.get((platform or '').split(':')[0].lower(), {}))
+    settings.update(options or {})
+    return settings
+
+def build_fetch_params(settings):
+    """Translate transfer settings into YoutubeDL params"""
+    params = {'buffersize': settings['buffer_size']}
+    if settings['chunk_size']:
+        params['http_chunk_size'] = settings['chunk_size']
+    if settings['mode'] == 'parallel':
+        params['concurrent_fragment_downloads'] = settings['fragments']
+        params['parallel_connections'] = settings['connections']
+        params['parallel_min_size'] = settings['min_parallel_size']
+    return params
+
+class ParallelHttpFD(FileDownloader):
+    """Fetches a progressive HTTP file as ranges over several connections
+
+    The file is split into pieces that a small thread pool downloads into
+    the .part file; finished pieces are recorded next to it so an
+    interrupted transfer continues where it stopped, along with how much of
+    the file from its start is already written (so it can be streamed
+    while fetched, see delivery.py). Progress hooks run on
+    the calling thread, so a hook raising (e.g. to pause) stops the pool.
+    Servers without range support, and small files, go to the regular
+    HttpFD.
+    """
+
+    FD_NAME = 'parallel-http'
+
+    # Piece size bounds; pieces are smaller than connection shares so fast
+    # connections pick up the work of slow ones
+    MIN_PIECE_SIZE = MB
+    PIECES_PER_CONNECTION = 4
+    PIECE_RETRIES = 3
+    REPORT_INTERVAL = 0.5
+
+    def real_download(self, filename, info_dict):
+        url = info_dict['url']
+        headers = dict(info_dict.get('http_headers') or {})
+        connections = self.params.get('parallel_connections') or 1
+        total = self._probe(url, headers)
+        if connections < 2 or not total or total < (self.params.get('parallel_min_size') or 0):
+            return self._fallback(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        state_filename = tmpfilename + '.ytdl'
+        piece_size = max(self.MIN_PIECE_SIZE, -(-total // (connections * self.PIECES_PER_CONNECTION)))
+        pieces = [(start, min(start + piece_size, total)) for start in range(0, total, piece_size)]
+        done = self._load_state(state_filename, tmpfilename, total, piece_size)
+        # Bytes written so far in each unfinished piece
+        positions = {}
+
+        def written():
+            # Length of the prefix without gaps; callers hold the lock
+            for index, (start, end) in enumerate(pieces):
+                if index not in done:
+                    return positions.get(index, start)
+            return total
+
+        # Saved first: readers take a .part file without state as written up to its size
+        self._save_state(state_filename, total, piece_size, done, written())
+        if not done:
+            with open(tmpfilename, 'wb') as f:
+                f.truncate(total)
+
+        self.report_destination(filename)
+        lock = threading.Lock()
+        stop = threading.Event()
+        progress = {'bytes': sum(pieces[index][1] - pieces[index][0] for index in done)}
+        resumed_bytes = progress['bytes']
+        buffer_size = self.params.get('buffersize') or 64 * 1024
+        throttle = self.params.get('throttle')
+
+        def fetch_piece(index):
+            start, end = pieces[index]
+            position = start
+            for attempt in range(self.PIECE_RETRIES):
+                try:
+                    request = Request(url, headers={**headers, 'Range': f'bytes={position}-{end - 1}'})
+                    with self.ydl.urlopen(request) as response, open(tmpfilename, 'r+b') as f:
+                        if response.status != 206:
+                            raise DownloadError(f'Server ignored range request (HTTP {response.status})')
+                        f.seek(position)
+                        while position < end and not stop.is_set():
+                            block = response.read(min(buffer_size, end - position))
+                            if not block:
+                                break
+                            f.write(block)
+                            f.flush()
+                            position += len(block)
+                            with lock:
+                                progress['bytes'] += len(block)
+                                positions[index] = position
+                            if throttle:
+                                throttle(len(block))
+                    if position >= end:
+                        return index
+                    if stop.is_set():
+                        return None
+                except DownloadError:
+                    raise
+                except Exception as e:
+                    if attempt == self.PIECE_RETRIES - 1:
+                        raise
+                    self.report_warning(f'Retrying range {position}-{end - 1}: {e}')
+            raise DownloadError(f'Range {start}-{end - 1} ended early at {position}')
+
+        started = time.time()
+        executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='parallel-http')
+        pending = {executor.submit(fetch_piece, index) for index in range(len(pieces)) if index not in done}
+        try:
+            while pending:
+                finished, pending = wait(pending, timeout=self.REPORT_INTERVAL, return_when=FIRST_EXCEPTION)
+                with lock:
+                    for future in finished:
+                        index = future.result()
+                        if index is not None:
+                            done.add(index)
+                    prefix = written()
+                self._save_state(state_filename, total, piece_size, done, prefix)
+
+                downloaded = progress['bytes']
+                speed = self.calc_speed(started, time.time(), downloaded - resumed_bytes)
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': total,
+                    'tmpfilename': tmpfilename,
+                    'filename': filename,
+                    'speed': speed,
+                    'eta': self.calc_eta(speed, total - downloaded) if speed else None,
+                    'elapsed': time.time() - started,
+                    # The pieces were throttled as they were read
+                    'throttled': True,
+                }, info_dict)
+        except BaseException:
+            stop.set()
+            with lock:
+                prefix = written()
+            self._save_state(state_filename, total, piece_size, done, prefix)
+            raise
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if os.path.exists(state_filename):
+            os.remove(state_filename)
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'status': 'finished',
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'elapsed': time.time() - started,
+        }, info_dict)
+        return True
+
+    def _probe(self, url, headers):
+        """Total size if the server honours range requests, else None"""
+        try:
+            with self.ydl.urlopen(Request(url, headers={**headers, 'Range': 'bytes=0-0'})) as response:
+                content_range = response.headers.get('Content-Range') or ''
+                if response.status == 206 and '/' in content_range:
+                    total = content_range.rsplit('/', 1)[1]
+                    return int(total) if total.isdigit() else None
+        except Exception as e:
+            logging.debug(f"Range probe failed for {url}: {str(e)}")
+        return None
+
+    def _fallback(self, filename, info_dict):
+        fd = HttpFD(self.ydl, self.params)
+        for hook in self._progress_hooks:
+            # HttpFD has its own console reporter
+            if hook != self.report_progress:
+                fd.add_progress_hook(hook)
+        return fd.real_download(filename, info_dict)
+
+    def _load_state(self, state_filename, tmpfilename, total, piece_size):
+        if not self.params.get('continuedl', True) or not os.path.exists(tmpfilename):
+            return set()
+        try:
+            with open(state_filename) as f:
+                state = json.load(f)
+            if state['total'] == total and state['piece_size'] == piece_size:
+                return set(state['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return set()
+
+    def _save_state(self, state_filename, total, piece_size, done, written):
+        # Replaced whole, as streaming readers may look at it any time
+        with open(state_filename + '.tmp', 'w') as f:
+            json.dump({'total': total, 'piece_size': piece_size, 'done': sorted(done), 'written': written}, f)
+        os.replace(state_filename + '.tmp', state_filename)
+
+class FetchingYoutubeDL(YoutubeDL):
+    """YoutubeDL that sends progressive HTTP downloads through ParallelHttpFD
+
+    With the defer_postprocessing param, post-processing (merge, fixups,
+    audio extraction) is not run after the download; it is recorded in
+    `deferred` as plain data for run_postprocessing (see postprocess.py).
+
+    The throttle param, a function of a byte count that may sleep, shapes
+    bandwidth: ParallelHttpFD calls it for every block, other downloaders
+    from a progress hook with the bytes read since their last report.
+    """
+
+    deferred = None
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        # Added even without a throttle, which a pooled instance may get later
+        self.throttle_lock = threading.Lock()
+        self.throttle_seen = {}
+        self.add_progress_hook(self._throttle_progress)
+
+    def reset(self):
+        """Forget the last download, before a pooled instance is reused; see ydl_pool.py"""
+        self.deferred = None
+        self.throttle_seen = {}
+
+    def _throttle_progress(self, d):
+        if not self.params.get('throttle') or d['status'] != 'downloading' or d.get('throttled'):
+            return
+        name = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        with self.throttle_lock:
+            # The first report of a file includes what was resumed, not read
+            previous = self.throttle_seen.get(name, downloaded)
+            self.throttle_seen[name] = max(previous, downloaded)
+        self.params['throttle'](downloaded - previous)
+
+    def post_process(self, filename, info, files_to_move=None):
+        postprocessors = info.get('__postprocessors') or []
+        if not self.params.get('defer_postprocessing') or not (
+                postprocessors or self._pps['post_process'] or self._pps['after_move']):
+            return super().post_process(filename, info, files_to_move)
+
+        self.deferred = {
+            'filename': filename,
+            'info': self.sanitize_info({k: v for k, v in info.items() if k != '__postprocessors'}),
+            'files_to_move': dict(files_to_move or {}),
+            'postprocessors': [type(pp).__name__ for pp in postprocessors],
+        }
+        info['filepath'] = filename
+        return info
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if ((self.params.get('parallel_connections') or 1) < 2 or test or subtitle or name == '-'
+                or get_suitable_downloader(info, self.params) is not HttpFD):
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        fd = ParallelHttpFD(self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        new_info = self._copy_infodict(info)
+        if new_info.get('http_headers') is None:
+            new_info['http_headers'] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
@@ -0,0 +1,110 @@
+from bisect import bisect_right
+from functools import lru_cache
+from operator import itemgetter
+
+# Quality ladders: ascending thresholds, and one label per band (one more
+# label than thresholds, the first covering everything below the lowest)
+HEIGHT_THRESHOLDS = (720, 1080, 1440, 2160)
+HEIGHT_LABELS = ('{height}p', 'HD ({height}p)', 'Full HD ({height}p)', '2K ({height}p)', '4K ({height}p)')
+AUDIO_THRESHOLDS = (128, 192, 256, 320)
+AUDIO_LABELS = (
+    'Audio Only',
+    'Good Audio (128 kbps)',
+    'Standard Audio (192 kbps)',
+    'Premium Audio (256 kbps)',
+    'High Quality Audio (320+ kbps)',
+)
+
+# Everything a format can report
+FORMAT_FIELDS = (
+    'format_id', 'ext', 'quality', 'quality_sort', 'filesize', 'vcodec', 'acodec',
+    'height', 'width', 'fps', 'tbr', 'is_audio_only',
+)
+
+@lru_cache(maxsize=4096)
+def quality_label(height, audio_band, format_note, vcodec, acodec):
+    """Render a quality label, e.g. 'Full HD (1080p) (avc1+mp4a)'; the same few recur across formats and videos"""
+    if height:
+        label = HEIGHT_LABELS[bisect_right(HEIGHT_THRESHOLDS, height)].format(height=height)
+    elif audio_band is not None:
+        label = AUDIO_LABELS[audio_band]
+    else:
+        label = format_note or 'Unknown Quality'
+
+    if vcodec != 'none' and acodec != 'none':
+        return f"{label} ({vcodec}+{acodec})"
+    if vcodec != 'none':
+        return f"{label} (video: {vcodec})"
+    if acodec != 'none':
+        return f"{label} (audio: {acodec})"
+    return label
+
+def normalize_formats(raw_formats):
+    """Filter, dedup and rank yt-dlp formats into API format rows
+
+    Rows are rendered here, once per extraction, with every field: results
+    are cached, so each request only picks its fields= out of them. Labels
+    are only worked out for formats that survive the dedup.
+    """
+    rows = []
+    seen = set()
+    for fmt in raw_formats or ():
+        if not fmt or (fmt.get('vcodec') == 'none' and fmt.get('acodec') == 'none'):
+            continue
+        height = fmt.get('height')
+        ext = fmt.get('ext', 'unknown')
+        vcodec = fmt.get('vcodec', 'none')
+        acodec = fmt.get('acodec', 'none')
+        key = (height, ext, vcodec, acodec)
+        if key in seen:
+            continue
+        seen.add(key)
+        is_audio_only = vcodec == 'none' and acodec != 'none'
+        tbr = fmt.get('tbr')
+        audio_band = bisect_right(AUDIO_THRESHOLDS, tbr or 0) if is_audio_only and not height else None
+        rows.append({
+            'format_id': fmt.get('format_id'),
+            'ext': ext,
+            'quality': quality_label(height, audio_band, fmt.get('format_note', ''), vcodec, acodec),
+            'quality_sort': height or 0,
+            'filesize': fmt.get('filesize'),
+            'vcodec': vcodec,
+            'acodec': acodec,
+            'height': height,
+            'width': fmt.get('width'),
+            'fps': fmt.get('fps'),
+            'tbr': tbr,
+            'is_audio_only': is_audio_only,
+        })
+
+    rows.sort(key=sort_key)
+    return rows
+
+def sort_key(row):
+    """Video before audio, then highest resolution first"""
+    return (row['is_audio_only'], -row['quality_sort'])
+
+def parse_fields(fields):
+    """Validate a fields= projection (list or comma separated string)"""
+    if not fields:
+        return FORMAT_FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    fields = tuple(field.strip() for field in fields if field.strip())
+    unknown = set(fields) - set(FORMAT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown format fields: {', '.join(sorted(unknown))}")
+    return fields
+
+@lru_cache(maxsize=64)
+def _projection(fields):
+    """Picks the values of fields out of a row, as a tuple"""
+    getter = itemgetter(*fields)
+    return getter if len(fields) > 1 else lambda row: (getter(row),)
+
+def render_formats(rows, fields=FORMAT_FIELDS):
+    """Project cached format rows onto the requested fields; all of them are returned as they are"""
+    if tuple(fields) == FORMAT_FIELDS:
+        return rows
+    project = _projection(tuple(fields))
+    return [dict(zip(fields, project(row))) for row in rows]
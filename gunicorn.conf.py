@@ -0,0 +1,17 @@
+import os
+
+# Picked up automatically by `gunicorn main:app` from the project root.
+# Threaded workers keep long-lived /api/progress_stream (SSE) connections from
+# tying up a whole worker process each; they still hold a thread each, so
+# routes.py caps them at SSE_MAX_STREAMS per process, below this thread count.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+def on_starting(server):
+    """Load yt-dlp and its extractors once in the master, before workers fork
+
+    Workers then inherit them instead of each importing ~1800 extractors
+    on boot, and share those pages with the master until written to.
+    """
+    import yt_dlp
+    yt_dlp.YoutubeDL({'quiet': True}).close()
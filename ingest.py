@@ -0,0 +1,186 @@
+import os
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import insert
+from models import Download, Playlist, DownloadStatus
+from app import app, db
+from progress import progress_store
+
+class PlaylistIngestor:
+    """Adds URLs to the queue in the background
+
+    Playlists are inserted with bulk INSERTs in batches and each batch is
+    claimable by workers as soon as it is committed, so large playlists start downloading
+    while the rest is still being ingested and no web worker is blocked.
+    """
+
+    MAX_FINISHED_JOBS = 100
+
+    def __init__(self, download_queue, downloader, max_jobs=None, resolve_workers=None, batch_size=None):
+        self.download_queue = download_queue
+        self.downloader = downloader
+        self.batch_size = batch_size or int(os.environ.get('INGEST_BATCH_SIZE', 500))
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_jobs or int(os.environ.get('INGEST_JOBS', 2)),
+            thread_name_prefix='ingest'
+        )
+        # Resolves flat entries that came back without a URL or title
+        self.resolver = ThreadPoolExecutor(
+            max_workers=resolve_workers or int(os.environ.get('INGEST_RESOLVE_WORKERS', 8)),
+            thread_name_prefix='ingest-resolve'
+        )
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, url, **fields):
+        """Start ingesting url; returns the job's initial state
+
+        fields are Download columns (format_id, quality, priority, ...)
+        applied to every download created from it.
+        """
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'url': url,
+            'status': 'queued',
+            'type': None,
+            'playlist_id': None,
+            'download_id': None,
+            'total': None,
+            'ingested': 0,
+            'error': None,
+        }
+        with self.lock:
+            self._prune()
+            self.jobs[job_id] = job
+        self.executor.submit(self._run, job, fields)
+        return dict(job)
+
+    def _prune(self):
+        # Caller holds the lock; keep only the most recent finished jobs
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('completed', 'failed')]
+        for job_id in finished[:-self.MAX_FINISHED_JOBS]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        """Get a job's current state, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job, **fields):
+        with self.lock:
+            job.update(fields)
+            state = dict(job)
+        progress_store.publish('ingest', state)
+
+    def _run(self, job, fields):
+        with app.app_context():
+            try:
+                self._update(job, status='extracting')
+                info = self.downloader.extract_info(job['url'], extract_flat=True)
+                if info.get('type') == 'playlist':
+                    self._ingest_playlist(job, info, fields)
+                else:
+                    self._ingest_video(job, info, fields)
+            except Exception as e:
+                logging.error(f"Error ingesting {job['url']}: {str(e)}")
+                db.session.rollback()
+                self._update(job, status='failed', error=str(e))
+            finally:
+                db.session.remove()
+
+    def _ingest_video(self, job, info, fields):
+        download = Download(
+            url=job['url'],
+            title=info.get('title', 'Unknown Video'),
+            platform=info.get('extractor', 'unknown'),
+            **fields
+        )
+        db.session.add(download)
+        db.session.commit()
+
+        self.download_queue.add_download(download)
+        self._update(job, status='completed', type='video', download_id=download.id, total=1, ingested=1)
+        progress_store.publish('status', {'id': download.id, 'status': DownloadStatus.PENDING.value})
+
+    def _ingest_playlist(self, job, info, fields):
+        entries = [(index + 1, entry) for index, entry in enumerate(info.get('entries') or []) if entry]
+        platform = info.get('extractor', 'unknown')
+
+        playlist = Playlist(
+            id=str(uuid.uuid4()),
+            title=info.get('title', 'Unknown Playlist'),
+            url=job['url'],
+            platform=platform,
+            total_videos=len(entries)
+        )
+        db.session.add(playlist)
+        db.session.commit()
+        self._update(job, status='ingesting', type='playlist', playlist_id=playlist.id, total=len(entries))
+
+        for start in range(0, len(entries), self.batch_size):
+            batch = self._resolve(entries[start:start + self.batch_size])
+            now = datetime.utcnow()
+            rows = [{
+                'url': entry.get('url') or entry.get('webpage_url'),
+                'title': entry.get('title') or f'Video {index}',
+                'platform': platform,
+                'status': DownloadStatus.PENDING,
+                'downloaded_bytes': 0,
+                'playlist_id': playlist.id,
+                'playlist_index': index,
+                'created_at': now,
+                'updated_at': now,
+                **fields,
+            } for index, entry in batch if entry.get('url') or entry.get('webpage_url')]
+
+            if rows:
+                # One executemany INSERT per batch; the rows are the queue
+                db.session.execute(insert(Download), rows)
+                db.session.commit()
+                self.download_queue.notify()
+
+            self._update(job, ingested=job['ingested'] + len(rows))
+            progress_store.publish('status', {'playlist_id': playlist.id, 'status': DownloadStatus.PENDING.value})
+
+        if job['ingested'] != len(entries):
+            # Entries that could not be resolved are not counted towards completion
+            playlist.total_videos = job['ingested']
+            db.session.commit()
+        self._update(job, status='completed')
+        logging.info(f"Ingested {job['ingested']} videos from playlist {playlist.title}")
+
+    def _resolve(self, batch):
+        """Fill in entries missing a URL or title, in parallel
+
+        Everything else about an entry is resolved lazily by the download
+        worker when it is actually downloaded.
+        """
+        missing = [position for position, (index, entry) in enumerate(batch)
+                   if not (entry.get('url') or entry.get('webpage_url')) or not entry.get('title')]
+        if not missing:
+            return batch
+
+        batch = list(batch)
+        futures = {position: self.resolver.submit(self._resolve_entry, batch[position][1]) for position in missing}
+        for position, future in futures.items():
+            index, entry = batch[position]
+            batch[position] = (index, future.result())
+        return batch
+
+    def _resolve_entry(self, entry):
+        target = entry.get('url') or entry.get('webpage_url') or entry.get('id')
+        if not target:
+            return entry
+        try:
+            with app.app_context():
+                info = self.downloader.extract_info(target, extract_flat=True)
+            return dict(entry, url=entry.get('url') or info.get('webpage_url'),
+                        title=entry.get('title') or info.get('title'))
+        except Exception as e:
+            logging.warning(f"Could not resolve playlist entry {target}: {str(e)}")
+            return entry
@@ -0,0 +1,205 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy import select, delete, insert
+from sqlalchemy.exc import IntegrityError
+from models import ExtractCache
+from app import app, db
+
+# Query parameters that never change what an extractor returns
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'igshid', 'gclid', 'ref', 'ref_src'}
+
+def normalize_url(url):
+    """Normalize a media URL so equivalent links share a cache entry"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip('/')
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if name not in TRACKING_PARAMS and not name.startswith('utm_')]
+
+    if host == 'youtu.be' and path:
+        query.append(('v', path.lstrip('/')))
+        host, path = 'youtube.com', '/watch'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+class MetadataCache:
+    """TTL + LRU cache of extract_info results with single-flight extraction
+
+    Entries are keyed on the normalized URL and the extract_flat flag. With
+    EXTRACT_CACHE_DB enabled, entries are also stored in the ExtractCache
+    table so they survive restarts and are shared across gunicorn workers.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, use_db=None):
+        self.ttl = ttl or int(os.environ.get('EXTRACT_CACHE_TTL', 900))
+        self.max_entries = max_entries or int(os.environ.get('EXTRACT_CACHE_SIZE', 256))
+        if use_db is None:
+            use_db = os.environ.get('EXTRACT_CACHE_DB', '1') == '1'
+        self.use_db = use_db
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    # Bump when the shape of cached extract_info results changes
+    VERSION = 3
+
+    @classmethod
+    def cache_key(cls, url, extract_flat):
+        raw = f"v{cls.VERSION}|{normalize_url(url)}|{'flat' if extract_flat else 'full'}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get_or_extract(self, url, extract_flat, extract):
+        """Return cached info for url, or call extract(url, extract_flat) once"""
+        key = self.cache_key(url, extract_flat)
+        # A full extraction answers a flat request too (e.g. add after preview)
+        keys = [key, self.cache_key(url, False)] if extract_flat else [key]
+
+        with self.lock:
+            for candidate in keys:
+                info = self._get_memory(candidate)
+                if info is not None:
+                    self.hits += 1
+                    return info
+
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = {'event': threading.Event()}
+            else:
+                self.deduplicated += 1
+
+        if not leader:
+            # Identical request already running; wait for its result
+            flight['event'].wait()
+            if 'error' in flight:
+                raise flight['error']
+            return flight['info']
+
+        try:
+            info = self._get_db(keys)
+            if info is not None:
+                with self.lock:
+                    self.db_hits += 1
+            else:
+                with self.lock:
+                    self.misses += 1
+                info = extract(url, extract_flat)
+                if self._cacheable(info):
+                    self._set_db(key, url, info)
+            if self._cacheable(info):
+                with self.lock:
+                    self._set_memory(key, info)
+            flight['info'] = info
+            return info
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            flight['event'].set()
+
+    def peek(self, url, extract_flat):
+        """Return cached info for url without ever extracting, or None"""
+        key = self.cache_key(url, extract_flat)
+        keys = [key, self.cache_key(url, False)] if extract_flat else [key]
+        with self.lock:
+            for candidate in keys:
+                info = self._get_memory(candidate)
+                if info is not None:
+                    self.hits += 1
+                    return info
+        return self._get_db(keys)
+
+    @staticmethod
+    def _cacheable(info):
+        # ignoreerrors turns failed extractions into placeholders; don't keep those
+        return bool(info) and info.get('extractor', 'unknown') != 'unknown'
+
+    def _get_memory(self, key):
+        # Caller holds the lock
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, info = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return info
+
+    def _set_memory(self, key, info):
+        # Caller holds the lock
+        self.entries[key] = (time.monotonic() + self.ttl, info)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _get_db(self, keys):
+        if not self.use_db:
+            return None
+        try:
+            with app.app_context():
+                with db.engine.connect() as connection:
+                    rows = connection.execute(
+                        select(ExtractCache.key, ExtractCache.payload)
+                        .where(ExtractCache.key.in_(keys), ExtractCache.expires_at > datetime.utcnow())
+                    ).all()
+        except Exception as e:
+            logging.error(f"Error reading extract cache: {str(e)}")
+            return None
+        payloads = dict(rows)
+        for key in keys:
+            if key in payloads:
+                return json.loads(payloads[key])
+        return None
+
+    def _set_db(self, key, url, info):
+        if not self.use_db:
+            return
+        now = datetime.utcnow()
+        try:
+            with app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(delete(ExtractCache).where(
+                        (ExtractCache.key == key) | (ExtractCache.expires_at <= now)
+                    ))
+                    connection.execute(insert(ExtractCache).values(
+                        key=key,
+                        url=url,
+                        payload=json.dumps(info, default=str),
+                        created_at=now,
+                        expires_at=now + timedelta(seconds=self.ttl)
+                    ))
+        except IntegrityError:
+            # Another worker process stored the same entry first
+            pass
+        except Exception as e:
+            logging.error(f"Error writing extract cache: {str(e)}")
+
+    def stats(self):
+        """Get hit/miss counters"""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'deduplicated': self.deduplicated,
+            }
+
+metadata_cache = MetadataCache()
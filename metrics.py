@@ -0,0 +1,167 @@
+import time
+import bisect
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, (), value) for labels, value in self.values.items()]
+
+class Histogram:
+    """Distribution of observations in cumulative buckets, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: (list(series['counts']), series['sum']) for labels, series in self.values.items()}
+        samples = []
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels, (('le', _number(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, (), total))
+            samples.append((f'{self.name}_count', labels, (), cumulative))
+        return samples
+
+class Gauge:
+    """Value read when scraped: callback returns {label values tuple: value}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, labels, (), value) for labels, value in self.callback().items()]
+
+class Metrics:
+    """Process-wide metrics, rendered in the Prometheus text format on /metrics
+
+    Recording is a lock and a dict update, cheap enough for hot paths;
+    each process (web or worker.py) has its own.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.queue_wait = self.histogram(
+            'mediatab_download_queue_wait_seconds', 'Time from queued (or due for retry) to started',
+            buckets=(0.5, 1, 5, 15, 60, 300, 900, 3600, 14400))
+        self.download_seconds = self.histogram(
+            'mediatab_download_transfer_seconds', 'Wall time of fetches, by extractor', ('extractor',),
+            buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+        self.download_video_seconds = self.histogram(
+            'mediatab_download_video_seconds', 'Wall time of VideoDownloader.download_video calls',
+            buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+        self.postprocess_seconds = self.histogram(
+            'mediatab_postprocess_seconds', 'Time spent post-processing a download',
+            buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600))
+        self.extract_seconds = self.histogram(
+            'mediatab_extract_info_seconds', 'yt-dlp extract_info latency (api: analyze, download: before a fetch)',
+            ('phase',), buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+        self.claim_seconds = self.histogram(
+            'mediatab_queue_claim_seconds', 'Time a worker took to pick and claim a download',
+            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+        self.worker_busy_seconds = self.counter(
+            'mediatab_worker_busy_seconds_total', 'Time workers spent processing downloads')
+        self.downloaded_bytes = self.counter(
+            'mediatab_downloaded_bytes_total', 'Bytes fetched, by extractor', ('extractor',))
+        self.failures = self.counter(
+            'mediatab_download_failures_total', 'Failed download runs by error class', ('error_class', 'retryable'))
+        self.commits = self.counter('mediatab_db_commits_total', 'Database transactions committed')
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=()):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        return self._register(Gauge(name, help, labelnames, callback))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, extra, value in metric.samples():
+                lines.append(f'{name}{_labels(metric.labelnames, labels, extra)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@event.listens_for(Engine, 'commit')
+def _count_commit(connection):
+    metrics.commits.inc()
+
+class Timer:
+    """Context manager measuring wall time into a histogram"""
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.monotonic() - self.started
+        self.histogram.observe(self.seconds, *self.labels)
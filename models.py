@@ -1,15 +1,20 @@
 from app import db
 from datetime import datetime
 from enum import Enum
+from sqlalchemy import inspect, text
 
 class DownloadStatus(Enum):
     PENDING = "pending"
     DOWNLOADING = "downloading"
+    POSTPROCESSING = "postprocessing"
     COMPLETED = "completed"
     FAILED = "failed"
     PAUSED = "paused"
 
 class Download(db.Model):
+    # Entries of a playlist by status, for reconciling its counters; see PlaylistProgress
+    __table_args__ = (db.Index('ix_download_playlist_id_status', 'playlist_id', 'status'),)
+
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.Text, nullable=False)
     title = db.Column(db.String(500))
@@ -18,16 +23,48 @@ class Download(db.Model):
     quality = db.Column(db.String(50))
     file_size = db.Column(db.BigInteger)
     downloaded_bytes = db.Column(db.BigInteger, default=0)
-    status = db.Column(db.Enum(DownloadStatus), default=DownloadStatus.PENDING)
+    status = db.Column(db.Enum(DownloadStatus), default=DownloadStatus.PENDING, index=True)
     error_message = db.Column(db.Text)
     filename = db.Column(db.String(500))
+    # JSON list of the subtitle files linked next to filename, deleted with it
+    subtitle_files = db.Column(db.Text)
     download_speed = db.Column(db.Float)
     eta = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
-    playlist_id = db.Column(db.String(100))
+    # Last time the file was served; retention evicts least recently used files first
+    last_accessed_at = db.Column(db.DateTime)
+    playlist_id = db.Column(db.String(100), index=True)
     playlist_index = db.Column(db.Integer)
+    # Scheduling: higher priorities run first; downloads are shared fairly
+    # between playlists and the sessions that added them (see FairScheduler)
+    priority = db.Column(db.Integer, default=0)
+    session_key = db.Column(db.String(64))
+    # JSON transfer options overriding the fetcher defaults, and the resulting wall time
+    fetch_options = db.Column(db.Text)
+    # Bandwidth cap in bytes/s on top of the global one; see BandwidthShaper
+    rate_limit = db.Column(db.BigInteger)
+    # Comma separated subtitle languages fetched with the video; none by default
+    subtitle_langs = db.Column(db.String(400))
+    # The video's identity at its site, known once it started; keys per-video caches
+    extractor_key = db.Column(db.String(100))
+    video_id = db.Column(db.String(200))
+    download_seconds = db.Column(db.Float)
+    # ResultStore key of the stored result its file links, once completed
+    result_key = db.Column(db.String(64), index=True)
+    # File a single progressive download is fetched to, so it can be streamed meanwhile
+    stream_path = db.Column(db.String(500))
+    # Merge/transcode stage: when the fetched files were handed over, and the time spent on them
+    postprocess_started_at = db.Column(db.DateTime)
+    postprocess_seconds = db.Column(db.Float)
+    # Failed runs so far, and when a retryable failure may be retried; see retry.py
+    attempts = db.Column(db.Integer)
+    next_retry_at = db.Column(db.DateTime)
+    # Set while a worker holds the row; see DownloadQueue
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
 
 class Playlist(db.Model):
     id = db.Column(db.String(100), primary_key=True)
@@ -36,5 +73,77 @@ class Playlist(db.Model):
     platform = db.Column(db.String(50))
     total_videos = db.Column(db.Integer)
     downloaded_videos = db.Column(db.Integer, default=0)
+    # Kept up to date as entries finish rather than counted; see PlaylistProgress.
+    # total_bytes adds up the sizes known so far, downloaded_bytes those of completed entries
+    failed_videos = db.Column(db.Integer, default=0)
+    downloaded_bytes = db.Column(db.BigInteger, default=0)
+    total_bytes = db.Column(db.BigInteger, default=0)
     status = db.Column(db.Enum(DownloadStatus), default=DownloadStatus.PENDING)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Setting(db.Model):
+    """Runtime settings shared by every process, changed through the API"""
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ExtractCache(db.Model):
+    """Shared, restart-safe backing store for MetadataCache"""
+    key = db.Column(db.String(64), primary_key=True)
+    url = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class StoredFile(db.Model):
+    """A download result in the ResultStore, shared by every Download with its key"""
+    key = db.Column(db.String(64), primary_key=True)
+    # While not ready: the download fetching it
+    owner_id = db.Column(db.Integer)
+    ready = db.Column(db.Boolean, default=False, nullable=False)
+    extractor = db.Column(db.String(100))
+    video_id = db.Column(db.String(200))
+    format_id = db.Column(db.String(100))
+    path = db.Column(db.String(500), index=True)
+    content_hash = db.Column(db.String(64), index=True)
+    size = db.Column(db.BigInteger)
+    # JSON: name suffix -> stored path of files that belong with it (subtitles)
+    extras = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+def upgrade_schema():
+    """Add columns and indexes introduced after the database was created
+
+    db.create_all() only creates missing tables, so databases from earlier
+    versions are brought up to date here. New columns must be nullable,
+    and new enum values are added to Postgres' native enum types.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    ))
+
+    if db.engine.dialect.name == 'postgresql':
+        enum_types = {column.type.name: column.type for table in db.metadata.sorted_tables
+                      for column in table.columns if isinstance(column.type, db.Enum)}
+        # ALTER TYPE ... ADD VALUE can't run inside a transaction before Postgres 12
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            for enum_type in enum_types.values():
+                for value in enum_type.enums:
+                    connection.execute(text(
+                        f"ALTER TYPE {preparer.format_type(enum_type)} ADD VALUE IF NOT EXISTS '{value}'"
+                    ))
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
@@ -0,0 +1,112 @@
+from sqlalchemy import select, update, case, func, literal
+from models import Download, Playlist, DownloadStatus
+from progress import progress_store
+from app import db
+
+class PlaylistProgress:
+    """Playlist counters, kept up to date as their entries change
+
+    Entries finishing add to their playlist's counters with one atomic
+    UPDATE, in the same transaction as their own status change, so neither
+    counting entries nor concurrent workers are involved. Changes the
+    counters don't follow (entries deleted, or resumed after they failed)
+    reconcile the playlist from its entries instead, through the
+    (playlist_id, status) index.
+    """
+
+    def record(self, playlist_id, completed=0, failed=0, downloaded_bytes=0, total_bytes=0):
+        """Add to a playlist's counters; committed with the caller's transaction"""
+        downloaded_videos = func.coalesce(Playlist.downloaded_videos, 0) + completed
+        db.session.execute(
+            update(Playlist)
+            .where(Playlist.id == playlist_id)
+            .values(
+                downloaded_videos=downloaded_videos,
+                failed_videos=func.coalesce(Playlist.failed_videos, 0) + failed,
+                downloaded_bytes=func.coalesce(Playlist.downloaded_bytes, 0) + downloaded_bytes,
+                total_bytes=func.coalesce(Playlist.total_bytes, 0) + total_bytes,
+                status=self._status(downloaded_videos),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    def reconcile(self, playlist_ids=None):
+        """Recount playlists from their entries (those with unset counters when None); commits"""
+        def entries(value, *conditions):
+            return (select(func.coalesce(value, 0))
+                    .where(Download.playlist_id == Playlist.id, *conditions)
+                    .scalar_subquery())
+
+        completed = Download.status == DownloadStatus.COMPLETED
+        query = update(Playlist).execution_options(synchronize_session=False)
+        query = query.where(Playlist.id.in_(playlist_ids)) if playlist_ids is not None \
+            else query.where(Playlist.failed_videos.is_(None))
+        db.session.execute(query.values(
+            downloaded_videos=entries(func.count(Download.id), completed),
+            failed_videos=entries(func.count(Download.id), Download.status == DownloadStatus.FAILED),
+            downloaded_bytes=entries(func.sum(Download.file_size), completed),
+            total_bytes=entries(func.sum(Download.file_size)),
+        ))
+        # Apart, as the counters above are only set once the statement is done
+        db.session.execute(query.values(status=self._status(Playlist.downloaded_videos)))
+        db.session.commit()
+
+    @staticmethod
+    def _status(downloaded_videos):
+        status_type = Playlist.status.type
+        return case(
+            (downloaded_videos >= Playlist.total_videos, literal(DownloadStatus.COMPLETED, status_type)),
+            (downloaded_videos > 0, literal(DownloadStatus.DOWNLOADING, status_type)),
+            else_=Playlist.status
+        )
+
+    def summary(self, playlist):
+        """Aggregate progress of a playlist, from its counters and its running entries
+
+        Bytes not known yet (entries that haven't started) are estimated
+        from the average size of the others.
+        """
+        running = db.session.execute(
+            select(Download.id, Download.downloaded_bytes, Download.file_size, Download.download_speed)
+            .where(Download.playlist_id == playlist.id, Download.status == DownloadStatus.DOWNLOADING)
+        ).all()
+        db.session.commit()
+
+        running_bytes = running_size = speed = 0
+        for download_id, downloaded, file_size, download_speed in running:
+            # This process' own downloads report live values
+            live = progress_store.get(download_id) or {}
+            running_bytes += live.get('downloaded_bytes') or downloaded or 0
+            running_size += live.get('file_size') or file_size or 0
+            speed += live.get('download_speed') or download_speed or 0
+
+        completed = playlist.downloaded_videos or 0
+        failed = playlist.failed_videos or 0
+        downloaded_bytes = (playlist.downloaded_bytes or 0) + running_bytes
+        sized = completed + len(running)
+        remaining = max((playlist.total_videos or 0) - completed - failed - len(running), 0)
+        estimated_total = None
+        if sized and (playlist.downloaded_bytes or running_size):
+            known = (playlist.downloaded_bytes or 0) + running_size
+            estimated_total = known + round(known / sized * remaining)
+        eta = None
+        if estimated_total is not None and speed:
+            eta = round(max(estimated_total - downloaded_bytes, 0) / speed)
+
+        return {
+            'id': playlist.id,
+            'status': playlist.status.value,
+            'total_videos': playlist.total_videos,
+            'completed_videos': completed,
+            'failed_videos': failed,
+            'running_videos': len(running),
+            'pending_videos': remaining,
+            'downloaded_bytes': downloaded_bytes,
+            'total_bytes': playlist.total_bytes or 0,
+            'estimated_total_bytes': estimated_total,
+            'download_speed': speed,
+            'eta': eta,
+            'progress': (completed / playlist.total_videos * 100) if playlist.total_videos else 0,
+        }
+
+playlist_progress = PlaylistProgress()
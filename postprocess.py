@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import yt_dlp.postprocessor
+from yt_dlp import YoutubeDL
+
+# Runs in the pool's child processes, so this module must not import the app
+
+def run_postprocessing(job):
+    """Run yt-dlp's post-processing (merge, fixups, audio extraction) for a fetched file
+
+    job is what FetchingYoutubeDL deferred: the downloaded filename, the
+    info dict, the files to move and the names of the info-level
+    postprocessors, plus the YoutubeDL params that define the rest.
+    """
+    started = time.monotonic()
+    with YoutubeDL(job['params']) as ydl:
+        info = dict(job['info'])
+        info['__postprocessors'] = [getattr(yt_dlp.postprocessor, name)(ydl) for name in job['postprocessors']]
+        info = ydl.post_process(job['filename'], info, job['files_to_move'])
+    return {
+        'filepath': info['filepath'],
+        'requested_subtitles': info.get('requested_subtitles'),
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+class PostProcessingStage:
+    """Bounded process pool that post-processes fetched files off the download workers
+
+    submit() blocks while the stage holds `backlog` jobs (queued or
+    running), so downloads slow down instead of piling up raw files when
+    transcoding falls behind. Completion callbacks run on a separate
+    thread, in submission order per finisher.
+    """
+
+    def __init__(self, workers=None, backlog=None):
+        self.workers = workers or int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1))
+        self.backlog = backlog or int(os.environ.get('POSTPROCESS_BACKLOG', self.workers * 2))
+        self.slots = threading.BoundedSemaphore(self.backlog)
+        self.executor = self._make_executor()
+        self.finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='postprocess-finish')
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.waited_seconds = 0.0
+
+    def submit(self, job, finish):
+        """Queue a job; finish(result, error) runs once it is done
+
+        Returns a Future that resolves after finish has run.
+        """
+        waited = time.monotonic()
+        self.slots.acquire()
+        with self.lock:
+            self.in_flight += 1
+            self.waited_seconds += time.monotonic() - waited
+
+        done = Future()
+
+        def finished(future):
+            self.finisher.submit(self._finish, future, finish, done)
+
+        try:
+            try:
+                future = self.executor.submit(run_postprocessing, job)
+            except BrokenProcessPool:
+                # A child died (e.g. killed for memory); start over with a fresh pool
+                logging.warning("Post-processing pool broke, restarting it")
+                with self.lock:
+                    self.executor = self._make_executor()
+                future = self.executor.submit(run_postprocessing, job)
+        except Exception:
+            self._release(failed=True)
+            raise
+        future.add_done_callback(finished)
+        return done
+
+    def _make_executor(self):
+        # Spawned, not forked: the parent is full of threads and open connections
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _finish(self, future, finish, done):
+        error = future.exception()
+        self._release(failed=error is not None)
+        try:
+            finish(None if error else future.result(), error)
+            done.set_result(None)
+        except Exception as e:
+            logging.error(f"Error finishing post-processing: {str(e)}")
+            done.set_exception(e)
+
+    def _release(self, failed):
+        with self.lock:
+            self.in_flight -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+        self.slots.release()
+
+    def stats(self):
+        """Get the stage's load and how long downloads waited for it"""
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'backlog': self.backlog,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'failed': self.failed,
+                'waited_seconds': round(self.waited_seconds, 3),
+            }
+
+postprocessing = PostProcessingStage()
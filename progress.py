@@ -0,0 +1,306 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, case
+from models import Download, DownloadStatus
+from app import app, db
+
+class ProgressStore:
+    """Thread-safe registry of live download progress
+
+    Workers write into it from the yt-dlp progress hook and the API reads
+    live fields from it, so polling clients never touch the DB for active
+    downloads. Samples are persisted to the DB in batches.
+
+    Downloads run by other processes (worker.py, other gunicorn workers)
+    are followed from the DB: while anyone watches (event streams, file
+    streams), a thread reads the rows whose updated_at moved every
+    tail_interval, and turns them into the same progress and status
+    events. They lag by up to a flush plus a tail interval.
+    """
+
+    # Flushed to the row; file_size isn't, as hooks report it per format or
+    # fragment (or not at all), and the downloader sets the row's size itself
+    FIELDS = ('downloaded_bytes', 'download_speed', 'eta')
+    # Read back from the rows of downloads running elsewhere
+    TAIL_FIELDS = FIELDS + ('file_size',)
+
+    PRIVATE_FIELDS = ('flushed_bytes', 'version')
+
+    # Tailing stops this long after the last watcher left
+    TAIL_IDLE_SECONDS = 60
+    # Rows are re-read with this much overlap, for clock skew between hosts
+    TAIL_SLACK = timedelta(seconds=2)
+    # Last known status per download, so tailed transitions aren't published twice
+    MAX_STATUSES = 10000
+
+    def __init__(self, flush_interval=None, flush_delta=None, event_backlog=None):
+        # Flush when this many seconds passed since the last flush...
+        self.flush_interval = flush_interval or float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 2.0))
+        # ...or when any download advanced by this fraction of its size
+        self.flush_delta = flush_delta or float(os.environ.get('PROGRESS_FLUSH_DELTA', 0.05))
+        self.entries = {}
+        self.dirty = set()
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        # Every change bumps the sequence; SSE clients resume from it via Last-Event-ID
+        self.changed = threading.Condition(self.lock)
+        self.sequence = 0
+        self.events = deque(maxlen=event_backlog or int(os.environ.get('SSE_EVENT_BACKLOG', 1000)))
+        self.events_floor = 0
+        # Downloads running in other processes, as last flushed; see _tail
+        self.tail_interval = float(os.environ.get('PROGRESS_TAIL_INTERVAL', 1.0))
+        self.remote = {}
+        self.statuses = {}
+        self.last_watched = None
+        self.tailer = None
+        self.updates = 0
+        self.commits = 0
+        self.commits_avoided = 0
+
+    def start(self, download_id, **fields):
+        """Register a download as live, with its display fields"""
+        with self.lock:
+            entry = self.entries.setdefault(download_id, {'flushed_bytes': 0})
+            entry.update(fields)
+            entry.setdefault('status', 'downloading')
+            self._touch(entry)
+            self._publish('status', {'id': download_id, 'status': entry['status']})
+
+    def update(self, download_id, downloaded_bytes, file_size, speed, eta):
+        """Record a progress sample, flushing if a threshold is crossed"""
+        with self.lock:
+            entry = self.entries.setdefault(download_id, {'flushed_bytes': 0})
+            entry.update({
+                'downloaded_bytes': downloaded_bytes or 0,
+                # Hooks don't always know the total; keep the last one they did
+                'file_size': file_size or entry.get('file_size') or 0,
+                'download_speed': speed or 0,
+                'eta': eta or 0,
+            })
+            self.dirty.add(download_id)
+            self.updates += 1
+            self._touch(entry)
+
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+            if not due and entry['file_size']:
+                advanced = entry['downloaded_bytes'] - entry['flushed_bytes']
+                due = advanced / entry['file_size'] >= self.flush_delta
+            if not due:
+                self.commits_avoided += 1
+
+        if due:
+            self.flush()
+
+    def get(self, download_id):
+        """Get the live fields of a download, or None if it isn't active"""
+        with self.lock:
+            entry = self.entries.get(download_id) or self.remote.get(download_id)
+            return self._public(download_id, entry) if entry else None
+
+    def snapshot(self):
+        """Get the live fields of every active download, this process' and tailed ones"""
+        with self.lock:
+            return [self._public(download_id, entry) for entries in (self.entries, self.remote)
+                    for download_id, entry in entries.items()]
+
+    @staticmethod
+    def _public(download_id, entry):
+        data = {key: value for key, value in entry.items() if key not in ProgressStore.PRIVATE_FIELDS}
+        data['id'] = download_id
+        file_size = entry.get('file_size')
+        data['progress'] = (entry.get('downloaded_bytes', 0) / file_size * 100) if file_size else 0
+        return data
+
+    def publish(self, event, data):
+        """Publish an event (e.g. a status transition) to SSE clients"""
+        with self.lock:
+            self._publish(event, data)
+
+    def _publish(self, event, data):
+        # Caller holds the lock
+        self.sequence += 1
+        if len(self.events) == self.events.maxlen:
+            self.events_floor = self.events[0][0]
+        self.events.append((self.sequence, event, data))
+        if event == 'status' and 'id' in data:
+            if len(self.statuses) >= self.MAX_STATUSES:
+                for download_id in list(self.statuses)[:self.MAX_STATUSES // 2]:
+                    del self.statuses[download_id]
+            self.statuses[data['id']] = data['status']
+        self.changed.notify_all()
+
+    def _touch(self, entry):
+        # Caller holds the lock
+        self.sequence += 1
+        entry['version'] = self.sequence
+        self.changed.notify_all()
+
+    def wait_events(self, last_id, timeout):
+        """Block until something changed after last_id, or timeout
+
+        Returns (cursor, events, reset). Events are (id, event, data) tuples:
+        logged status events plus one coalesced 'progress' event per download
+        that changed. reset is True when last_id is older than the backlog
+        (or from a previous process), so the client must reload its state.
+        """
+        self.watch()
+        with self.changed:
+            if self.sequence <= last_id:
+                self.changed.wait(timeout)
+
+            reset = last_id > self.sequence or last_id < self.events_floor
+            if reset:
+                return self.sequence, [], True
+
+            events = [event for event in self.events if event[0] > last_id]
+            for download_id, entry in [*self.entries.items(), *self.remote.items()]:
+                if entry.get('version', 0) > last_id:
+                    events.append((entry['version'], 'progress', self._public(download_id, entry)))
+            events.sort(key=lambda event: event[0])
+            return self.sequence, events, False
+
+    def wait_progress(self, download_id, version, timeout):
+        """Block until a download's entry differs from version, or timeout
+
+        Returns the entry's current version (None when it isn't tracked).
+        Downloads running in other processes signal as their flushed rows
+        are tailed.
+        """
+        self.watch()
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                entry = self.entries.get(download_id) or self.remote.get(download_id)
+                current = entry.get('version') if entry else None
+                remaining = deadline - time.monotonic()
+                if current != version or remaining <= 0:
+                    return current
+                self.changed.wait(remaining)
+
+    def watch(self):
+        """Note that progress is followed here, tailing other processes' downloads meanwhile"""
+        with self.lock:
+            self.last_watched = time.monotonic()
+            if self.tailer is None:
+                self.tailer = threading.Thread(target=self._tail, name='progress-tail', daemon=True)
+                self.tailer.start()
+
+    def _tail(self):
+        since = None
+        with app.app_context():
+            while True:
+                time.sleep(self.tail_interval)
+                with self.lock:
+                    watched = time.monotonic() - self.last_watched < self.TAIL_IDLE_SECONDS
+                    if not watched:
+                        self.remote.clear()
+                if not watched:
+                    since = None
+                    continue
+                try:
+                    since = self._tail_rows(since)
+                except Exception as e:
+                    logging.error(f"Error tailing download progress: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _tail_rows(self, since):
+        """Apply rows changed since the last call (running rows on the first); returns the next since"""
+        now = datetime.utcnow()
+        query = select(Download.id, Download.status, Download.title, Download.url, Download.platform,
+                       Download.playlist_id, *[getattr(Download, field) for field in self.TAIL_FIELDS])
+        if since is None:
+            query = query.where(Download.status == DownloadStatus.DOWNLOADING)
+        else:
+            query = query.where(Download.updated_at >= since - self.TAIL_SLACK)
+        rows = db.session.execute(query).all()
+        with self.lock:
+            unseen = set(self.remote) - {row.id for row in rows}
+        # Running rows that vanished were cancelled
+        gone = unseen - set(db.session.execute(select(Download.id).where(Download.id.in_(unseen))).scalars()) \
+            if unseen else set()
+        db.session.commit()
+
+        with self.lock:
+            for row in rows:
+                if row.id in self.entries:
+                    # Running here; reported first hand
+                    continue
+                status = row.status.value
+                if row.status == DownloadStatus.DOWNLOADING:
+                    fields = {field: getattr(row, field) or 0 for field in self.TAIL_FIELDS}
+                    entry = self.remote.get(row.id)
+                    if entry is None or any(entry.get(field) != value for field, value in fields.items()):
+                        entry = self.remote[row.id] = dict(fields, status=status, title=row.title, url=row.url,
+                                                           platform=row.platform, playlist_id=row.playlist_id)
+                        self._touch(entry)
+                else:
+                    self.remote.pop(row.id, None)
+                if since is None:
+                    self.statuses.setdefault(row.id, status)
+                elif self.statuses.get(row.id) != status:
+                    self._publish('status', {'id': row.id, 'status': status})
+            for download_id in gone:
+                self.remote.pop(download_id, None)
+                self._publish('status', {'id': download_id, 'status': 'cancelled'})
+        return now
+
+    def pop(self, download_id):
+        """Stop tracking a download and return its last progress sample
+
+        Terminal states are written by the caller, so pending samples for
+        this download are dropped instead of flushed.
+        """
+        with self.lock:
+            self.dirty.discard(download_id)
+            return self.entries.pop(download_id, None) or {}
+
+    def flush(self):
+        """Write all dirty progress samples in a single multi-row UPDATE"""
+        with self.lock:
+            rows = {download_id: dict(self.entries[download_id]) for download_id in self.dirty
+                    if download_id in self.entries}
+            for download_id, entry in rows.items():
+                self.entries[download_id]['flushed_bytes'] = entry['downloaded_bytes']
+            self.dirty.clear()
+            self.last_flush = time.monotonic()
+
+        if not rows:
+            return
+
+        values = {
+            field: case({download_id: entry[field] for download_id, entry in rows.items()}, value=Download.id)
+            for field in self.FIELDS
+        }
+        try:
+            # Hooks may fire on yt-dlp helper threads, so don't rely on the caller's context
+            with app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        update(Download.__table__)
+                        # A batch taken before a download finished, paused or failed
+                        # must not overwrite what that transition wrote
+                        .where(Download.id.in_(rows.keys()), Download.status == DownloadStatus.DOWNLOADING)
+                        .values(**values)
+                    )
+            with self.lock:
+                self.commits += 1
+        except Exception as e:
+            logging.error(f"Error flushing download progress: {str(e)}")
+
+    def stats(self):
+        """Get counters describing how much DB traffic was batched away"""
+        with self.lock:
+            return {
+                'tracked': len(self.entries),
+                'updates': self.updates,
+                'commits': self.commits,
+                'commits_avoided': self.commits_avoided,
+            }
+
+progress_store = ProgressStore()
@@ -1,130 +1,638 @@
-import threading
-import queue
+import os
 import time
+import heapq
+import socket
+import itertools
+import threading
+import uuid
 import logging
-from models import Download, Playlist, DownloadStatus
-from app import db
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, and_, or_, func
+from models import Download, DownloadStatus, Setting
+from app import app, db
 from downloader import VideoDownloader
+from postprocess import postprocessing
+from bandwidth import bandwidth, parse_rate
+from disk_space import disk_space, retention
+from retry import classify_error, CircuitBreakers
+from metrics import metrics, Timer
+
+def platform_key(platform):
+    """Normalize an extractor name (e.g. 'youtube:tab') to a platform key"""
+    return (platform or 'unknown').split(':')[0].lower()
+
+def parse_platform_limits(value):
+    """Parse a "youtube=2,instagram=1,default=3" string into a dict"""
+    limits = {}
+    for part in (value or '').split(','):
+        if '=' not in part:
+            continue
+        name, limit = part.split('=', 1)
+        try:
+            limits[name.strip().lower()] = max(1, int(limit))
+        except ValueError:
+            logging.warning(f"Ignoring invalid platform limit: {part}")
+    return limits
+
+def schedule_group(playlist_id, session_key):
+    """Fair-share group of a download: its playlist, else the session that added it"""
+    return f"playlist:{playlist_id}" if playlist_id else f"session:{session_key or ''}"
+
+class FairScheduler:
+    """Picks the next download: priority first, fair share within a priority
+
+    Each priority level is a heap ordered by start-time fair queuing tags,
+    so groups (playlists, sessions) take turns instead of one big playlist
+    running to completion before anything queued after it. Below-normal
+    items are promoted one level per aging_seconds waited (via a timer
+    heap) until they reach normal priority, so they are never starved by
+    normal traffic; normal items don't age, which would let an old playlist
+    overtake everything added after it. Items waiting to be retried sit in
+    a timer heap until they are due.
+
+    Within a level, each platform has its own heap and pop takes the lowest
+    tag among the heads of platforms that aren't blocked, so a platform at
+    its cap is passed over without touching its backlog. Items too large
+    for the free disk space are parked in a heap by size until there is
+    room. push/pop are O(log n) (plus the number of levels and platforms);
+    entries that are replaced or discarded are skipped lazily.
+    """
+
+    MIN_PRIORITY = -10
+    MAX_PRIORITY = 10
+    # Aging stops at normal priority
+    AGING_CEILING = 0
+
+    def __init__(self, aging_seconds=None):
+        self.aging_seconds = aging_seconds or float(os.environ.get('QUEUE_AGING_SECONDS', 600))
+        self.entries = {}
+        self.levels = {}
+        self.virtual_time = {}
+        self.finish_tags = {}
+        self.promotions = []
+        self.delayed = []
+        self.oversized = []
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, download_id):
+        return download_id in self.entries
+
+    def priority_of(self, download_id):
+        entry = self.entries.get(download_id)
+        return entry['priority'] if entry else None
+
+    def push(self, download_id, priority, enqueued_at, group, platform, now=None, size=None, not_before=None):
+        """Add or replace a runnable item; enqueued_at is a unix timestamp
+
+        size is what the item still has to write to disk, when known; an
+        item with a not_before timestamp isn't popped before then.
+        """
+        now = now if now is not None else time.time()
+        priority = min(max(priority or 0, self.MIN_PRIORITY), self.MAX_PRIORITY)
+        entry = {
+            'id': download_id,
+            'priority': priority,
+            'enqueued_at': enqueued_at,
+            'group': group,
+            'platform': platform,
+            'size': size,
+        }
+        self.entries[download_id] = entry
+        if not_before and not_before > now:
+            heapq.heappush(self.delayed, (not_before, next(self.sequence), download_id, entry))
+        else:
+            self._schedule(entry, now)
+
+    def _schedule(self, entry, now):
+        aged = int(max(now - entry['enqueued_at'], 0) // self.aging_seconds)
+        self._place(entry, max(entry['priority'], min(entry['priority'] + aged, self.AGING_CEILING)))
+
+    def discard(self, download_id):
+        self.entries.pop(download_id, None)
+
+    def pop(self, blocked=(), room=None, now=None):
+        """Remove and return the next entry, passing over blocked platforms and items larger than room"""
+        now = now if now is not None else time.time()
+        self._release_delayed(now)
+        self._promote(now)
+        self._release_oversized(room)
+        try:
+            for level in sorted(self.levels, reverse=True):
+                best = None
+                for platform, heap in self.levels[level].items():
+                    if platform in blocked:
+                        continue
+                    self._clean_head(heap, level, room)
+                    if heap and (best is None or heap[0] < best[0]):
+                        best = heap
+                if best is not None:
+                    tag, _, download_id, entry = heapq.heappop(best)
+                    del self.entries[download_id]
+                    self.virtual_time[level] = tag
+                    return entry
+            return None
+        finally:
+            self._prune()
+
+    def _clean_head(self, heap, level, room):
+        # Drop stale nodes off the top, and park items that don't fit on disk
+        while heap:
+            _, _, download_id, entry = heap[0]
+            if self.entries.get(download_id) is not entry or entry['level'] != level:
+                heapq.heappop(heap)
+            elif room is not None and (entry['size'] or 0) > room:
+                heapq.heappush(self.oversized, (entry['size'], next(self.sequence), level, heapq.heappop(heap)))
+            else:
+                return
+
+    def _release_oversized(self, room):
+        while self.oversized and (room is None or self.oversized[0][0] <= room):
+            _, _, level, node = heapq.heappop(self.oversized)
+            entry = node[3]
+            if self.entries.get(entry['id']) is entry and entry['level'] == level:
+                heapq.heappush(self.levels.setdefault(level, {}).setdefault(entry['platform'], []), node)
+
+    def _place(self, entry, level):
+        # Start tag: the level's virtual time, or right after the group's previous item
+        key = (level, entry['group'])
+        start = max(self.virtual_time.get(level, 0), self.finish_tags.get(key, 0))
+        self.finish_tags[key] = start + 1
+        entry['level'] = level
+        heap = self.levels.setdefault(level, {}).setdefault(entry['platform'], [])
+        heapq.heappush(heap, (start, next(self.sequence), entry['id'], entry))
+        if level < self.AGING_CEILING:
+            promote_at = entry['enqueued_at'] + (level - entry['priority'] + 1) * self.aging_seconds
+            heapq.heappush(self.promotions, (promote_at, next(self.sequence), entry['id'], entry))
+
+    def _release_delayed(self, now):
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, download_id, entry = heapq.heappop(self.delayed)
+            if self.entries.get(download_id) is entry:
+                self._schedule(entry, now)
+
+    def _promote(self, now):
+        while self.promotions and self.promotions[0][0] <= now:
+            _, _, download_id, entry = heapq.heappop(self.promotions)
+            if self.entries.get(download_id) is entry and entry['level'] < self.AGING_CEILING:
+                self._place(entry, entry['level'] + 1)
+
+    def _prune(self):
+        # Drop fair-share bookkeeping for groups the virtual clock has passed
+        if len(self.finish_tags) > 2 * len(self.entries) + 100:
+            self.finish_tags = {key: tag for key, tag in self.finish_tags.items()
+                                if tag > self.virtual_time.get(key[0], 0)}
+        for level, platforms in list(self.levels.items()):
+            for platform in [platform for platform, heap in platforms.items() if not heap]:
+                del platforms[platform]
+            if not platforms:
+                del self.levels[level]
 
 class DownloadQueue:
-    def __init__(self):
-        self.queue = queue.Queue()
+    """Worker pool that uses the Download table itself as a durable queue
+
+    PENDING rows are the queue. Each process mirrors them in a FairScheduler
+    that decides what runs next; a worker claims the chosen row atomically
+    with a conditional UPDATE and holds a lease on it that a heartbeat renews. Rows whose lease expired,
+    e.g. because their process died, go back to PENDING. Any number of
+    processes on any number of hosts can run a DownloadQueue against the
+    same database; see worker.py. Rows handed to the post-processing stage
+    stay leased (and POSTPROCESSING) until it is done with them, while the
+    worker moves on to the next row. Rows known to need more disk space
+    than is available are passed over until there is room (see DiskSpace),
+    which the retention sweeper makes. Failed rows to be retried come back
+    at their next_retry_at, and platforms whose circuit breaker is open get
+    nothing dispatched (see retry.py).
+    """
+
+    # Seconds of overlap between scheduler refreshes, to absorb clock skew
+    REFRESH_SLACK = 10
+    # Setting holding the global bandwidth limit in bytes/s
+    BANDWIDTH_SETTING = 'bandwidth_limit'
+
+    def __init__(self, num_workers=None, platform_limits=None, lease_seconds=None, poll_interval=None):
+        self.num_workers = num_workers or int(os.environ.get('DOWNLOAD_WORKERS', 3))
+        if platform_limits is None:
+            platform_limits = parse_platform_limits(os.environ.get('PLATFORM_CONCURRENCY', 'youtube=2'))
+        self.platform_limits = dict(platform_limits)
+        self.default_platform_limit = self.platform_limits.pop('default', self.num_workers)
+        self.lease_seconds = lease_seconds or int(os.environ.get('DOWNLOAD_LEASE_SECONDS', 60))
+        # Rows committed by other processes are noticed within this many seconds;
+        # rows added in this process wake a worker immediately
+        self.poll_interval = poll_interval or float(os.environ.get('QUEUE_POLL_INTERVAL', 2))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
         self.active_downloads = {}
-        self.paused_downloads = set()
+        # download id -> 'paused' or 'cancelled', polled by the running transfer
+        self.interrupts = {}
+        # Rows in the post-processing stage, still leased by this process
+        self.postprocessing = set()
+        self.platform_active = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.generation = 0
+        self.claim_lock = threading.Lock()
+        self.scheduler = FairScheduler()
+        self.breakers = CircuitBreakers()
+        self.last_refresh = None
+        self.stop_event = threading.Event()
         self.is_running = False
-        self.worker_thread = None
+        self.workers = []
         self.downloader = VideoDownloader()
-        self.current_download = None
-    
+
     def start_worker(self):
-        """Start the worker thread"""
-        if not self.is_running:
+        """Recover stale rows, then start the worker pool and lease heartbeat"""
+        with self.lock:
+            if self.is_running:
+                return
             self.is_running = True
-            self.worker_thread = threading.Thread(target=self._worker, daemon=True)
-            self.worker_thread.start()
-            logging.info("Download worker started")
-    
+            self.stop_event.clear()
+
+        with app.app_context():
+            try:
+                self._recover_stale(startup=True)
+                self._sync_bandwidth()
+            finally:
+                db.session.remove()
+
+        workers = [threading.Thread(target=self._worker, name=f"download-worker-{index}", daemon=True)
+                   for index in range(self.num_workers)]
+        workers.append(threading.Thread(target=self._heartbeat, name="download-heartbeat", daemon=True))
+        workers.append(threading.Thread(target=self._sweeper, name="download-sweeper", daemon=True))
+        for worker in workers:
+            worker.start()
+        self.workers = workers
+        logging.info(f"Download worker pool {self.worker_id} started with {self.num_workers} workers")
+
     def stop_worker(self):
-        """Stop the worker thread"""
-        self.is_running = False
-        if self.worker_thread:
-            self.worker_thread.join()
-            logging.info("Download worker stopped")
-    
+        """Stop the worker pool (running downloads finish first)"""
+        with self.wakeup:
+            if not self.is_running:
+                return
+            self.is_running = False
+            self.wakeup.notify_all()
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        logging.info("Download worker pool stopped")
+
+    def notify(self):
+        """Wake idle workers: new PENDING rows were committed"""
+        with self.wakeup:
+            self.generation += 1
+            self.wakeup.notify_all()
+
     def _worker(self):
-        """Worker thread that processes the download queue"""
-        while self.is_running:
-            try:
-                if not self.queue.empty():
-                    download = self.queue.get(timeout=1)
-                    
-                    if download.id not in self.paused_downloads:
-                        self.current_download = {
-                            'id': download.id,
-                            'title': download.title,
-                            'url': download.url
-                        }
-                        
-                        try:
-                            self.downloader.download_video(download)
-                            
-                            # Update playlist progress if this is part of a playlist
-                            if download.playlist_id:
-                                self._update_playlist_progress(download.playlist_id)
-                            
-                        except Exception as e:
-                            logging.error(f"Download failed: {str(e)}")
-                        
-                        finally:
-                            self.current_download = None
-                    
-                    else:
-                        # Re-queue paused download
-                        self.queue.put(download)
-                
-                else:
-                    time.sleep(1)
-            
-            except queue.Empty:
+        """Worker thread that claims and processes queued downloads"""
+        # Each worker owns an app context, and with it its own scoped DB session
+        with app.app_context():
+            while self.is_running:
+                with self.lock:
+                    generation = self.generation
+
+                try:
+                    with Timer(metrics.claim_seconds):
+                        claimed = self._claim_next()
+                except Exception as e:
+                    logging.error(f"Error claiming download: {str(e)}")
+                    db.session.rollback()
+                    claimed = None
+
+                if claimed is None:
+                    # Nothing claimable; sleep until notified or the next poll
+                    with self.wakeup:
+                        if self.is_running and self.generation == generation:
+                            self.wakeup.wait(self.poll_interval)
+                    continue
+
+                download_id, platform = claimed
+                started = time.monotonic()
+                try:
+                    self._process(download_id, platform)
+                except Exception as e:
+                    logging.error(f"Worker error: {str(e)}")
+                finally:
+                    self._release(download_id, platform)
+                    db.session.remove()
+                    metrics.worker_busy_seconds.inc(time.monotonic() - started)
+
+    def _platform_limit(self, platform):
+        return self.platform_limits.get(platform, self.default_platform_limit)
+
+    def _claim_next(self):
+        """Atomically claim the next PENDING row picked by the scheduler
+
+        Returns (download_id, platform key), or None if nothing is claimable.
+        """
+        with self.claim_lock:
+            self._refresh_schedule()
+            with self.lock:
+                capped = {platform for platform, count in self.platform_active.items()
+                          if count >= self._platform_limit(platform)}
+            capped |= self.breakers.blocked()
+            room = disk_space.available()
+
+            while True:
+                entry = self.scheduler.pop(blocked=capped, room=room)
+                if entry is None:
+                    db.session.commit()
+                    return None
+
+                # Rows claimed by another process, paused or deleted since the
+                # last refresh fail the conditional UPDATE and are simply dropped.
+                # On PostgreSQL the row is locked first, skipping rows another
+                # process is claiming right now instead of waiting for its commit
+                download_id = entry['id']
+                now = datetime.utcnow()
+                claimable = and_(Download.id == download_id, Download.status == DownloadStatus.PENDING,
+                                 or_(Download.next_retry_at.is_(None), Download.next_retry_at <= now))
+                # Last set PENDING (requeued, resumed, failed for a retry) or due again, for the queue wait
+                queued = db.session.execute(
+                    select(Download.updated_at, Download.next_retry_at).where(claimable)
+                    .with_for_update(skip_locked=True)
+                ).first()
+                if queued is None:
+                    db.session.commit()
+                    continue
+                result = db.session.execute(
+                    update(Download)
+                    .where(claimable)
+                    .values(status=DownloadStatus.DOWNLOADING,
+                            lease_owner=self.worker_id,
+                            lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                if result.rowcount == 1:
+                    queued_since = max(filter(None, queued))
+                    metrics.queue_wait.observe(max((now - queued_since).total_seconds(), 0))
+                    key = entry['platform']
+                    self.breakers.started(key)
+                    with self.lock:
+                        self.platform_active[key] = self.platform_active.get(key, 0) + 1
+                        self.active_downloads[download_id] = {'id': download_id}
+                    return download_id, key
+
+    def _refresh_schedule(self):
+        """Feed PENDING rows that changed since the last refresh into the scheduler
+
+        The first refresh loads every PENDING row; later ones only read rows
+        whose updated_at moved (new, resumed, requeued or re-prioritized),
+        with some slack for clock skew between hosts.
+        """
+        now = datetime.utcnow()
+        query = (select(Download.id, Download.priority, Download.created_at, Download.playlist_id,
+                        Download.session_key, Download.platform, Download.file_size, Download.downloaded_bytes,
+                        Download.next_retry_at)
+                 .where(Download.status == DownloadStatus.PENDING)
+                 .order_by(Download.created_at, Download.id))
+        if self.last_refresh is not None:
+            query = query.where(Download.updated_at >= self.last_refresh - timedelta(seconds=self.REFRESH_SLACK))
+
+        for (download_id, priority, created_at, playlist_id, session_key, platform,
+             file_size, downloaded_bytes, next_retry_at) in db.session.execute(query):
+            priority = priority or 0
+            if self.scheduler.priority_of(download_id) == priority:
                 continue
-            except Exception as e:
-                logging.error(f"Worker error: {str(e)}")
-    
+            enqueued_at = (created_at or now).replace(tzinfo=timezone.utc).timestamp()
+            # Known once a run got past extraction, e.g. one deferred for disk space
+            size = file_size - (downloaded_bytes or 0) if file_size else None
+            not_before = next_retry_at.replace(tzinfo=timezone.utc).timestamp() if next_retry_at else None
+            self.scheduler.push(download_id, priority, enqueued_at,
+                                schedule_group(playlist_id, session_key), platform_key(platform),
+                                size=size, not_before=not_before)
+        self.last_refresh = now
+
+    def _release(self, download_id, platform):
+        """Drop the lease on a finished row (unless it is post-processing) and free its platform slot"""
+        with self.lock:
+            postprocessing = download_id in self.postprocessing
+        if not postprocessing:
+            self._drop_lease(download_id)
+
+        with self.wakeup:
+            self.active_downloads.pop(download_id, None)
+            self.interrupts.pop(download_id, None)
+            self.platform_active[platform] -= 1
+            # A capped platform may have become claimable again
+            self.generation += 1
+            self.wakeup.notify_all()
+
+    def _drop_lease(self, download_id):
+        try:
+            db.session.execute(
+                update(Download)
+                .where(Download.id == download_id, Download.lease_owner == self.worker_id)
+                .values(lease_owner=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception as e:
+            logging.error(f"Error releasing download {download_id}: {str(e)}")
+            db.session.rollback()
+
+    def _postprocessed(self, download_id):
+        """Release a row the post-processing stage is done with"""
+        with app.app_context():
+            try:
+                with self.lock:
+                    self.postprocessing.discard(download_id)
+                self._drop_lease(download_id)
+            finally:
+                db.session.remove()
+
+    def _process(self, download_id, platform):
+        """Download a single claimed row inside the worker's session"""
+        download = db.session.get(Download, download_id)
+        if download is None:
+            # Cancelled and deleted right after it was claimed
+            self.breakers.record(platform, None)
+            return
+
+        self.active_downloads[download_id] = {
+            'id': download.id,
+            'title': download.title,
+            'url': download.url
+        }
+        try:
+            pending = self.downloader.download_video(download, should_stop=lambda: self.interrupts.get(download_id))
+
+            if pending is not None:
+                # Being post-processed; this worker moves on and the stage finishes the row
+                with self.lock:
+                    self.postprocessing.add(download_id)
+                pending.add_done_callback(lambda future: self._postprocessed(download_id))
+            self.breakers.record(platform, True)
+
+        except Exception as e:
+            retryable, label = classify_error(e)
+            # Only failures that say the platform is in trouble count against it
+            self.breakers.record(platform, not retryable)
+            logging.error(f"Download failed ({label}): {str(e)}")
+
+    def _heartbeat(self):
+        """Renew leases, stop downloads paused or cancelled elsewhere, rebalance bandwidth, requeue expired rows"""
+        renew_interval = self.lease_seconds / 3
+        last_renewal = time.monotonic()
+        with app.app_context():
+            while not self.stop_event.wait(min(self.poll_interval, renew_interval)):
+                try:
+                    active_ids = list(self.active_downloads)
+                    if active_ids:
+                        self._check_interrupts(active_ids)
+                        self._sync_bandwidth()
+
+                    if time.monotonic() - last_renewal >= renew_interval:
+                        last_renewal = time.monotonic()
+                        with self.lock:
+                            leased_ids = active_ids + list(self.postprocessing)
+                        if leased_ids:
+                            db.session.execute(
+                                update(Download)
+                                .where(Download.id.in_(leased_ids), Download.lease_owner == self.worker_id)
+                                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+                                .execution_options(synchronize_session=False)
+                            )
+                            db.session.commit()
+                        self._recover_stale()
+                except Exception as e:
+                    logging.error(f"Lease heartbeat error: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _sweeper(self):
+        """Apply the retention policy periodically, making room for deferred downloads"""
+        with app.app_context():
+            retention.run(self.stop_event, self.worker_id)
+
+    def _check_interrupts(self, active_ids):
+        """Interrupt running downloads whose rows were paused or deleted by another process"""
+        statuses = dict(db.session.execute(
+            select(Download.id, Download.status).where(Download.id.in_(active_ids))
+        ).all())
+        db.session.commit()
+        for download_id in active_ids:
+            status = statuses.get(download_id)
+            if status is None:
+                self._interrupt(download_id, 'cancelled')
+            elif status == DownloadStatus.PAUSED:
+                self._interrupt(download_id, 'paused')
+
+    def _interrupt(self, download_id, reason):
+        """Ask a download running in this process to stop at its next progress update"""
+        with self.lock:
+            if download_id in self.active_downloads and self.interrupts.get(download_id) != 'cancelled':
+                self.interrupts[download_id] = reason
+
+    def _recover_stale(self, startup=False):
+        """Put DOWNLOADING and POSTPROCESSING rows whose worker is gone back to PENDING
+
+        Fetched files are still in the store's partial directory, so a
+        requeued POSTPROCESSING row skips straight to post-processing.
+
+        At startup this also covers rows without any lease, left behind by
+        versions that did not take leases.
+        """
+        stale = Download.lease_expires_at < datetime.utcnow()
+        if startup:
+            stale = or_(stale, Download.lease_owner.is_(None))
+        result = db.session.execute(
+            update(Download)
+            .where(Download.status.in_([DownloadStatus.DOWNLOADING, DownloadStatus.POSTPROCESSING]), stale)
+            .values(status=DownloadStatus.PENDING, lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logging.warning(f"Requeued {result.rowcount} downloads with expired leases")
+            self.notify()
+
     def add_download(self, download):
-        """Add a download to the queue"""
-        self.queue.put(download)
-        if not self.is_running:
-            self.start_worker()
+        """Wake a worker for a newly committed PENDING download"""
+        self.notify()
         logging.info(f"Added download: {download.title}")
-    
+
     def pause_download(self, download_id):
-        """Pause a specific download"""
-        self.paused_downloads.add(download_id)
+        """Stop a paused download if it is running here (PAUSED rows are never claimed)"""
+        self._interrupt(download_id, 'paused')
         logging.info(f"Paused download: {download_id}")
-    
+
     def resume_download(self, download_id):
-        """Resume a paused download"""
-        if download_id in self.paused_downloads:
-            self.paused_downloads.remove(download_id)
-            logging.info(f"Resumed download: {download_id}")
-    
+        """Resume a paused download once its row is PENDING again"""
+        self.notify()
+        logging.info(f"Resumed download: {download_id}")
+
+    def prioritize_download(self, download_id):
+        """Reschedule a download whose priority was changed"""
+        # The next refresh sees the bumped updated_at and re-queues it
+        self.notify()
+        logging.info(f"Reprioritized download: {download_id}")
+
     def cancel_download(self, download_id):
-        """Cancel a download"""
-        if download_id in self.paused_downloads:
-            self.paused_downloads.remove(download_id)
-        # Note: If download is currently active, it will complete but won't be re-queued
+        """Stop a cancelled download if it is running here; other processes notice the deleted row"""
+        self._interrupt(download_id, 'cancelled')
         logging.info(f"Cancelled download: {download_id}")
-    
+
+    def bandwidth_limit(self):
+        """Get the global bandwidth limit in bytes/s (None: unlimited)"""
+        setting = db.session.get(Setting, self.BANDWIDTH_SETTING)
+        if setting is None:
+            return parse_rate(os.environ.get('BANDWIDTH_LIMIT'))
+        return int(setting.value) if setting.value else None
+
+    def set_bandwidth_limit(self, rate):
+        """Change the global bandwidth limit for every process; None removes it"""
+        db.session.merge(Setting(key=self.BANDWIDTH_SETTING, value=str(rate) if rate else ''))
+        db.session.commit()
+        # Other processes pick it up on their next heartbeat
+        self._sync_bandwidth()
+        logging.info(f"Bandwidth limit set to {rate or 'unlimited'}")
+
+    def _sync_bandwidth(self):
+        """Take this process' share of the global bandwidth limit
+
+        The limit is split between processes by how many downloads each
+        one is running.
+        """
+        limit = self.bandwidth_limit()
+        share = limit
+        if limit:
+            running = dict(db.session.execute(
+                select(Download.lease_owner, func.count())
+                .where(Download.status == DownloadStatus.DOWNLOADING)
+                .group_by(Download.lease_owner)
+            ).all())
+            total = sum(running.values())
+            if total and running.get(self.worker_id):
+                share = limit * running[self.worker_id] / total
+        db.session.commit()
+        bandwidth.set_global_rate(share)
+
     def is_active(self):
-        """Check if worker is running"""
+        """Check if the worker pool is running"""
         return self.is_running
-    
+
     def queue_size(self):
-        """Get current queue size"""
-        return self.queue.qsize()
-    
-    def get_current_download(self):
-        """Get currently downloading item"""
-        return self.current_download
-    
-    def _update_playlist_progress(self, playlist_id):
-        """Update playlist download progress"""
-        try:
-            playlist = Playlist.query.get(playlist_id)
-            if playlist:
-                completed_count = Download.query.filter_by(
-                    playlist_id=playlist_id,
-                    status=DownloadStatus.COMPLETED
-                ).count()
-                
-                playlist.downloaded_videos = completed_count
-                
-                if completed_count >= playlist.total_videos:
-                    playlist.status = DownloadStatus.COMPLETED
-                elif completed_count > 0:
-                    playlist.status = DownloadStatus.DOWNLOADING
-                
-                db.session.commit()
-        
-        except Exception as e:
-            logging.error(f"Error updating playlist progress: {str(e)}")
+        """Get the number of PENDING downloads across all workers"""
+        return Download.query.filter_by(status=DownloadStatus.PENDING).count()
+
+    def scheduled_size(self):
+        """Get the number of PENDING downloads this process' scheduler holds"""
+        # Not under claim_lock: callers hold a pooled connection, and the
+        # claiming worker may be waiting for one while holding the lock
+        return len(self.scheduler)
+
+    def breaker_stats(self):
+        """Get the state of the per-platform circuit breakers"""
+        return self.breakers.stats()
+
+    def postprocessing_stats(self):
+        """Get the post-processing stage's load"""
+        return postprocessing.stats()
+
+    def get_active_downloads(self):
+        """Get all items downloading in this process"""
+        return list(self.active_downloads.values())
@@ -0,0 +1,282 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from models import Download, StoredFile
+from app import db
+
+class ResultStore:
+    """Content-addressed store of finished downloads
+
+    A result key is (extractor, video id, resolved formats, postprocessing
+    settings). The first download of a key fetches it into the store, where
+    files are named by their content hash; later downloads of the same key
+    finish immediately with a hardlink, and downloads arriving while it is
+    in flight wait for it instead of fetching it again. The pending row in
+    stored_file is the in-flight lock, so this holds across processes.
+    Least recently used results are evicted past max_bytes, and a result
+    goes as soon as the last download linking it is deleted.
+    """
+
+    # Options that change the produced files
+    POSTPROCESS_OPTIONS = ('postprocessors', 'merge_output_format', 'writesubtitles',
+                           'writeautomaticsub', 'subtitleslangs')
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.path.join('downloads', '.store')
+        self.partial_dir = os.path.join(self.root, 'partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.max_bytes = max_bytes or int(os.environ.get('RESULT_CACHE_MAX_BYTES', 50 * 1024 ** 3))
+        # A fetch whose download row vanished is taken over after this long
+        self.orphan_seconds = int(os.environ.get('DOWNLOAD_LEASE_SECONDS', 60))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.followers = 0
+        self.evictions = 0
+
+    def make_key(self, info, ydl_opts):
+        """Result key of an extracted (not yet downloaded) video"""
+        postprocess = {option: ydl_opts.get(option) for option in self.POSTPROCESS_OPTIONS}
+        raw = json.dumps([info.get('extractor_key'), info.get('id'), info.get('format_id'), postprocess],
+                         sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def partial_template(self, key):
+        """outtmpl for fetching a key; stable, so interrupted fetches resume"""
+        return os.path.join(self.partial_dir, f'{key}.%(ext)s')
+
+    def claim(self, key, download_id, wait):
+        """Get the stored result of key, or become the download that fetches it
+
+        Returns a ready StoredFile, or None when the caller must fetch the key
+        and then call store() (or release() if it gives up). While another
+        live download fetches the key, wait(leader_id) is called between
+        checks; it should sleep, and may raise to stop waiting.
+        """
+        followed = False
+        orphaned_at = None
+        while True:
+            stored = db.session.execute(select(StoredFile).where(StoredFile.key == key)).scalar_one_or_none()
+            if stored is None:
+                db.session.add(StoredFile(key=key, owner_id=download_id, ready=False))
+                try:
+                    db.session.commit()
+                    self._count('misses')
+                    return None
+                except IntegrityError:
+                    # Someone else started it first
+                    db.session.rollback()
+                    continue
+
+            if stored.ready:
+                if os.path.exists(stored.path):
+                    self._count('hits')
+                    return stored
+                # Removed from disk behind our back
+                db.session.delete(stored)
+                db.session.commit()
+                continue
+
+            # The leader is alive while its worker holds the lease: a paused or
+            # cancelled leader keeps it until its transfer has stopped writing
+            leader_id = stored.owner_id
+            leader = db.session.execute(
+                select(Download.lease_owner, Download.lease_expires_at).where(Download.id == leader_id)
+            ).first()
+            now = datetime.utcnow()
+            if leader is None:
+                orphaned_at = orphaned_at or now
+                abandoned = (now - orphaned_at).total_seconds() >= self.orphan_seconds
+            else:
+                orphaned_at = None
+                lease_owner, lease_expires_at = leader
+                abandoned = lease_owner is None or lease_expires_at is None or lease_expires_at < now
+            if leader_id == download_id or abandoned:
+                result = db.session.execute(
+                    update(StoredFile)
+                    .where(StoredFile.key == key, StoredFile.owner_id == leader_id, StoredFile.ready.is_(False))
+                    .values(owner_id=download_id)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                if result.rowcount == 1:
+                    self._count('misses')
+                    return None
+                continue
+
+            db.session.commit()
+            if not followed:
+                followed = True
+                self._count('followers')
+            wait(leader_id)
+
+    def store(self, key, download_id, info, filepath, extra_files=None):
+        """Move a fetched result into the store and mark its key ready
+
+        extra_files maps a name suffix (e.g. '.en.vtt') to a file fetched
+        alongside the main one.
+        """
+        content_hash = self._hash_file(filepath)
+        ext = os.path.splitext(filepath)[1]
+        path = self._move_in(filepath, f'{content_hash}{ext}')
+        extras = {suffix: self._move_in(extra, f'{content_hash}{suffix}')
+                  for suffix, extra in (extra_files or {}).items() if os.path.exists(extra)}
+
+        now = datetime.utcnow()
+        db.session.execute(
+            update(StoredFile)
+            .where(StoredFile.key == key)
+            .values(owner_id=None, ready=True, extractor=info.get('extractor_key'), video_id=info.get('id'),
+                    format_id=info.get('format_id'), path=path, content_hash=content_hash,
+                    size=os.path.getsize(path), extras=json.dumps(extras) if extras else None,
+                    created_at=now, last_accessed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        self.evict()
+        return db.session.execute(select(StoredFile).where(StoredFile.key == key)).scalar_one()
+
+    def release(self, key, download_id):
+        """Give up fetching key, so a waiting download can take over"""
+        db.session.execute(
+            delete(StoredFile)
+            .where(StoredFile.key == key, StoredFile.owner_id == download_id, StoredFile.ready.is_(False))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def link(self, stored, directory, basename):
+        """Expose a stored result as directory/basename<ext>; returns the file name and those of its extras"""
+        ext = os.path.splitext(stored.path)[1]
+        filename = self.link_free(stored.path, directory, basename, ext)
+        extra_names = [self.link_free(extra, directory, os.path.splitext(filename)[0], suffix)
+                       for suffix, extra in json.loads(stored.extras or '{}').items() if os.path.exists(extra)]
+
+        db.session.execute(
+            update(StoredFile)
+            .where(StoredFile.key == stored.key)
+            .values(last_accessed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return filename, extra_names
+
+    def evict(self):
+        """Drop least recently used results until the store fits max_bytes
+
+        Downloads linked to an evicted result keep their files; the space is
+        freed once those are deleted too.
+        """
+        total = db.session.execute(
+            select(func.coalesce(func.sum(StoredFile.size), 0)).where(StoredFile.ready.is_(True))
+        ).scalar()
+        if total <= self.max_bytes:
+            return
+
+        candidates = db.session.execute(
+            select(StoredFile).where(StoredFile.ready.is_(True)).order_by(StoredFile.last_accessed_at)
+        ).scalars()
+        for stored in candidates:
+            if total <= self.max_bytes:
+                break
+            total -= stored.size or 0
+            self._drop(stored)
+        db.session.commit()
+
+    def forget(self, keys):
+        """Drop the results of keys that no download links any more; commits
+
+        Their files are the store's hardlinks of deleted downloads, so this
+        is what frees the space of removing a download.
+        """
+        keys = set(keys) - set(db.session.execute(
+            select(Download.result_key).where(Download.result_key.in_(keys))
+        ).scalars()) if keys else set()
+        if keys:
+            for stored in db.session.execute(
+                select(StoredFile).where(StoredFile.key.in_(keys), StoredFile.ready.is_(True))
+            ).scalars().all():
+                self._drop(stored)
+        db.session.commit()
+
+    def key_of(self, path, size):
+        """Key of the stored result path links, for downloads completed before their key was recorded"""
+        if not size or not os.path.exists(path):
+            return None
+        for key, stored_path in db.session.execute(
+            select(StoredFile.key, StoredFile.path).where(StoredFile.size == size, StoredFile.ready.is_(True))
+        ):
+            if stored_path and os.path.exists(stored_path) and os.path.samefile(path, stored_path):
+                return key
+        return None
+
+    def _drop(self, stored):
+        db.session.delete(stored)
+        db.session.flush()
+        # Content can be shared by several keys
+        shared = db.session.execute(
+            select(func.count()).select_from(StoredFile).where(StoredFile.path == stored.path)
+        ).scalar()
+        if not shared:
+            for path in [stored.path, *json.loads(stored.extras or '{}').values()]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._count('evictions')
+        logging.info(f"Evicted stored result {stored.key} ({stored.size} bytes)")
+
+    def stats(self):
+        """Get hit/miss counters"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'followers': self.followers,
+                'evictions': self.evictions,
+            }
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _move_in(self, source, name):
+        target = os.path.join(self.root, name)
+        if os.path.exists(target):
+            # Identical content is already stored
+            os.remove(source)
+        else:
+            os.replace(source, target)
+        return target
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def link_free(source, directory, basename, suffix):
+        """Hardlink source under the first free name (or one already linking it)"""
+        for attempt in range(1000):
+            name = f'{basename}{suffix}' if attempt == 0 else f'{basename} ({attempt}){suffix}'
+            target = os.path.join(directory, name)
+            if os.path.exists(target):
+                if os.path.samefile(source, target):
+                    return name
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                # No hardlinks here (e.g. another filesystem); fall back to a copy
+                shutil.copy2(source, target)
+            return name
+        raise OSError(f'No free file name for {basename}{suffix}')
+
+result_store = ResultStore()
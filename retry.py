@@ -0,0 +1,154 @@
+import os
+import time
+import errno
+import random
+import socket
+import threading
+from http.client import IncompleteRead
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.utils import ContentTooShortError, GeoRestrictedError, UnsupportedError
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 5))
+RETRY_BASE_SECONDS = float(os.environ.get('RETRY_BASE_SECONDS', 30))
+RETRY_MAX_SECONDS = float(os.environ.get('RETRY_MAX_SECONDS', 3600))
+
+# 403 is mostly an expired signed media URL; a retry extracts fresh ones
+RETRYABLE_STATUSES = {403, 408, 425, 429}
+# Platforms pushing back (or down) without an HTTP error yt-dlp kept
+THROTTLE_MARKERS = ('too many requests', 'rate limit', 'rate-limit', 'try again later',
+                    "confirm you're not a bot", 'temporarily unavailable', 'http error 429', 'http error 5')
+NETWORK_MARKERS = ('timed out', 'connection reset', 'connection refused', 'connection aborted',
+                   'temporary failure in name resolution', 'remote end closed connection')
+
+def _causes(error):
+    """An exception and what it wraps: DownloadError.exc_info, ExtractorError.cause, __cause__"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        wrapped = getattr(error, 'exc_info', None)
+        error = (wrapped[1] if wrapped else None) or getattr(error, 'cause', None) or error.__cause__ or error.__context__
+
+def classify_error(error):
+    """Classify a download failure; returns (retryable, label)
+
+    Retryable failures are those a later attempt may not hit: throttling,
+    5xx responses, network trouble, a full disk. Everything else (removed
+    or private videos, unsupported URLs, geo restrictions) is fatal.
+    """
+    for cause in _causes(error):
+        if isinstance(cause, HTTPError):
+            return cause.status in RETRYABLE_STATUSES or cause.status >= 500, f'http_{cause.status}'
+        if isinstance(cause, GeoRestrictedError):
+            return False, 'geo_restricted'
+        if isinstance(cause, UnsupportedError):
+            return False, 'unsupported'
+        if isinstance(cause, (TransportError, ContentTooShortError, IncompleteRead, socket.timeout,
+                              ConnectionError, TimeoutError)):
+            return True, 'network'
+        if isinstance(cause, OSError) and cause.errno == errno.ENOSPC:
+            return True, 'disk_full'
+
+    message = str(error).lower()
+    if any(marker in message for marker in THROTTLE_MARKERS):
+        return True, 'throttled'
+    if any(marker in message for marker in NETWORK_MARKERS):
+        return True, 'network'
+    return False, 'error'
+
+def retry_after(error):
+    """Seconds a 429/503 response asked to wait, if it did"""
+    for cause in _causes(error):
+        if isinstance(cause, HTTPError):
+            value = cause.response.headers.get('Retry-After') or ''
+            return float(value) if value.isdigit() else None
+    return None
+
+def retry_delay(attempts, error):
+    """Seconds until the next attempt after attempts failures, or None to give up
+
+    Exponential backoff with jitter: between half and all of
+    base * 2^(attempts - 1), so a burst of failures doesn't come back as
+    a burst; never sooner than the server's Retry-After.
+    """
+    if attempts >= RETRY_MAX_ATTEMPTS:
+        return None
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    delay = random.uniform(delay / 2, delay)
+    return max(delay, min(retry_after(error) or 0, RETRY_MAX_SECONDS))
+
+class CircuitBreakers:
+    """Per-platform circuit breakers for dispatching downloads
+
+    threshold retryable failures in a row open a platform's breaker: the
+    queue dispatches nothing to it for cooldown seconds. Then one download
+    probes it (half-open); success closes the breaker, failure opens it
+    again for twice as long, up to max_cooldown. Fatal failures say the
+    platform is up and count as successes. State is per process.
+    """
+
+    def __init__(self, threshold=None, cooldown=None, max_cooldown=None):
+        self.threshold = threshold or int(os.environ.get('BREAKER_THRESHOLD', 5))
+        self.cooldown = cooldown or float(os.environ.get('BREAKER_COOLDOWN_SECONDS', 300))
+        self.max_cooldown = max_cooldown or float(os.environ.get('BREAKER_MAX_COOLDOWN_SECONDS', 3600))
+        self.lock = threading.Lock()
+        self.platforms = {}
+        self.trips = 0
+
+    def blocked(self, now=None):
+        """Platforms nothing may be dispatched to right now"""
+        now = now if now is not None else time.monotonic()
+        with self.lock:
+            blocked = set()
+            for platform, breaker in self.platforms.items():
+                if breaker['state'] == 'open' and breaker['open_until'] <= now:
+                    breaker['state'] = 'half_open'
+                    breaker['probing'] = False
+                if breaker['state'] == 'open' or (breaker['state'] == 'half_open' and breaker['probing']):
+                    blocked.add(platform)
+            return blocked
+
+    def started(self, platform):
+        """A download of platform was dispatched; in half-open state it is the probe"""
+        with self.lock:
+            breaker = self.platforms.get(platform)
+            if breaker and breaker['state'] == 'half_open':
+                breaker['probing'] = True
+
+    def record(self, platform, ok):
+        """Record how a download of platform ended; None when it didn't get to tell"""
+        with self.lock:
+            breaker = self.platforms.get(platform)
+            if ok is None:
+                if breaker and breaker['state'] == 'half_open':
+                    # Let another download probe it
+                    breaker['probing'] = False
+                return
+            if ok:
+                self.platforms.pop(platform, None)
+                return
+            if breaker is None:
+                breaker = self.platforms[platform] = {'state': 'closed', 'failures': 0, 'cooldown': self.cooldown}
+            breaker['failures'] += 1
+            if breaker['state'] == 'half_open':
+                breaker['cooldown'] = min(breaker['cooldown'] * 2, self.max_cooldown)
+            elif breaker['state'] != 'closed' or breaker['failures'] < self.threshold:
+                return
+            breaker['state'] = 'open'
+            breaker['open_until'] = time.monotonic() + breaker['cooldown']
+            self.trips += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'trips': self.trips,
+                'platforms': {
+                    platform: {
+                        'state': breaker['state'],
+                        'failures': breaker['failures'],
+                        'retry_in': round(max(breaker.get('open_until', now) - now, 0), 1),
+                    }
+                    for platform, breaker in self.platforms.items()
+                },
+            }
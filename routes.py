@@ -1,15 +1,97 @@
-from flask import render_template, request, jsonify, session, Response
+from flask import render_template, request, jsonify, session, Response, stream_with_context
 from app import app, db
 from models import Download, Playlist, DownloadStatus
-from downloader import VideoDownloader
-from queue_manager import DownloadQueue
+from queue_manager import DownloadQueue, FairScheduler
+from progress import progress_store
+from ingest import PlaylistIngestor
+from extraction import ExtractionPool, ExtractionBusy, ExtractionTimeout
+from metadata_cache import metadata_cache
+from result_store import result_store
+from formats import parse_fields
+from fetcher import parse_fetch_options
+from subtitles import parse_subtitle_langs
+from bandwidth import bandwidth, parse_rate
+from delivery import send_download, open_growing, stream_growing, content_disposition
+from disk_space import disk_space, retention
+from metrics import metrics
+from ydl_pool import ydl_pool
+from playlist_progress import playlist_progress
+import os
 import json
 import uuid
+import time
+import base64
+import hashlib
 import logging
+import mimetypes
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, func, select, update
+
+# Fields served from the in-memory progress registry while a download is active
+LIVE_FIELDS = ('downloaded_bytes', 'file_size', 'download_speed', 'eta', 'status', 'progress')
+
+# /api/downloads page sizes
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Server-sent events tuning
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_STREAM_SECONDS = float(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+SSE_MIN_INTERVAL = float(os.environ.get('SSE_MIN_INTERVAL', 0.5))
+SSE_RETRY_MS = 3000
+# Each open stream holds a web thread (see GUNICORN_THREADS); clients over this get a 503
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 16))
+SSE_BUSY_RETRY_SECONDS = 5
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Served files record their last access at most this often (players send a request per seek)
+ACCESS_RESOLUTION = timedelta(minutes=1)
+
+# Seconds stream requests are asked to wait when the fetch of their download hasn't started
+STREAM_RETRY_SECONDS = 2
 
 # Initialize the download queue
 download_queue = DownloadQueue()
-video_downloader = VideoDownloader()
+# One downloader per process, shared with the queue's workers
+video_downloader = download_queue.downloader
+playlist_ingestor = PlaylistIngestor(download_queue, video_downloader)
+extraction_pool = ExtractionPool(video_downloader)
+
+def _queue_depth():
+    counts = dict(db.session.query(Download.status, func.count(Download.id)).group_by(Download.status).all())
+    return {(status.value,): counts.get(status, 0) for status in DownloadStatus}
+
+# Read when /metrics is scraped
+metrics.gauge('mediatab_downloads', 'Downloads by status, across all processes', ('status',), _queue_depth)
+metrics.gauge('mediatab_workers', 'Download workers of this process', (),
+              lambda: {(): download_queue.num_workers if download_queue.is_active() else 0})
+metrics.gauge('mediatab_workers_busy', 'Download workers of this process running a download', (),
+              lambda: {(): len(download_queue.get_active_downloads())})
+metrics.gauge('mediatab_postprocessing_in_flight', 'Downloads in the post-processing stage', (),
+              lambda: {(): download_queue.postprocessing_stats()['in_flight']})
+metrics.gauge('mediatab_extractions_in_flight', 'API extractions queued or running in this process', (),
+              lambda: {(): extraction_pool.stats()['in_flight']})
+metrics.gauge('mediatab_youtubedl_idle', 'Idle pooled YoutubeDL instances in this process', (),
+              lambda: {(): ydl_pool.stats()['idle']})
+
+def parse_priority(value):
+    """Validate a priority, clamped to the scheduler's range"""
+    try:
+        priority = int(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError('priority must be an integer')
+    return min(max(priority, FairScheduler.MIN_PRIORITY), FairScheduler.MAX_PRIORITY)
+
+def client_session_key():
+    """Stable per-browser key, used to share the queue fairly between clients"""
+    if 'client_id' not in session:
+        session['client_id'] = uuid.uuid4().hex
+    return session['client_id']
+
+def client_address():
+    """Address of the client, for limits that must hold without cookies (see TRUSTED_PROXIES)"""
+    return request.remote_addr or 'unknown'
 
 @app.route('/')
 def index():
@@ -17,7 +99,12 @@ def index():
 
 @app.route('/api/extract_info', methods=['POST'])
 def extract_info():
-    """Extract video/playlist information without downloading"""
+    """Extract video/playlist information without downloading
+
+    Extraction runs on the ExtractionPool: 503 with Retry-After when it is
+    full, 504 when the extraction takes longer than EXTRACT_TIMEOUT (it
+    carries on, and a retry gets the result from the cache).
+    """
     try:
         data = request.get_json()
         url = data.get('url')
@@ -25,16 +112,33 @@ def extract_info():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        info = video_downloader.extract_info(url)
+        try:
+            fields = parse_fields(data.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        info = extraction_pool.extract(url, client_address(), fields=fields)
         return jsonify(info)
     
+    except ExtractionBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+    except ExtractionTimeout as e:
+        return jsonify({'error': str(e)}), 504
+
     except Exception as e:
         logging.error(f"Error extracting info: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/add_download', methods=['POST'])
 def add_download():
-    """Add a new download to the queue"""
+    """Add a new download to the queue
+
+    Single videos that were already analyzed are added right away.
+    Anything else (playlists, or URLs that still need extracting) is ingested
+    in the background; the response carries a job id whose progress is
+    published on /api/progress_stream and available from /api/ingest/<job_id>.
+    """
     try:
         data = request.get_json()
         url = data.get('url')
@@ -44,172 +148,506 @@ def add_download():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        # Extract basic info first
-        info = video_downloader.extract_info(url, extract_flat=True)
+        try:
+            priority = parse_priority(data.get('priority'))
+            fetch_options = parse_fetch_options(data.get('fetch'))
+            subtitle_langs = parse_subtitle_langs(data.get('subtitles'))
+            rate_limit = parse_rate(data.get('rate_limit'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if info.get('_type') == 'playlist':
-            # Handle playlist
-            playlist_id = str(uuid.uuid4())
-            playlist = Playlist(
-                id=playlist_id,
-                title=info.get('title', 'Unknown Playlist'),
-                url=url,
-                platform=info.get('extractor', 'unknown'),
-                total_videos=len(info.get('entries', []))
-            )
-            db.session.add(playlist)
-            
-            # Add individual videos to download queue
-            for idx, entry in enumerate(info.get('entries', [])):
-                if entry:
-                    download = Download(
-                        url=entry.get('url', entry.get('webpage_url')),
-                        title=entry.get('title', f'Video {idx + 1}'),
-                        platform=info.get('extractor', 'unknown'),
-                        format_id=format_id,
-                        quality=quality,
-                        playlist_id=playlist_id,
-                        playlist_index=idx + 1
-                    )
-                    db.session.add(download)
-                    download_queue.add_download(download)
-            
-            db.session.commit()
-            return jsonify({'message': f'Added {len(info.get("entries", []))} videos to download queue', 'playlist_id': playlist_id})
+        # Columns shared by every download this request creates
+        fields = {
+            'format_id': format_id,
+            'quality': quality,
+            'priority': priority,
+            'session_key': client_session_key(),
+            'fetch_options': json.dumps(fetch_options) if fetch_options else None,
+            'subtitle_langs': subtitle_langs,
+            'rate_limit': rate_limit,
+        }
         
-        else:
+        # Usually cached by the preview from /api/extract_info
+        info = metadata_cache.peek(url, extract_flat=True)
+        
+        if info and info.get('type') == 'video':
             # Handle single video
             download = Download(
                 url=url,
                 title=info.get('title', 'Unknown Video'),
                 platform=info.get('extractor', 'unknown'),
-                format_id=format_id,
-                quality=quality
+                **fields
             )
             db.session.add(download)
             db.session.commit()
             
             download_queue.add_download(download)
+            progress_store.publish('status', {'id': download.id, 'status': DownloadStatus.PENDING.value})
             return jsonify({'message': 'Video added to download queue', 'download_id': download.id})
+        
+        job = playlist_ingestor.submit(url, **fields)
+        return jsonify({'message': 'Adding to download queue...', 'job_id': job['id']}), 202
     
     except Exception as e:
         logging.error(f"Error adding download: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ingest/<job_id>')
+def get_ingest_job(job_id):
+    """Get the progress of a background ingestion job"""
+    job = playlist_ingestor.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/playlist/<playlist_id>/progress')
+def get_playlist_progress(playlist_id):
+    """Get a playlist's aggregate progress, from its counters and running entries only"""
+    try:
+        playlist = db.session.get(Playlist, playlist_id)
+        if playlist is None:
+            return jsonify({'error': 'Playlist not found'}), 404
+        return jsonify(playlist_progress.summary(playlist))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def serialize_download(download):
+    """Serialize a Download row, overlaying live fields while it is active"""
+    data = {
+        'id': download.id,
+        'url': download.url,
+        'title': download.title,
+        'platform': download.platform,
+        'quality': download.quality,
+        'file_size': download.file_size,
+        'downloaded_bytes': download.downloaded_bytes,
+        'status': download.status.value,
+        'error_message': download.error_message,
+        'attempts': download.attempts or 0,
+        'next_retry_at': download.next_retry_at.isoformat() if download.next_retry_at else None,
+        'filename': download.filename,
+        'download_speed': download.download_speed,
+        # Rate the download is held to right now, if shaped in this process
+        'effective_rate': bandwidth.effective_rate(download.id),
+        'rate_limit': download.rate_limit,
+        'eta': download.eta,
+        'playlist_id': download.playlist_id,
+        'playlist_index': download.playlist_index,
+        'priority': download.priority or 0,
+        'fetch_options': json.loads(download.fetch_options) if download.fetch_options else None,
+        'subtitle_langs': download.subtitle_langs.split(',') if download.subtitle_langs else [],
+        # Can be played from /api/download/<id>/stream while downloading
+        'streamable': download.stream_path is not None,
+        'download_seconds': download.download_seconds,
+        'postprocess_seconds': download.postprocess_seconds,
+        'created_at': download.created_at.isoformat() if download.created_at else None,
+        'updated_at': download.updated_at.isoformat() if download.updated_at else None,
+        'progress': (download.downloaded_bytes / download.file_size * 100) if download.file_size else 0
+    }
+    # Active downloads report live fields from the registry, not the last flush
+    live = progress_store.get(download.id)
+    if live:
+        for field in LIVE_FIELDS:
+            if field in live:
+                data[field] = live[field]
+    return data
+
+def serialize_playlist(playlist):
+    """Serialize a Playlist row"""
+    return {
+        'id': playlist.id,
+        'title': playlist.title,
+        'url': playlist.url,
+        'platform': playlist.platform,
+        'total_videos': playlist.total_videos,
+        'downloaded_videos': playlist.downloaded_videos,
+        'failed_videos': playlist.failed_videos,
+        'downloaded_bytes': playlist.downloaded_bytes,
+        'total_bytes': playlist.total_bytes,
+        'status': playlist.status.value,
+        'progress': (playlist.downloaded_videos / playlist.total_videos * 100) if playlist.total_videos else 0
+    }
+
+def encode_cursor(download):
+    """Opaque keyset cursor for the (created_at, id) position of a row"""
+    raw = f"{download.created_at.isoformat()}|{download.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on malformed input"""
+    created_at, download_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(download_id)
+
 @app.route('/api/downloads')
 def get_downloads():
-    """Get all downloads with their status"""
-    downloads = Download.query.order_by(Download.created_at.desc()).all()
-    playlists = Playlist.query.order_by(Playlist.created_at.desc()).all()
-    
-    download_data = []
-    for download in downloads:
-        download_data.append({
-            'id': download.id,
-            'url': download.url,
-            'title': download.title,
-            'platform': download.platform,
-            'quality': download.quality,
-            'file_size': download.file_size,
-            'downloaded_bytes': download.downloaded_bytes,
-            'status': download.status.value,
-            'error_message': download.error_message,
-            'filename': download.filename,
-            'download_speed': download.download_speed,
-            'eta': download.eta,
-            'playlist_id': download.playlist_id,
-            'playlist_index': download.playlist_index,
-            'progress': (download.downloaded_bytes / download.file_size * 100) if download.file_size else 0
-        })
-    
-    playlist_data = []
-    for playlist in playlists:
-        playlist_data.append({
-            'id': playlist.id,
-            'title': playlist.title,
-            'url': playlist.url,
-            'platform': playlist.platform,
-            'total_videos': playlist.total_videos,
-            'downloaded_videos': playlist.downloaded_videos,
-            'status': playlist.status.value,
-            'progress': (playlist.downloaded_videos / playlist.total_videos * 100) if playlist.total_videos else 0
-        })
-    
-    return jsonify({
-        'downloads': download_data,
-        'playlists': playlist_data,
+    """Get a page of downloads with their status
+
+    Query parameters: limit, cursor (from next_cursor), status, platform,
+    playlist_id, and updated_since (the server_time of a previous response)
+    to get only rows changed since then. Responses carry an ETag.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        updated_since = request.args.get('updated_since')
+
+        query = Download.query
+        playlist_query = Playlist.query
+        if request.args.get('status'):
+            query = query.filter(Download.status == DownloadStatus(request.args['status']))
+        if request.args.get('platform'):
+            query = query.filter(Download.platform == request.args['platform'])
+        if request.args.get('playlist_id'):
+            query = query.filter(Download.playlist_id == request.args['playlist_id'])
+            playlist_query = playlist_query.filter(Playlist.id == request.args['playlist_id'])
+        if updated_since:
+            updated_since = datetime.fromisoformat(updated_since)
+            query = query.filter(Download.updated_at > updated_since)
+            playlist_query = playlist_query.filter(Playlist.updated_at > updated_since)
+        if cursor:
+            created_at, download_id = decode_cursor(cursor)
+            query = query.filter(or_(
+                Download.created_at < created_at,
+                and_(Download.created_at == created_at, Download.id < download_id)
+            ))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
+    server_time = datetime.utcnow()
+    downloads = query.order_by(Download.created_at.desc(), Download.id.desc()).limit(limit + 1).all()
+    has_more = len(downloads) > limit
+    downloads = downloads[:limit]
+
+    # Playlists are small in number; send them with the first page only
+    playlists = []
+    if not cursor:
+        playlists = playlist_query.order_by(Playlist.created_at.desc()).limit(limit).all()
+
+    # This process' downloads, then those of other processes as tailed from the database
+    active = download_queue.get_active_downloads()
+    local_ids = {download['id'] for download in active}
+    active += [{'id': entry['id'], 'title': entry.get('title'), 'url': entry.get('url')}
+               for entry in progress_store.snapshot() if entry['id'] not in local_ids]
+    progress_store.watch()
+
+    counts = {status.value: count for status, count in
+              db.session.query(Download.status, func.count(Download.id)).group_by(Download.status)}
+
+    response = jsonify({
+        'downloads': [serialize_download(download) for download in downloads],
+        'playlists': [serialize_playlist(playlist) for playlist in playlists],
+        'next_cursor': encode_cursor(downloads[-1]) if has_more else None,
+        'server_time': server_time.isoformat(),
+        'counts': counts,
         'queue_status': {
             'active': download_queue.is_active(),
             'queue_size': download_queue.queue_size(),
-            'current_download': download_queue.get_current_download()
+            'scheduled': download_queue.scheduled_size(),
+            'current_download': active[0] if active else None,
+            'active_downloads': active,
+            'workers': download_queue.num_workers
         }
     })
+    # server_time changes on every call, so hash the payload without it
+    payload = response.get_json()
+    payload.pop('server_time')
+    response.set_etag(hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/download/<int:download_id>/pause', methods=['POST'])
 def pause_download(download_id):
-    """Pause a specific download"""
+    """Pause a specific download, stopping it if it is running"""
     try:
         download = Download.query.get_or_404(download_id)
-        download_queue.pause_download(download_id)
+        if download.status not in (DownloadStatus.PENDING, DownloadStatus.DOWNLOADING):
+            return jsonify({'error': f'Cannot pause a {download.status.value} download'}), 400
         download.status = DownloadStatus.PAUSED
         db.session.commit()
+        download_queue.pause_download(download_id)
+        progress_store.publish('status', {'id': download_id, 'status': download.status.value})
         return jsonify({'message': 'Download paused'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/download/<int:download_id>/resume', methods=['POST'])
 def resume_download(download_id):
-    """Resume a paused download"""
+    """Resume a paused download from where it stopped"""
     try:
         download = Download.query.get_or_404(download_id)
-        download_queue.resume_download(download_id)
+        if download.lease_owner and download.lease_expires_at and download.lease_expires_at > datetime.utcnow():
+            # Its worker has not let go of the .part file yet
+            return jsonify({'error': 'Download is still stopping, try again shortly'}), 409
+        finished = download.status in (DownloadStatus.COMPLETED, DownloadStatus.FAILED)
         download.status = DownloadStatus.PENDING
+        # Resuming by hand runs it now, with a fresh set of retries
+        download.attempts = None
+        download.next_retry_at = None
         db.session.commit()
+        if finished and download.playlist_id:
+            # No longer counted as completed or failed
+            playlist_progress.reconcile([download.playlist_id])
+        download_queue.resume_download(download_id)
+        progress_store.publish('status', {'id': download_id, 'status': download.status.value})
         return jsonify({'message': 'Download resumed'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/download/<int:download_id>/priority', methods=['POST'])
+def set_download_priority(download_id):
+    """Change the priority of a queued download"""
+    try:
+        data = request.get_json() or {}
+        try:
+            priority = parse_priority(data.get('priority'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        download = Download.query.get_or_404(download_id)
+        download.priority = priority
+        db.session.commit()
+        download_queue.prioritize_download(download_id)
+        return jsonify({'message': 'Download priority updated', 'priority': priority})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/download/<int:download_id>/cancel', methods=['DELETE'])
 def cancel_download(download_id):
-    """Cancel and remove a download"""
+    """Cancel and remove a download (and its file, if completed)"""
     try:
         download = Download.query.get_or_404(download_id)
+        retention.remove([download])
         download_queue.cancel_download(download_id)
-        db.session.delete(download)
-        db.session.commit()
+        progress_store.publish('status', {'id': download_id, 'status': 'cancelled'})
         return jsonify({'message': 'Download cancelled'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/download/<int:download_id>/subtitles', methods=['POST'])
+def fetch_download_subtitles(download_id):
+    """Fetch subtitles for a completed download and save them next to its file
+
+    Body: {"languages": ["en", "de"]}; defaults to the languages the download
+    was added with, else English. Tracks are cached per video.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            subtitle_langs = parse_subtitle_langs(data.get('languages'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        download = Download.query.get_or_404(download_id)
+        if download.status != DownloadStatus.COMPLETED or not download.filename:
+            return jsonify({'error': 'Subtitles can be fetched once the download has completed'}), 409
+
+        languages = (subtitle_langs or download.subtitle_langs or 'en').split(',')
+        files = video_downloader.fetch_subtitles(download, languages)
+        return jsonify({'subtitles': files, 'missing': [language for language in languages if language not in files]})
+    except Exception as e:
+        logging.error(f"Error fetching subtitles for download {download_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/download/<int:download_id>/file')
+def download_file(download_id):
+    """Serve the file of a completed download
+
+    Supports Range requests (seeking in the browser) and conditional GETs;
+    ?attachment=1 asks the browser to save it instead of playing it.
+    """
+    try:
+        download = db.session.get(Download, download_id)
+        if download is None:
+            return jsonify({'error': 'Download not found'}), 404
+        if download.status != DownloadStatus.COMPLETED or not download.filename:
+            return jsonify({'error': 'Download has not completed'}), 409
+
+        path = os.path.join(video_downloader.download_dir, download.filename)
+        if not os.path.isfile(path):
+            return jsonify({'error': 'File no longer exists'}), 410
+
+        now = datetime.utcnow()
+        if download.last_accessed_at is None or download.last_accessed_at < now - ACCESS_RESOLUTION:
+            # For retention, which evicts least recently used files; not a change clients need to see
+            db.session.execute(
+                update(Download)
+                .where(Download.id == download_id)
+                .values(last_accessed_at=now, updated_at=Download.updated_at)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        return send_download(path, video_downloader.download_dir, attachment=bool(request.args.get('attachment')))
+    except Exception as e:
+        logging.error(f"Error serving download {download_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/download/<int:download_id>/stream')
+def stream_download(download_id):
+    """Serve a download while it is being fetched
+
+    Single progressive files are sent as their bytes arrive, chunked,
+    continuing into the finished file; completed downloads are served as
+    from /file. Before the fetch starts writing, the answer is a 409 with
+    Retry-After. The stream ends with a broken connection if the download
+    is paused, fails or is cancelled.
+    """
+    try:
+        download = db.session.get(Download, download_id)
+        if download is None:
+            return jsonify({'error': 'Download not found'}), 404
+        stream_path = download.stream_path
+        title = download.title
+
+        if download.status == DownloadStatus.COMPLETED:
+            return download_file(download_id)
+        if download.status != DownloadStatus.DOWNLOADING or not stream_path:
+            return jsonify({'error': 'Download is not being fetched as a single file'}), 409
+        file, part_path = open_growing(stream_path)
+        db.session.commit()
+        if file is None:
+            # Not started yet, or being moved into the result store; no thread waits for it
+            return jsonify({'error': 'Download has not started writing yet, try again shortly'}), 409, \
+                {'Retry-After': str(STREAM_RETRY_SECONDS)}
+        version = -1
+    except Exception as e:
+        logging.error(f"Error streaming download {download_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    def wait(timeout):
+        nonlocal version
+        previous, version = version, progress_store.wait_progress(download_id, version, timeout)
+        return version != previous
+
+    def stopped():
+        status = db.session.execute(select(Download.status).where(Download.id == download_id)).scalar()
+        db.session.commit()
+        return status not in (DownloadStatus.DOWNLOADING, DownloadStatus.POSTPROCESSING, DownloadStatus.COMPLETED)
+
+    ext = os.path.splitext(stream_path)[1]
+    return Response(stream_with_context(stream_growing(file, part_path, wait, stopped)),
+                    mimetype=mimetypes.guess_type(stream_path)[0] or 'application/octet-stream',
+                    direct_passthrough=True, headers={
+                        'Content-Disposition': content_disposition(f'{title or download_id}{ext}', False),
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    })
+
 @app.route('/api/clear_completed', methods=['POST'])
 def clear_completed():
-    """Clear all completed downloads from the list"""
+    """Clear all completed downloads from the list, deleting their files"""
     try:
-        Download.query.filter_by(status=DownloadStatus.COMPLETED).delete()
-        db.session.commit()
+        retention.remove(Download.query.filter_by(status=DownloadStatus.COMPLETED).all())
+        progress_store.publish('status', {'status': 'cleared'})
         return jsonify({'message': 'Completed downloads cleared'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _sse_message(event, data, event_id=None):
+    """Format one server-sent event"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
 @app.route('/api/progress_stream')
 def progress_stream():
-    """Simple progress endpoint for polling"""
+    """Server-sent events stream of progress deltas and status transitions
+
+    The stream is closed after SSE_MAX_STREAM_SECONDS; EventSource reconnects
+    with Last-Event-ID and resumes from the registry's event backlog. At most
+    SSE_MAX_STREAMS are open per process, so streams can't take every web
+    thread; further clients get a 503 with Retry-After.
+    """
+    if not sse_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many progress streams open, try again shortly'}), 503, \
+            {'Retry-After': str(SSE_BUSY_RETRY_SECONDS)}
+
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
     try:
-        current_download = download_queue.get_current_download()
-        if current_download:
-            download = Download.query.get(current_download['id'])
-            if download:
-                data = {
-                    'id': download.id,
-                    'progress': (download.downloaded_bytes / download.file_size * 100) if download.file_size else 0,
-                    'downloaded_bytes': download.downloaded_bytes,
-                    'file_size': download.file_size,
-                    'download_speed': download.download_speed,
-                    'eta': download.eta,
-                    'status': download.status.value
-                }
-                return jsonify(data)
-        return jsonify({'heartbeat': True})
+        cursor = int(last_event_id) if last_event_id else None
+    except ValueError:
+        cursor = None
+
+    def generate():
+        nonlocal cursor
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+
+        if cursor is None:
+            cursor = progress_store.sequence
+            yield _sse_message('snapshot', progress_store.snapshot(), cursor)
+
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            cursor, events, reset = progress_store.wait_events(cursor, SSE_HEARTBEAT_SECONDS)
+            if reset:
+                yield _sse_message('reset', progress_store.snapshot(), cursor)
+            elif not events:
+                yield ": heartbeat\n\n"
+                continue
+
+            for event_id, event, data in events:
+                yield _sse_message(event, data, event_id)
+
+            # Coalesce bursts of hook updates into one batch per interval
+            time.sleep(SSE_MIN_INTERVAL)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Called by the server once the response is done, even if it never started streaming
+    response.call_on_close(sse_slots.release)
+    return response
+
+@app.route('/api/bandwidth', methods=['GET', 'POST'])
+def bandwidth_limit():
+    """Get or change the global bandwidth limit shared by all downloads
+
+    POST {"limit": "5M"} (bytes/s, or null for unlimited). Other processes
+    apply a change within a heartbeat.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                limit = parse_rate(data.get('limit'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            download_queue.set_bandwidth_limit(limit)
+
+        return jsonify({
+            'limit': download_queue.bandwidth_limit(),
+            # This process' share of it and its running downloads
+            'process': bandwidth.stats()
+        })
     except Exception as e:
-        logging.error(f"Progress endpoint error: {str(e)}")
+        logging.error(f"Error updating bandwidth limit: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def get_metrics():
+    """This process' metrics in the Prometheus text format"""
+    body = metrics.render()
+    db.session.commit()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats')
+def get_stats():
+    """Internal counters for the queue and progress persistence"""
+    return jsonify({
+        'progress': progress_store.stats(),
+        'extract_cache': metadata_cache.stats(),
+        'extraction': extraction_pool.stats(),
+        'youtubedl_pool': ydl_pool.stats(),
+        'result_store': result_store.stats(),
+        'bandwidth': bandwidth.stats(),
+        'disk': dict(disk_space.stats(), retention=retention.stats()),
+        'queue': {
+            'workers': download_queue.num_workers,
+            'queue_size': download_queue.queue_size(),
+            'scheduled': download_queue.scheduled_size(),
+            'active': len(download_queue.get_active_downloads()),
+            'postprocessing': download_queue.postprocessing_stats(),
+            'circuit_breakers': download_queue.breaker_stats()
+        }
+    })
@@ -2,6 +2,12 @@ class MediaDownloader {
     constructor() {
         this.currentInfo = null;
         this.eventSource = null;
+        this.currentDownloadId = null;
+        this.downloads = [];
+        this.nextCursor = null;
+        this.playlists = [];
+        this.serverTime = null;
+        this.pollTimer = null;
         this.init();
     }
 
@@ -9,9 +15,6 @@ class MediaDownloader {
         this.setupEventListeners();
         this.loadDownloads();
         this.startProgressStream();
-        
-        // Refresh downloads every 30 seconds
-        setInterval(() => this.loadDownloads(), 30000);
     }
 
     setupEventListeners() {
@@ -39,13 +42,21 @@ class MediaDownloader {
         this.showLoading();
         
         try {
-            const response = await fetch('/api/extract_info', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ url })
-            });
+            let response;
+            // 503: the server is busy extracting, 504: still extracting; both are worth retrying
+            for (let attempt = 0; attempt < 5; attempt++) {
+                response = await fetch('/api/extract_info', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    // Only the format fields the quality picker renders
+                    body: JSON.stringify({ url, fields: ['format_id', 'ext', 'quality', 'filesize', 'height'] })
+                });
+                if (response.status !== 503 && response.status !== 504) break;
+                const wait = parseInt(response.headers.get('Retry-After') || '1', 10);
+                await new Promise(resolve => setTimeout(resolve, wait * 1000));
+            }
 
             const data = await response.json();
             
@@ -227,22 +238,77 @@ class MediaDownloader {
 
     async loadDownloads() {
         try {
+            // Responses carry an ETag, so unchanged pages revalidate as 304s
             const response = await fetch('/api/downloads');
             const data = await response.json();
             
-            this.updateQueueStatus(data.queue_status, data.downloads);
-            this.displayDownloads(data.downloads);
-            this.displayPlaylists(data.playlists);
+            this.downloads = data.downloads;
+            this.playlists = data.playlists;
+            this.nextCursor = data.next_cursor;
+            this.serverTime = data.server_time;
+            this.updateQueueStatus(data.queue_status, data.counts);
+            this.displayDownloads(this.downloads);
+            this.displayPlaylists(this.playlists);
             this.updateCurrentDownload(data.queue_status.current_download);
         } catch (error) {
             console.error('Failed to load downloads:', error);
         }
     }
 
-    updateQueueStatus(queueStatus, downloads) {
+    async pollChanges() {
+        // Without a progress stream: fetch the rows changed since the last response,
+        // and the whole first page now and then (deleted rows don't show up as changes)
+        this.polls = (this.polls || 0) + 1;
+        if (!this.serverTime || this.polls % 10 === 0) {
+            return this.loadDownloads();
+        }
+
+        try {
+            const response = await fetch(`/api/downloads?updated_since=${encodeURIComponent(this.serverTime)}`);
+            const data = await response.json();
+
+            this.serverTime = data.server_time;
+            this.downloads = this.mergeById(this.downloads, data.downloads);
+            this.playlists = this.mergeById(this.playlists, data.playlists);
+            this.updateQueueStatus(data.queue_status, data.counts);
+            this.displayDownloads(this.downloads);
+            this.displayPlaylists(this.playlists);
+            const current = data.queue_status.current_download;
+            const changed = current && data.downloads.find(download => download.id === current.id);
+            this.updateCurrentDownload(current);
+            if (changed) this.updateDownloadProgress(changed);
+        } catch (error) {
+            console.error('Failed to poll downloads:', error);
+        }
+    }
+
+    mergeById(items, changed) {
+        // Changed items replace theirs; new ones go first, as the list is newest first
+        const byId = new Map(changed.map(item => [item.id, item]));
+        const known = new Set(items.map(item => item.id));
+        return changed.filter(item => !known.has(item.id))
+            .concat(items.map(item => byId.get(item.id) || item));
+    }
+
+    async loadMoreDownloads() {
+        if (!this.nextCursor) return;
+
+        try {
+            const response = await fetch(`/api/downloads?cursor=${encodeURIComponent(this.nextCursor)}`);
+            const data = await response.json();
+
+            this.downloads = this.downloads.concat(data.downloads);
+            this.nextCursor = data.next_cursor;
+            this.displayDownloads(this.downloads);
+        } catch (error) {
+            console.error('Failed to load more downloads:', error);
+        }
+    }
+
+    updateQueueStatus(queueStatus, counts) {
         const queueSize = queueStatus.queue_size || 0;
-        const activeCount = downloads.filter(d => d.status === 'downloading').length;
-        const completedCount = downloads.filter(d => d.status === 'completed').length;
+        const activeCount = counts.downloading || 0;
+        const completedCount = counts.completed || 0;
 
         document.getElementById('queueSize').textContent = queueSize;
         document.getElementById('activeDownloads').textContent = activeCount;
@@ -251,6 +317,7 @@ class MediaDownloader {
 
     updateCurrentDownload(currentDownload) {
         const currentDownloadDiv = document.getElementById('currentDownload');
+        this.currentDownloadId = currentDownload ? currentDownload.id : null;
         
         if (currentDownload) {
             document.getElementById('currentTitle').textContent = currentDownload.title;
@@ -282,7 +349,7 @@ class MediaDownloader {
             const progressWidth = Math.round(download.progress || 0);
 
             html += `
-                <div class="card mb-2">
+                <div class="card mb-2" data-download-id="${download.id}">
                     <div class="card-body">
                         <div class="d-flex justify-content-between align-items-start mb-2">
                             <div class="flex-grow-1">
@@ -302,21 +369,21 @@ class MediaDownloader {
                         
                         ${download.status === 'downloading' || download.status === 'completed' ? `
                             <div class="progress mb-2" style="height: 6px;">
-                                <div class="progress-bar ${download.status === 'completed' ? 'bg-success' : ''}" 
+                                <div class="progress-bar download-progress-bar ${download.status === 'completed' ? 'bg-success' : ''}" 
                                      style="width: ${progressWidth}%"></div>
                             </div>
                             <div class="row text-small">
                                 <div class="col-4">
                                     <i class="fas fa-tachometer-alt me-1"></i>
-                                    ${download.download_speed ? this.formatSpeed(download.download_speed) : 'N/A'}
+                                    <span class="download-speed">${download.download_speed ? this.formatSpeed(download.download_speed) : 'N/A'}</span>
                                 </div>
                                 <div class="col-4">
                                     <i class="fas fa-clock me-1"></i>
-                                    ${download.eta ? this.formatTime(download.eta) : 'N/A'}
+                                    <span class="download-eta">${download.eta ? this.formatTime(download.eta) : 'N/A'}</span>
                                 </div>
                                 <div class="col-4">
                                     <i class="fas fa-hdd me-1"></i>
-                                    ${download.file_size ? this.formatFileSize(download.file_size) : 'Unknown'}
+                                    <span class="download-size">${download.file_size ? this.formatFileSize(download.file_size) : 'Unknown'}</span>
                                 </div>
                             </div>
                         ` : ''}
@@ -331,6 +398,16 @@ class MediaDownloader {
             `;
         });
 
+        if (this.nextCursor) {
+            html += `
+                <div class="text-center">
+                    <button class="btn btn-outline-secondary btn-sm" onclick="mediaDownloader.loadMoreDownloads()">
+                        <i class="fas fa-chevron-down me-1"></i>Load more
+                    </button>
+                </div>
+            `;
+        }
+
         downloadsList.innerHTML = html;
     }
 
@@ -384,6 +461,11 @@ class MediaDownloader {
             case 'pending':
             case 'downloading':
                 return `
+                    ${download.streamable && download.status === 'downloading' ? `
+                        <a class="btn btn-outline-primary btn-sm" href="/api/download/${download.id}/stream" target="_blank">
+                            <i class="fas fa-play-circle"></i>
+                        </a>
+                    ` : ''}
                     <button class="btn btn-outline-warning btn-sm" onclick="mediaDownloader.pauseDownload(${download.id})">
                         <i class="fas fa-pause"></i>
                     </button>
@@ -400,6 +482,15 @@ class MediaDownloader {
                         <i class="fas fa-times"></i>
                     </button>
                 `;
+            case 'completed':
+                return `
+                    <a class="btn btn-outline-success btn-sm" href="/api/download/${download.id}/file?attachment=1">
+                        <i class="fas fa-file-download"></i>
+                    </a>
+                    <button class="btn btn-outline-danger btn-sm" onclick="mediaDownloader.cancelDownload(${download.id})">
+                        <i class="fas fa-times"></i>
+                    </button>
+                `;
             case 'failed':
                 return `
                     <button class="btn btn-outline-success btn-sm" onclick="mediaDownloader.resumeDownload(${download.id})">
@@ -434,6 +525,9 @@ class MediaDownloader {
             const response = await fetch(`/api/download/${downloadId}/resume`, { method: 'POST' });
             if (response.ok) {
                 this.loadDownloads();
+            } else {
+                const data = await response.json();
+                this.showError(data.error || 'Failed to resume download');
             }
         } catch (error) {
             this.showError('Failed to resume download');
@@ -454,7 +548,7 @@ class MediaDownloader {
     }
 
     async clearCompleted() {
-        if (!confirm('Are you sure you want to clear all completed downloads?')) return;
+        if (!confirm('Clear all completed downloads? Their files are deleted too.')) return;
         
         try {
             const response = await fetch('/api/clear_completed', { method: 'POST' });
@@ -468,37 +562,104 @@ class MediaDownloader {
     }
 
     startProgressStream() {
-        // Use polling instead of server-sent events to avoid timeout issues
-        this.progressInterval = setInterval(async () => {
-            try {
-                const response = await fetch('/api/progress_stream');
-                if (response.ok) {
-                    const data = await response.json();
-                    if (!data.heartbeat && !data.error) {
-                        this.updateDownloadProgress(data);
-                    }
-                }
-            } catch (error) {
-                console.error('Failed to fetch progress:', error);
+        // Server-sent events: progress deltas and status transitions are pushed,
+        // and EventSource reconnects with Last-Event-ID when the stream closes
+        this.eventSource = new EventSource('/api/progress_stream');
+        this.eventSource.onopen = () => this.stopPolling();
+
+        this.eventSource.addEventListener('snapshot', (e) => {
+            this.applySnapshot(JSON.parse(e.data));
+        });
+
+        this.eventSource.addEventListener('reset', (e) => {
+            this.applySnapshot(JSON.parse(e.data));
+            this.scheduleReload();
+        });
+
+        this.eventSource.addEventListener('progress', (e) => {
+            this.updateDownloadProgress(JSON.parse(e.data));
+        });
+
+        this.eventSource.addEventListener('status', () => {
+            this.scheduleReload();
+        });
+
+        this.eventSource.addEventListener('ingest', (e) => {
+            const job = JSON.parse(e.data);
+            if (job.status === 'failed') {
+                this.showError(`Failed to add ${job.url}: ${job.error}`);
+            } else if (job.status === 'completed' && job.type === 'playlist') {
+                this.showSuccess(`Added ${job.ingested} videos to download queue`);
+            }
+        });
+
+        this.eventSource.onerror = () => {
+            console.error('Progress stream disconnected, reconnecting...');
+            // Turned away (e.g. 503 when the server has too many streams open):
+            // EventSource gives up on error responses, so poll for changes
+            // meanwhile and try a new stream later, spread out between tabs
+            if (this.eventSource.readyState === EventSource.CLOSED) {
+                this.startPolling();
+                clearTimeout(this.streamRetryTimer);
+                this.streamRetryTimer = setTimeout(() => this.startProgressStream(), 15000 + Math.random() * 15000);
             }
-        }, 3000); // Poll every 3 seconds
+        };
+    }
+
+    startPolling() {
+        if (this.pollTimer) return;
+        this.pollTimer = setInterval(() => this.pollChanges(), 3000);
+    }
+
+    stopPolling() {
+        clearInterval(this.pollTimer);
+        this.pollTimer = null;
+    }
+
+    scheduleReload() {
+        // Several transitions often arrive together; reload the list once
+        clearTimeout(this.reloadTimer);
+        this.reloadTimer = setTimeout(() => this.loadDownloads(), 500);
+    }
+
+    applySnapshot(active) {
+        active.forEach(data => this.updateDownloadProgress(data));
+        if (active.length === 0) {
+            this.updateCurrentDownload(null);
+        }
     }
 
     updateDownloadProgress(data) {
-        // Update current download progress
-        if (data.id) {
-            const progressElement = document.getElementById('currentProgress');
-            const progressBarElement = document.getElementById('currentProgressBar');
-            const speedElement = document.getElementById('currentSpeed');
-            const etaElement = document.getElementById('currentEta');
-            const sizeElement = document.getElementById('currentSize');
-
-            if (progressElement) progressElement.textContent = `${Math.round(data.progress || 0)}%`;
-            if (progressBarElement) progressBarElement.style.width = `${Math.round(data.progress || 0)}%`;
-            if (speedElement) speedElement.textContent = this.formatSpeed(data.download_speed);
-            if (etaElement) etaElement.textContent = this.formatTime(data.eta);
-            if (sizeElement) sizeElement.textContent = this.formatFileSize(data.file_size);
+        if (!data.id) return;
+
+        // Update the download's card in the list
+        const card = document.querySelector(`[data-download-id="${data.id}"]`);
+        if (card) {
+            const bar = card.querySelector('.download-progress-bar');
+            const speed = card.querySelector('.download-speed');
+            const eta = card.querySelector('.download-eta');
+            const size = card.querySelector('.download-size');
+
+            if (bar) bar.style.width = `${Math.round(data.progress || 0)}%`;
+            if (speed) speed.textContent = this.formatSpeed(data.download_speed);
+            if (eta) eta.textContent = this.formatTime(data.eta);
+            if (size) size.textContent = this.formatFileSize(data.file_size);
         }
+
+        // Update current download progress (the panel follows one download at a time)
+        if (this.currentDownloadId && this.currentDownloadId !== data.id) return;
+        this.updateCurrentDownload(data);
+        const progressElement = document.getElementById('currentProgress');
+        const progressBarElement = document.getElementById('currentProgressBar');
+        const speedElement = document.getElementById('currentSpeed');
+        const etaElement = document.getElementById('currentEta');
+        const sizeElement = document.getElementById('currentSize');
+
+        if (progressElement) progressElement.textContent = `${Math.round(data.progress || 0)}%`;
+        if (progressBarElement) progressBarElement.style.width = `${Math.round(data.progress || 0)}%`;
+        if (speedElement) speedElement.textContent = this.formatSpeed(data.download_speed);
+        if (etaElement) etaElement.textContent = this.formatTime(data.eta);
+        if (sizeElement) sizeElement.textContent = this.formatFileSize(data.file_size);
     }
 
     // Utility functions
@@ -506,6 +667,7 @@ class MediaDownloader {
         const icons = {
             'pending': '<i class="fas fa-clock"></i>',
             'downloading': '<i class="fas fa-download"></i>',
+            'postprocessing': '<i class="fas fa-cog"></i>',
             'completed': '<i class="fas fa-check"></i>',
             'failed': '<i class="fas fa-exclamation-triangle"></i>',
             'paused': '<i class="fas fa-pause"></i>'
@@ -517,6 +679,7 @@ class MediaDownloader {
         const classes = {
             'pending': 'bg-secondary',
             'downloading': 'bg-primary',
+            'postprocessing': 'bg-info',
             'completed': 'bg-success',
             'failed': 'bg-danger',
             'paused': 'bg-warning'
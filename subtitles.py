@@ -0,0 +1,106 @@
+import os
+import re
+import glob
+import hashlib
+import logging
+from ydl_pool import ydl_pool
+
+# Language codes as yt-dlp takes them ('en', 'pt-BR', 'en.*', 'all')
+LANGUAGE_PATTERN = re.compile(r'^[A-Za-z0-9_.*-]{1,32}$')
+MAX_LANGUAGES = 10
+
+def parse_subtitle_langs(value):
+    """Validate a subtitle language list (list or comma separated string)
+
+    Returns the normalized comma separated form stored on Download, or
+    None when no subtitles are wanted.
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise ValueError('subtitles must be a list of language codes')
+    languages = []
+    for language in value:
+        language = language.strip() if isinstance(language, str) else None
+        if not language or not LANGUAGE_PATTERN.match(language):
+            raise ValueError('subtitles must be language codes such as "en" or "pt-BR"')
+        if language not in languages:
+            languages.append(language)
+    if len(languages) > MAX_LANGUAGES:
+        raise ValueError(f'At most {MAX_LANGUAGES} subtitle languages')
+    return ','.join(languages)
+
+def subtitle_params(langs):
+    """YoutubeDL params that fetch the given (stored) subtitle languages with a download"""
+    if not langs:
+        return {}
+    return {
+        'writesubtitles': True,
+        'writeautomaticsub': True,
+        'subtitleslangs': langs.split(','),
+    }
+
+class SubtitleCache:
+    """Subtitle tracks fetched on demand, cached per video
+
+    Tracks are kept as <video key>.<lang>.<ext> under root, where the
+    video key is derived from the extractor and video id, so asking again
+    for a video (in any format) is served from disk.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join('downloads', '.store', 'subtitles')
+        os.makedirs(self.root, exist_ok=True)
+
+    def video_key(self, extractor_key, video_id):
+        return hashlib.sha256(f'{extractor_key}:{video_id}'.encode()).hexdigest()[:32]
+
+    def cached(self, extractor_key, video_id, languages):
+        """Cached tracks of a video for plain language codes: {lang: path}"""
+        prefix = os.path.join(self.root, self.video_key(extractor_key, video_id))
+        tracks = {}
+        for language in languages:
+            # Patterns such as 'en.*' or 'all' always go to the site
+            if re.fullmatch(r'[A-Za-z0-9_-]+', language):
+                paths = glob.glob(f'{glob.escape(prefix)}.{language}.*')
+                if paths:
+                    tracks[language] = paths[0]
+        return tracks
+
+    def fetch(self, url, languages, extractor_key=None, video_id=None):
+        """Get subtitle tracks for a video, fetching the ones not cached yet
+
+        Returns (extractor_key, video_id, {lang: path}); languages the
+        video has no track for are left out.
+        """
+        tracks = self.cached(extractor_key, video_id, languages) if video_id else {}
+        missing = [language for language in languages if language not in tracks]
+        if not missing:
+            return extractor_key, video_id, tracks
+
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'writesubtitles': True,
+            'writeautomaticsub': True,
+            'subtitleslangs': missing,
+        }
+        with ydl_pool.get(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if info.get('_type') == 'playlist':
+            raise ValueError('Subtitles can only be fetched for single videos')
+        extractor_key, video_id = info.get('extractor_key'), info.get('id')
+        outtmpl = os.path.join(self.root, self.video_key(extractor_key, video_id)) + '.%(ext)s'
+        with ydl_pool.get(dict(ydl_opts, outtmpl=outtmpl)) as ydl:
+            info = ydl.process_ie_result(info, download=True)
+
+        for language, subtitle in (info.get('requested_subtitles') or {}).items():
+            if subtitle.get('filepath') and os.path.exists(subtitle['filepath']):
+                tracks[language] = subtitle['filepath']
+        logging.info(f"Fetched subtitles {', '.join(missing)} for {url}: found {', '.join(tracks) or 'none'}")
+        return extractor_key, video_id, tracks
+
+subtitle_cache = SubtitleCache()
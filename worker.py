@@ -0,0 +1,33 @@
+"""Standalone download worker
+
+Runs a DownloadQueue worker pool without serving HTTP, so downloads can be
+scaled across processes and hosts independently of the web tier:
+
+    RUN_WORKERS=0 gunicorn main:app      # web tier, only queues downloads
+    python worker.py                     # one per worker process/host
+
+All processes must point DATABASE_URL at the same database.
+"""
+import os
+import signal
+import threading
+
+# Importing the app must not start a second pool; main() starts this one
+os.environ['RUN_WORKERS'] = '0'
+
+from app import app  # noqa: F401  (sets up the database)
+
+def main():
+    # Imported here: post-processing children import this module too, and need no queue
+    from routes import download_queue
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+
+    download_queue.start_worker()
+    stop.wait()
+    download_queue.stop_worker()
+
+if __name__ == '__main__':
+    main()
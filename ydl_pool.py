@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from yt_dlp import YoutubeDL
+
+# Options that change from one use to the next; instances are pooled by the rest
+PER_USE_PARAMS = ('progress_hooks', 'throttle', 'outtmpl')
+
+class YoutubeDLPool:
+    """Idle YoutubeDL instances kept for reuse, keyed by their options
+
+    Building a YoutubeDL sets up every extractor (~100 ms) and a fresh set
+    of HTTP handlers, so instead of one per call, instances are checked out
+    exclusively and handed back afterwards, keeping their extractors,
+    cookies and open connections. Options that change per use (progress
+    hooks, throttle, output template) are applied at checkout and cleared
+    on return. An instance whose use raised is closed rather than reused,
+    as it may have stopped halfway. At most size instances are kept idle,
+    the least recently used closed first; a size of 0 disables reuse.
+    """
+
+    def __init__(self, size=None):
+        self.size = int(os.environ.get('YDL_POOL_SIZE', 8)) if size is None else size
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @staticmethod
+    def profile(cls, params):
+        """Key of the instances that can serve params"""
+        options = {option: value for option, value in params.items() if option not in PER_USE_PARAMS}
+        return cls, json.dumps(options, sort_keys=True, default=repr)
+
+    @contextmanager
+    def get(self, params, cls=YoutubeDL):
+        """Check out an instance of cls set up with params, for use as `with pool.get(params) as ydl:`"""
+        key = self.profile(cls, params)
+        ydl = self._take(key)
+        if ydl is None:
+            ydl = cls({option: value for option, value in params.items() if option not in PER_USE_PARAMS})
+            # What the instance set up itself, restored on every checkout
+            ydl.pool_hooks = list(ydl._progress_hooks)
+            ydl.pool_outtmpl = dict(ydl.params['outtmpl'])
+            with self.lock:
+                self.created += 1
+        self._bind(ydl, params)
+        try:
+            yield ydl
+        except BaseException:
+            with self.lock:
+                self.discarded += 1
+            ydl.close()
+            raise
+        self._bind(ydl, {})
+        self._give(key, ydl)
+
+    def _take(self, key):
+        with self.lock:
+            for index in range(len(self.idle) - 1, -1, -1):
+                if self.idle[index][0] == key:
+                    ydl = self.idle[index][1]
+                    del self.idle[index]
+                    self.reused += 1
+                    return ydl
+        return None
+
+    def _give(self, key, ydl):
+        with self.lock:
+            self.idle.append((key, ydl))
+            evicted = [self.idle.popleft()[1] for _ in range(len(self.idle) - self.size)]
+        for ydl in evicted:
+            ydl.close()
+
+    @staticmethod
+    def _bind(ydl, params):
+        ydl._progress_hooks = ydl.pool_hooks + list(params.get('progress_hooks') or [])
+        ydl.params['throttle'] = params.get('throttle')
+        outtmpl = params.get('outtmpl')
+        if outtmpl is None:
+            ydl.params['outtmpl'] = dict(ydl.pool_outtmpl)
+        else:
+            ydl.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else {'default': outtmpl}
+            ydl._parse_outtmpl()
+        # Per-run counters (autonumber, max_downloads, exit code)
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+        if hasattr(ydl, 'reset'):
+            ydl.reset()
+
+    def close(self):
+        """Close every idle instance"""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for _, ydl in idle:
+            ydl.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+            }
+
+ydl_pool = YoutubeDLPool()